@@ -0,0 +1,244 @@
+# Raw Spotify payloads of every pull, archived so a week can be re-processed without the API
+#
+# Each market's pull writes one gzipped JSON lines file to PULL_ARCHIVE_DIR: a header record describing the run,
+# then every playlist / playlist-items response as it came back, and every playlist item read back from the playlist
+# cache instead of the API. `ReplaySpotify` and `ReplayCache` serve a pull from such a file, so the matching and the
+# database write can be re-run without a single network call (see `data_pull.replay_pull`).
+import os
+import gzip
+import json
+import time
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+
+# Directory the archives are written to; empty (the default) to disable archiving. Should be on persistent storage.
+ARCHIVE_DIR = os.getenv('PULL_ARCHIVE_DIR', '')
+
+# Archives older than this are removed whenever a new one is written; 0 to keep them all
+ARCHIVE_MAX_AGE_DAYS = int(os.getenv('PULL_ARCHIVE_MAX_AGE_DAYS', '56'))
+
+# Permissions of a finished archive - its temporary file is created readable by its owner only
+ARCHIVE_FILE_MODE = 0o644
+
+# Spotify client methods whose responses are archived
+ARCHIVED_METHODS = ('playlist', 'playlist_items')
+
+
+class ArchiveMissing(Exception):
+    """Raised when a replayed pull asks for a payload the archive does not hold."""
+
+
+class RunArchive:
+    """
+    Gzipped JSON lines archive of one market's pull. Records can be written from any thread.
+
+    The file is written under a temporary name and only renamed into place by `close()`, so a pull that fails
+    leaves no archive behind (`discard()`).
+
+    Args:
+    - header (dict): Description of the run - market, seed playlist, tracked playlists and upload date.
+    - directory (str): Directory to write the archive to.
+    - max_age_days (int): Age beyond which the directory's archives are pruned on `close()`; 0 to keep them all.
+    """
+
+    def __init__(self, header, directory=ARCHIVE_DIR, max_age_days=ARCHIVE_MAX_AGE_DAYS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_age_days = max_age_days
+        started_at = datetime.now()
+        self.path = os.path.join(directory, f"{header['upload_date']}_{started_at:%Y%m%dT%H%M%S}_{header['market'].lower()}.jsonl.gz")
+        self._temp = tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False)
+        self._file = gzip.open(self._temp, 'wt', compresslevel=6, encoding='utf-8')
+        self._lock = threading.Lock()
+        self.write({'kind': 'run', **header, 'started_at': started_at.isoformat()})
+
+    def write(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        """
+        Finishes the archive, moves it into place and prunes the archives past their maximum age.
+        """
+        self._file.close()
+        self._temp.close()
+        os.chmod(self._temp.name, ARCHIVE_FILE_MODE)
+        os.replace(self._temp.name, self.path)
+        logging.info(f"Archived the pull's Spotify responses to {self.path}.")
+        prune_archives(self.directory, self.max_age_days)
+
+    def discard(self):
+        """
+        Drops the archive of a pull that did not finish.
+        """
+        self._file.close()
+        self._temp.close()
+        os.remove(self._temp.name)
+
+
+def prune_archives(directory=ARCHIVE_DIR, max_age_days=ARCHIVE_MAX_AGE_DAYS):
+    """
+    Removes the archives in `directory` last written more than `max_age_days` ago, along with temporary files left
+    behind by pulls that were killed before they could discard them.
+
+    Args:
+    - directory (str): Directory of the archives.
+    - max_age_days (int): Age beyond which files are removed; 0 to keep them all.
+
+    Returns:
+    - int: Number of files removed.
+    """
+    if not max_age_days:
+        return 0
+    cutoff = time.time() - max_age_days * 24 * 3600
+    removed = 0
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            if entry.name.endswith(('.jsonl.gz', '.tmp')) and entry.stat().st_mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue  # Pruned by another market's pull
+                removed += 1
+    if removed:
+        logging.info(f"Pruned {removed} pull archives older than {max_age_days} days from {directory}.")
+    return removed
+
+
+class ArchivingSpotify:
+    """
+    Wraps a Spotipy client and writes the response of every playlist / playlist-items call to `archive`.
+
+    Args:
+    - sp (spotipy.Spotify): The client to wrap, e.g. a `RateLimitedSpotify`.
+    - archive (RunArchive): The run's archive.
+    """
+
+    def __init__(self, sp, archive):
+        self._sp = sp
+        self.archive = archive
+
+    def __getattr__(self, name):
+        attr = getattr(self._sp, name)
+        if name not in ARCHIVED_METHODS:
+            return attr
+
+        def archived(playlist_id, *args, **kwargs):
+            response = attr(playlist_id, *args, **kwargs)
+            self.archive.write({'kind': 'response', 'method': name, 'playlist_id': playlist_id,
+                                'offset': kwargs.get('offset', 0), 'response': response})
+            return response
+
+        return archived
+
+
+class ArchivingCache:
+    """
+    Wraps a `functions.PlaylistCache` and writes every snapshot ID lookup and every item read from it to `archive`,
+    so a replay takes the same cache hits and misses as the original pull.
+
+    Args:
+    - cache (functions.PlaylistCache): The market's playlist cache.
+    - archive (RunArchive): The run's archive.
+    """
+
+    def __init__(self, cache, archive):
+        self._cache = cache
+        self.archive = archive
+
+    def snapshot_id(self, playlist_id):
+        snapshot_id = self._cache.snapshot_id(playlist_id)
+        self.archive.write({'kind': 'cache_lookup', 'playlist_id': playlist_id, 'snapshot_id': snapshot_id})
+        return snapshot_id
+
+    def items(self, playlist_id):
+        for item in self._cache.items(playlist_id):
+            self.archive.write({'kind': 'cached_item', 'playlist_id': playlist_id, 'item': item})
+            yield item
+
+    def store(self, playlist_id, snapshot_id, items):
+        return self._cache.store(playlist_id, snapshot_id, items)
+
+
+def load_archive(file_path):
+    """
+    Reads a pull's archive.
+
+    Args:
+    - file_path (str): Path of a `.jsonl.gz` archive written by `RunArchive`.
+
+    Returns:
+    - tuple: The run's header (dict), a `ReplaySpotify` and a `ReplayCache` serving the archived payloads.
+    """
+    header = None
+    responses, snapshot_ids, cached_items = {}, {}, {}
+    with gzip.open(file_path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            kind = record['kind']
+            if kind == 'run':
+                header = record
+            elif kind == 'response':
+                responses[(record['method'], record['playlist_id'], record['offset'])] = record['response']
+            elif kind == 'cache_lookup':
+                snapshot_ids[record['playlist_id']] = record['snapshot_id']
+            elif kind == 'cached_item':
+                cached_items.setdefault(record['playlist_id'], []).append(record['item'])
+
+    if header is None:
+        raise ValueError(f"{file_path} is not a pull archive: it has no run header.")
+    logging.info(f"Loaded {len(responses)} archived responses and {sum(map(len, cached_items.values()))} cached items from {file_path}.")
+    return header, ReplaySpotify(responses), ReplayCache(snapshot_ids, cached_items)
+
+
+class ReplaySpotify:
+    """
+    Stands in for the Spotipy client during a replay, answering playlist / playlist-items calls from an archive.
+
+    Args:
+    - responses (dict): (method, playlist ID, offset) -> archived response.
+    """
+
+    def __init__(self, responses):
+        self._responses = responses
+
+    def _get(self, method, playlist_id, offset):
+        try:
+            return self._responses[(method, playlist_id, offset)]
+        except KeyError:
+            raise ArchiveMissing(f"The archive holds no {method} response for playlist {playlist_id} at offset {offset}.") from None
+
+    def playlist(self, playlist_id, fields=None, **kwargs):
+        return self._get('playlist', playlist_id, 0)
+
+    def playlist_items(self, playlist_id, fields=None, offset=0, **kwargs):
+        return self._get('playlist_items', playlist_id, offset)
+
+
+class ReplayCache:
+    """
+    Stands in for the playlist cache during a replay: returns the snapshot IDs and items the original pull read from
+    its cache, and writes nothing.
+
+    Args:
+    - snapshot_ids (dict): Playlist ID -> cached snapshot ID at the time of the pull.
+    - cached_items (dict): Playlist ID -> items the pull read from the cache.
+    """
+
+    def __init__(self, snapshot_ids, cached_items):
+        self._snapshot_ids = snapshot_ids
+        self._cached_items = cached_items
+
+    def snapshot_id(self, playlist_id):
+        return self._snapshot_ids.get(playlist_id)
+
+    def items(self, playlist_id):
+        # A cached playlist without items has no records
+        yield from self._cached_items.get(playlist_id, [])
+
+    def store(self, playlist_id, snapshot_id, items):
+        return items
@@ -0,0 +1,123 @@
+# Benchmark: DataFrame.to_sql vs the COPY + staging merge used by `upsert_coverage`
+#
+# Usage (needs a Postgres database you can create tables in):
+#   DATABASE_URL=postgresql://... python benchmarks/bench_ingest.py --rows 20000
+#
+# Everything runs inside one transaction that is rolled back at the end, so the database is left untouched.
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import COVERAGE_COLUMNS, ROW_COLUMNS, get_database_url, upsert_coverage
+
+BENCH_TABLE = 'coverage_rows_bench'
+BENCH_SNAPSHOT_TABLE = 'playlist_snapshot_bench'
+BENCH_TRACK_TABLE = 'release_track_bench'
+# Tables `upsert_coverage` writes to in the benchmarks
+BENCH_TABLES = {'table': BENCH_TABLE, 'snapshot_table': BENCH_SNAPSHOT_TABLE, 'track_table': BENCH_TRACK_TABLE}
+# The old single wide table, for the to_sql baseline
+TO_SQL_TABLE = 'nmf_spotify_coverage_bench'
+BENCH_DATE = '2024-01-05'
+
+
+def synthetic_week(rows, playlists=60, seed=0):
+    """
+    Builds a week of coverage rows shaped like the real data: every release sits in a handful of playlists.
+    """
+    rng = np.random.default_rng(seed)
+    playlist_names = [f'Playlist {i}' for i in range(playlists)]
+    followers = dict(zip(playlist_names, rng.integers(1_000, 5_000_000, size=playlists)))
+    release_ids = np.arange(rows) // 4
+
+    df = pd.DataFrame({
+        'Date': BENCH_DATE,
+        'Market': 'AU',
+        'Track_ID': [f'{i:022d}' for i in release_ids],
+        'ISRC': [f'AUXX{i:08d}' for i in release_ids],
+        'Artist': [f'Artist {i % 5000}' for i in release_ids],
+        'Title': [f'Title {i}' for i in release_ids],
+        'Playlist': [playlist_names[i % playlists] for i in range(rows)],
+        'Position': rng.integers(1, 100, size=rows),
+    })
+    df['Followers'] = df['Playlist'].map(followers)
+    df['Image_URL'] = 'https://i.scdn.co/image/ab67706f00000002' + df['Playlist'].str.replace(' ', '')
+    df['Cover_Artist'] = 'Cover ' + df['Playlist']
+    return df[COVERAGE_COLUMNS]
+
+
+def create_bench_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE public.{BENCH_TABLE} (
+            "Date" DATE, "Market" TEXT NOT NULL, "Playlist" TEXT, "Track_ID" TEXT, "Position" INTEGER
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE public.{BENCH_TRACK_TABLE} (
+            "Date" DATE, "Market" TEXT, "Track_ID" TEXT, "Artist" TEXT, "Title" TEXT, "ISRC" TEXT,
+            PRIMARY KEY ("Date", "Market", "Track_ID")
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE public.{BENCH_SNAPSHOT_TABLE} (
+            "Date" DATE, "Market" TEXT, "Playlist" TEXT, "Followers" BIGINT, "Image_URL" TEXT, "Cover_Artist" TEXT,
+            PRIMARY KEY ("Date", "Market", "Playlist")
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE public.{TO_SQL_TABLE} (
+            "Date" DATE, "Market" TEXT NOT NULL, "Playlist" TEXT, "Track_ID" TEXT, "ISRC" TEXT, "Artist" TEXT, "Title" TEXT,
+            "Position" INTEGER, "Followers" BIGINT, "Image_URL" TEXT, "Cover_Artist" TEXT
+        )
+    """))
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.3f}s  {result if result is not None else ''}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark to_sql against the COPY-based coverage upsert.')
+    parser.add_argument('--rows', type=int, default=20000, help='Number of coverage rows in the synthetic week')
+    args = parser.parse_args()
+
+    engine = create_engine(get_database_url())
+    df = synthetic_week(args.rows)
+    rows = list(df[ROW_COLUMNS].itertuples(index=False, name=None))
+    print(f"Synthetic week: {len(df):,} rows\n")
+
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            create_bench_table(conn)
+
+            # Baseline: the old full delete + to_sql insert
+            timed('to_sql (default INSERT path)', lambda: df.to_sql(TO_SQL_TABLE, con=conn, schema='public', if_exists='append', index=False) and None)
+
+            # COPY into staging + merge, empty week (every row inserted)
+            timed('upsert_coverage, empty week', lambda: upsert_coverage(conn, rows, BENCH_DATE, **BENCH_TABLES))
+
+            # Same rows again - the common case between Friday runs
+            timed('upsert_coverage, unchanged week', lambda: upsert_coverage(conn, rows, BENCH_DATE, **BENCH_TABLES))
+
+            # 5% of positions move
+            changed_df = df.copy()
+            changed_df.loc[changed_df.sample(frac=0.05, random_state=1).index, 'Position'] += 1
+            changed_rows = list(changed_df[ROW_COLUMNS].itertuples(index=False, name=None))
+            timed('upsert_coverage, 5% changed', lambda: upsert_coverage(conn, changed_rows, BENCH_DATE, **BENCH_TABLES))
+        finally:
+            trans.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Benchmark: peak memory of the streaming pull as the tracked playlists grow
+#
+# Usage:
+#   python benchmarks/bench_memory.py --playlists 30 --tracks 250 1000 4000
+#   DATABASE_URL=postgresql://... python benchmarks/bench_memory.py --database
+#
+# For every playlist size M the pull runs against the local API stand-in twice - with an empty playlist cache, then
+# with the cache from the first run - and the tracemalloc peak is reported next to the number of items fetched.
+# The streaming pull should stay flat as M grows. The 'materialised' row fetches every playlist's full track list
+# first (`materialised_positions`), as the pull did before, for comparison.
+#
+# With --database the rows are written with `upsert_coverage` into a scratch table, inside a transaction that is
+# rolled back; otherwise they are only counted.
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_spotify import FakeSpotify, NMF_PLAYLIST_ID, synthetic_fixtures
+from bench_ingest import BENCH_DATE, BENCH_TABLES, create_bench_table
+from data_pull import collect_coverage
+from database import get_database_url, upsert_coverage
+from functions import (build_track_index, fetch_playlists_concurrently, get_playlist_snapshot, iter_playlist_items,
+                       iter_tracks, match_positions, PlaylistCache)
+from rate_limit import RateLimitedSpotify, RequestScheduler
+
+
+def measure(func):
+    """
+    Runs `func` with tracemalloc on and returns (seconds, peak MiB, result).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    # The pull's progress prints would interleave with the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20, result
+
+
+def materialised_positions(sp, track_details, playlists_dict, max_workers):
+    """
+    The matching as the pull did it before the rows were streamed: every tracked playlist's full track list is
+    fetched and held in memory, then matched against the NMF tracks.
+
+    Returns:
+    - dict: Track ID -> the track's names and the playlists and positions it was found at.
+    """
+    def fetch(sp, playlist_id):
+        return list(iter_tracks(iter_playlist_items(sp, playlist_id)))
+
+    playlists_tracks = fetch_playlists_concurrently(fetch, sp, playlists_dict, max_workers)
+
+    track_index = build_track_index(track_details)
+    track_positions = {
+        track_id: {'track_id': track_id, 'track_name': name, 'artist_name': artist, 'isrc': isrc, 'playlists': []}
+        for track_id, name, artist, isrc in track_index[0].values()
+    }
+    for playlist_name, playlist_tracks in playlists_tracks.items():
+        for track_id, position in match_positions(track_index, playlist_tracks):
+            track_positions[track_id]['playlists'].append({'playlist': playlist_name, 'position': position})
+    return track_positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Peak memory of the streaming pull for growing playlists.')
+    parser.add_argument('--playlists', type=int, default=30, help='Number of tracked playlists (N)')
+    parser.add_argument('--tracks', type=int, nargs='+', default=[250, 1000, 4000], help='Tracks per playlist (M), one run each')
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--database', action='store_true', help='Write the rows with upsert_coverage (needs DATABASE_URL)')
+    args = parser.parse_args()
+
+    engine = None
+    if args.database:
+        from sqlalchemy import create_engine
+        engine = create_engine(get_database_url())
+
+    print(f"{args.playlists} playlists, max_workers {args.max_workers}, rows {'written to Postgres' if engine else 'counted'}\n")
+    print(f"{'tracks':>6} {'items':>9} {'pipeline':<14} {'seconds':>8} {'peak MiB':>9} {'rows':>6}")
+
+    for m_tracks in args.tracks:
+        # Fixtures are built before tracing starts, so only the pull's own allocations are measured
+        fixtures = synthetic_fixtures(args.playlists, m_tracks)
+        playlists_dict = fixtures['playlists_dict']
+        total_items = sum(len(playlist['items']) for playlist in fixtures['playlists'].values())
+        cache_dir = tempfile.mkdtemp()
+
+        with FakeSpotify(fixtures) as stub:
+            client = stub.client(max_workers=args.max_workers)
+
+            def scheduled():
+                return RateLimitedSpotify(client, RequestScheduler(rate=1000, max_rate=1000, burst=args.max_workers,
+                                                                   call_budget=None))
+
+            def materialised():
+                sp = scheduled()
+                seed = get_playlist_snapshot(sp, NMF_PLAYLIST_ID)
+                track_positions = materialised_positions(sp, seed['tracks'], playlists_dict, args.max_workers)
+                return sum(len(track['playlists']) for track in track_positions.values())
+
+            def streamed():
+                rows = collect_coverage(scheduled(), playlists_dict, NMF_PLAYLIST_ID, PlaylistCache(cache_dir))
+                if engine is None:
+                    return sum(1 for _ in rows)
+                return write(engine, rows)
+
+            for label, func in [('materialised', materialised), ('stream, cold', streamed), ('stream, cached', streamed)]:
+                elapsed, peak, row_count = measure(func)
+                print(f"{m_tracks:>6} {total_items:>9,} {label:<14} {elapsed:>8.3f} {peak:>9.2f} {row_count:>6}")
+
+
+def write(engine, rows):
+    """
+    Streams `rows` into a scratch coverage table and rolls the write back. Returns the number of rows written.
+    """
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            create_bench_table(conn)
+            return upsert_coverage(conn, rows, BENCH_DATE, **BENCH_TABLES)['inserted']
+        finally:
+            trans.rollback()
+
+
+if __name__ == "__main__":
+    main()
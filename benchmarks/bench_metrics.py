@@ -0,0 +1,109 @@
+# Benchmark: the single-pass weekly summaries of metrics.py vs the per-metric groupby / iterrows version they replaced
+#
+# Usage:
+#   python benchmarks/bench_metrics.py --rows 2000 20000 200000 --repeat 5
+#
+# Runs on synthetic weeks (see bench_ingest.synthetic_week), so no database is needed. Every size also checks that both
+# versions produce the same summaries, up to the order of ties.
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_ingest import synthetic_week
+from metrics import NMF_PLAYLIST_NAME, TOP_REACH_SIZE, WEEK_COLUMNS, _number, weekly_summary
+
+
+def legacy_weekly_summary(df, nmf_playlist=NMF_PLAYLIST_NAME):
+    """
+    The weekly summaries as computed before: one groupby per metric and iterrows to build the lists.
+    """
+    reach = df.groupby(['Title', 'Artist'])['Followers'].sum()
+    adds = df.groupby(['Title', 'Artist']).size()
+    avg_position = df.groupby(['Title', 'Artist'])['Position'].mean()
+    max_reach, max_adds, min_avg_position = reach.max(), adds.max(), avg_position.min()
+
+    def releases(grouped, value):
+        pairs = [(artist, title) for title, artist in grouped[grouped == value].index]
+        return sorted(pairs, key=lambda pair: f"{pair[0]} - '{pair[1]}'")
+
+    top_reach = df.groupby(['Artist', 'Title']).agg({
+        'Followers': 'sum',
+        'Playlist': lambda x: list(x.unique())
+    }).sort_values(by='Followers', ascending=False).head(TOP_REACH_SIZE)
+
+    nmf_rows = df[df['Playlist'] == nmf_playlist]
+    nmf_cover = None
+    if not nmf_rows.empty and pd.notna(nmf_rows['Image_URL'].iloc[0]):
+        cover_artist = nmf_rows['Cover_Artist'].iloc[0]
+        nmf_cover = {'image_url': nmf_rows['Image_URL'].iloc[0],
+                     'cover_artist': cover_artist if pd.notna(cover_artist) else None}
+
+    covers = df.dropna(subset=['Cover_Artist', 'Image_URL']).groupby('Playlist').agg({
+        'Image_URL': 'first',
+        'Cover_Artist': 'first'
+    }).reset_index()
+
+    adds_per_playlist = df.dropna(subset=['Artist', 'Title'])['Playlist'].value_counts() \
+        .reindex(df['Playlist'].unique(), fill_value=0).sort_values()
+
+    return {
+        'highest_reach': {'reach': _number(max_reach), 'releases': releases(reach, max_reach)},
+        'most_added': {'count': int(max_adds) if pd.notna(max_adds) else None, 'releases': releases(adds, max_adds)},
+        'highest_average_position': {'position': _number(min_avg_position),
+                                     'releases': releases(avg_position, min_avg_position)},
+        'top_reach': [{'artist': artist, 'title': title, 'followers': _number(row['Followers']),
+                       'playlists': list(row['Playlist'])}
+                      for (artist, title), row in top_reach.iterrows()],
+        'nmf_cover': nmf_cover,
+        'cover_artists': [{'playlist': row['Playlist'], 'cover_artist': row['Cover_Artist'], 'image_url': row['Image_URL']}
+                          for _, row in covers.iterrows()],
+        'adds_by_playlist': [[playlist, int(count)] for playlist, count in adds_per_playlist.items()],
+    }
+
+
+def same_summaries(legacy, summary):
+    # Playlists tied on adds may come out in either order
+    def comparable(summary):
+        return {**summary, 'top_reach': None,
+                'adds_by_playlist': sorted(summary['adds_by_playlist'], key=lambda row: (row[1], row[0]))}
+
+    # Releases tied on reach at the end of the Top 5 may be picked in either order - same reaches, and the same
+    # playlists for the releases both picked
+    legacy_top = {(row['artist'], row['title']): row for row in legacy['top_reach']}
+    same_top = [row['followers'] for row in legacy['top_reach']] == [row['followers'] for row in summary['top_reach']] \
+        and all(legacy_top[key] == row for row in summary['top_reach'] if (key := (row['artist'], row['title'])) in legacy_top)
+    return same_top and comparable(legacy) == comparable(summary)
+
+
+def timed(func, df, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(df)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the weekly summaries on synthetic weeks.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[2000, 20000, 200000], help='Coverage rows per synthetic week')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per size; the best time is reported')
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'legacy':>10} {'single pass':>12} {'speed-up':>9}  same")
+    for rows in args.rows:
+        df = synthetic_week(rows)[WEEK_COLUMNS]
+        legacy_seconds, legacy = timed(legacy_weekly_summary, df, args.repeat)
+        seconds, summary = timed(weekly_summary, df, args.repeat)
+        same = same_summaries(legacy, summary)
+        print(f"{rows:>8,} {legacy_seconds:>9.3f}s {seconds:>11.3f}s {legacy_seconds / seconds:>8.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
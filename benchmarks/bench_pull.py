@@ -0,0 +1,91 @@
+# Benchmark: offline end-to-end pull (Spotify fetch -> matching -> coverage rows) against the local API stand-in
+#
+# Usage:
+#   python benchmarks/bench_pull.py --playlists 30 --tracks 150 --latency-ms 30
+#   python benchmarks/bench_pull.py --fixtures fixtures.json --rate-limit-every 50
+#
+# Each run reports wall time, API calls, 429s retried by the request scheduler, bytes received and tracemalloc peak. The first run starts with an empty
+# playlist cache; later runs show the snapshot_id cache at work.
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_spotify import FakeSpotify, NMF_PLAYLIST_ID, synthetic_fixtures
+from data_pull import collect_coverage
+from functions import PlaylistCache
+from rate_limit import RateLimitedSpotify, RequestScheduler
+import instrumentation
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the data pull against the local Spotify API stand-in.')
+    parser.add_argument('--fixtures', help='Recorded fixtures JSON (default: synthetic)')
+    parser.add_argument('--playlists', type=int, default=30, help='Synthetic: number of tracked playlists (N)')
+    parser.add_argument('--tracks', type=int, default=150, help='Synthetic: tracks per playlist (M)')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Latency added to every API response')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='Answer every Nth request with a 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=50, help='Starting request rate of the scheduler (requests/s)')
+    parser.add_argument('--max-rate', type=float, default=200, help='Ceiling of the adaptive request rate')
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--stages', action='store_true', help='Print the per-stage metrics of every run')
+    args = parser.parse_args()
+
+    if args.fixtures:
+        with open(args.fixtures) as file:
+            fixtures = json.load(file)
+    else:
+        fixtures = synthetic_fixtures(args.playlists, args.tracks)
+
+    playlists_dict = fixtures['playlists_dict']
+    total_items = sum(len(playlist['items']) for playlist in fixtures['playlists'].values())
+    print(f"{len(fixtures['playlists'])} playlists, {total_items:,} items, latency {args.latency_ms:g}ms, "
+          f"max_workers {args.max_workers}\n")
+    print(f"{'run':>3} {'seconds':>8} {'api calls':>9} {'429s':>5} {'retries':>7} {'KiB recv':>9} {'peak MiB':>9} {'rows':>6}")
+
+    cache_dir = tempfile.mkdtemp()
+
+    with FakeSpotify(fixtures, latency=args.latency_ms / 1000, page_size=args.page_size,
+                     rate_limit_every=args.rate_limit_every, retry_after=args.retry_after) as stub:
+        client = stub.client(max_workers=args.max_workers)
+
+        for run in range(1, args.runs + 1):
+            stub.reset_counters()
+            # One scheduler per run, as in data_pull()
+            request_scheduler = RequestScheduler(rate=args.rate, max_rate=args.max_rate, burst=args.max_workers)
+            sp = RateLimitedSpotify(client, request_scheduler)
+            tracemalloc.start()
+            start = time.perf_counter()
+
+            # The pull's progress prints would interleave with the report
+            with contextlib.redirect_stdout(io.StringIO()), instrumentation.collect(trace_memory=True) as metrics:
+                row_count = sum(1 for _ in collect_coverage(sp, playlists_dict, NMF_PLAYLIST_ID, PlaylistCache(cache_dir)))
+
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            # The stage metrics reset the traced peak at every stage boundary, so the run's peak is the highest of theirs
+            peak = max([peak] + [stage['peak_memory_bytes'] for stage in metrics.snapshot()])
+
+            print(f"{run:>3} {elapsed:>8.3f} {stub.api_calls:>9} {stub.calls['429']:>5} {request_scheduler.retries:>7} "
+                  f"{stub.bytes_sent / 1024:>9.1f} {peak / 2**20:>9.1f} {row_count:>6}")
+            if args.stages:
+                for stage in metrics.snapshot():
+                    print(f"      {stage['stage']:<15} {stage['seconds']:>8.3f}s {stage['api_calls']:>5} calls "
+                          f"{stage['retries']:>3} retries {stage['bytes_received'] / 1024:>9.1f} KiB "
+                          f"{stage['peak_memory_bytes'] / 2**20:>7.1f} MiB peak")
+
+
+if __name__ == "__main__":
+    main()
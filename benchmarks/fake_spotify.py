@@ -0,0 +1,343 @@
+# Local stand-in for the parts of the Spotify Web API the data pull uses:
+#   POST /api/token                      client-credentials token
+#   GET  /v1/playlists/{id}              playlist object with the first page of items
+#   GET  /v1/playlists/{id}/tracks       further pages of items (offset / limit)
+#
+# Responses come from recorded or synthetically generated fixtures, with configurable latency, page size and 429 injection.
+#
+# Usage:
+#   python benchmarks/fake_spotify.py serve --playlists 30 --tracks 150 --port 8099
+#   python benchmarks/fake_spotify.py serve --fixtures fixtures.json --port 8099
+#   python benchmarks/fake_spotify.py record fixtures.json      (needs CLIENT_ID / CLIENT_SECRET)
+#
+# Point the worker at a running stand-in with:
+#   SPOTIFY_API_URL=http://127.0.0.1:8099/v1/ SPOTIFY_TOKEN_URL=http://127.0.0.1:8099/api/token
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# New Music Friday AU & NZ - the seed playlist of the pull
+NMF_PLAYLIST_ID = '37i9dQZF1DWT2SPAYawYcO'
+NMF_PLAYLIST_NAME = 'New Music Friday AU & NZ'
+
+
+def _spotify_id(rng):
+    return ''.join(rng.choice('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(22))
+
+
+def synthetic_fixtures(n_playlists, m_tracks, nmf_tracks=100, nmf_share=0.3, seed=0):
+    """
+    Generates fixtures for `n_playlists` tracked playlists of `m_tracks` items each, plus the NMF seed playlist.
+
+    Args:
+    - n_playlists (int): Number of tracked playlists besides NMF.
+    - m_tracks (int): Number of items in each tracked playlist.
+    - nmf_tracks (int): Number of items in the NMF seed playlist.
+    - nmf_share (float): Share of each tracked playlist's items that are NMF releases.
+    - seed (int): Random seed, so runs are reproducible.
+
+    Returns:
+    - dict: {'playlists_dict': {name: id}, 'playlists': {id: playlist object with an 'items' list}}
+    """
+    rng = random.Random(seed)
+
+    def track(i):
+        return {
+            'id': _spotify_id(rng),
+            'name': f'Song {i}',
+            'artists': [{'name': f'Artist {i % 997}'}] + ([{'name': f'Feature {i % 89}'}] if i % 5 == 0 else []),
+            'external_ids': {'isrc': f'AUXX2400{i:04d}'},
+        }
+
+    nmf = [track(i) for i in range(nmf_tracks)]
+    catalog = [track(i) for i in range(nmf_tracks, nmf_tracks + max(m_tracks * 4, 1000))]
+
+    def playlist(name, tracks):
+        return {
+            'name': name,
+            'snapshot_id': _spotify_id(rng),
+            'followers': {'total': rng.randint(1_000, 2_000_000)},
+            'images': [{'url': f'https://i.scdn.co/image/{_spotify_id(rng)}', 'height': 640, 'width': 640}],
+            'description': f'The freshest tracks, updated weekly. Cover: Artist {rng.randint(0, 996)}',
+            'items': [{'track': t} for t in tracks],
+        }
+
+    playlists_dict = {NMF_PLAYLIST_NAME: NMF_PLAYLIST_ID}
+    playlists = {NMF_PLAYLIST_ID: playlist(NMF_PLAYLIST_NAME, nmf)}
+
+    for i in range(n_playlists):
+        n_nmf = min(int(m_tracks * nmf_share), len(nmf))
+        tracks = rng.sample(nmf, n_nmf) + rng.sample(catalog, m_tracks - n_nmf)
+        rng.shuffle(tracks)
+        playlist_id = _spotify_id(rng)
+        playlists_dict[f'Playlist {i + 1}'] = playlist_id
+        playlists[playlist_id] = playlist(f'Playlist {i + 1}', tracks)
+
+    return {'playlists_dict': playlists_dict, 'playlists': playlists}
+
+
+def record_fixtures(sp, playlists_dict, seed_playlist_id=NMF_PLAYLIST_ID):
+    """
+    Records the tracked playlists from the live API into the fixture format served by `FakeSpotify`.
+
+    Args:
+    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
+    - playlists_dict (dict): A dictionary mapping playlist names to their Spotify IDs.
+    - seed_playlist_id (str): The seed playlist, recorded even if it is not in `playlists_dict`.
+
+    Returns:
+    - dict: {'playlists_dict': {name: id}, 'playlists': {id: playlist object with an 'items' list}}
+    """
+    from functions import PLAYLIST_ITEMS_FIELDS
+
+    playlist_ids = dict(playlists_dict)
+    if seed_playlist_id not in playlist_ids.values():
+        playlist_ids[NMF_PLAYLIST_NAME] = seed_playlist_id
+
+    playlists = {}
+    for playlist_name, playlist_id in playlist_ids.items():
+        playlist = sp.playlist(playlist_id, fields='name,followers.total,images,description,snapshot_id')
+        items = []
+        results = sp.playlist_items(playlist_id, fields=PLAYLIST_ITEMS_FIELDS)
+        while results:
+            items.extend(results['items'])
+            results = sp.next(results) if results['next'] else None
+        playlist['items'] = items
+        playlists[playlist_id] = playlist
+
+    return {'playlists_dict': playlists_dict, 'playlists': playlists}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stub.record_bytes(len(body))
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if urlparse(self.path).path != '/api/token':
+            return self._send_json(404, {'error': 'not found'})
+        stub.record_call('token')
+        self._send_json(200, {'access_token': 'fake-token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        if stub.should_rate_limit():
+            stub.record_call('429')
+            return self._send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                                   headers={'Retry-After': str(stub.retry_after)})
+
+        match = re.fullmatch(r'/v1/playlists/([^/]+)(/tracks)?', url.path)
+        if not match or match.group(1) not in stub.playlists:
+            stub.record_call('404')
+            return self._send_json(404, {'error': {'status': 404, 'message': 'Resource not found'}})
+
+        playlist_id, is_items = match.group(1), bool(match.group(2))
+        playlist = stub.playlists[playlist_id]
+
+        if is_items:
+            stub.record_call('playlist_items')
+            offset = int(query.get('offset', ['0'])[0])
+            limit = min(int(query.get('limit', [str(stub.page_size)])[0]), stub.page_size)
+            return self._send_json(200, stub.items_page(playlist_id, offset, limit))
+
+        stub.record_call('playlist')
+        payload = {key: value for key, value in playlist.items() if key != 'items'}
+        payload['id'] = playlist_id
+        # A fields projection without 'tracks' is a metadata-only request
+        fields = query.get('fields', [''])[0]
+        if not fields or 'tracks' in fields:
+            payload['tracks'] = stub.items_page(playlist_id, 0, stub.page_size)
+        self._send_json(200, payload)
+
+
+class FakeSpotify:
+    """
+    Threaded local HTTP server serving playlist fixtures in the shape of the Spotify Web API.
+
+    Args:
+    - fixtures (dict): Output of `synthetic_fixtures` or `record_fixtures`.
+    - latency (float): Seconds added to every API response.
+    - page_size (int): Maximum number of items per page.
+    - rate_limit_every (int): Answer every Nth API request with a 429 (0 disables injection).
+    - retry_after (int): Retry-After seconds sent with injected 429s.
+    - host (str), port (int): Address to listen on. Port 0 picks a free port.
+    """
+
+    def __init__(self, fixtures, latency=0.0, page_size=100, rate_limit_every=0, retry_after=1, host='127.0.0.1', port=0):
+        self.playlists = fixtures['playlists']
+        self.playlists_dict = fixtures['playlists_dict']
+        self.latency = latency
+        self.page_size = page_size
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self._requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self):
+        return f'{self.base_url}/v1/'
+
+    @property
+    def token_url(self):
+        return f'{self.base_url}/api/token'
+
+    @property
+    def api_calls(self):
+        """Number of Web API requests served, including injected 429s but not token requests."""
+        return sum(count for name, count in self.calls.items() if name != 'token')
+
+    def record_call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def record_bytes(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = Counter()
+            self.bytes_sent = 0
+
+    def should_rate_limit(self):
+        with self._lock:
+            self._requests += 1
+            return bool(self.rate_limit_every) and self._requests % self.rate_limit_every == 0
+
+    def items_page(self, playlist_id, offset, limit):
+        items = self.playlists[playlist_id]['items']
+        has_next = offset + limit < len(items)
+        return {
+            'href': f'{self.api_url}playlists/{playlist_id}/tracks?offset={offset}&limit={limit}',
+            'items': items[offset:offset + limit],
+            'limit': limit,
+            'offset': offset,
+            'total': len(items),
+            'next': f'{self.api_url}playlists/{playlist_id}/tracks?offset={offset + limit}&limit={limit}' if has_next else None,
+            'previous': None,
+        }
+
+    def client(self, max_workers=8, token_cache_path=None):
+        """
+        Returns a Spotipy client pointed at this server. Like `functions.get_spotify_client`, it leaves 429s to the
+        caller - wrap it in a `rate_limit.RateLimitedSpotify`.
+        """
+        import tempfile
+        from functions import build_spotify_client, SCHEDULED_RETRY_CODES
+
+        token_cache_path = token_cache_path or os.path.join(tempfile.mkdtemp(), 'token')
+        return build_spotify_client('fake-client-id', 'fake-client-secret', max_workers=max_workers,
+                                    token_cache_path=token_cache_path, api_url=self.api_url, token_url=self.token_url,
+                                    retry_status_codes=SCHEDULED_RETRY_CODES)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Spotify API stand-in for offline pull benchmarks.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help='Serve recorded or synthetic fixtures')
+    serve.add_argument('--fixtures', help='Recorded fixtures JSON (default: synthetic)')
+    serve.add_argument('--playlists', type=int, default=30, help='Synthetic: number of tracked playlists')
+    serve.add_argument('--tracks', type=int, default=150, help='Synthetic: tracks per playlist')
+    serve.add_argument('--latency-ms', type=float, default=0, help='Latency added to every API response')
+    serve.add_argument('--page-size', type=int, default=100)
+    serve.add_argument('--rate-limit-every', type=int, default=0, help='Answer every Nth request with a 429')
+    serve.add_argument('--retry-after', type=int, default=1)
+    serve.add_argument('--port', type=int, default=8099)
+    serve.add_argument('--write-playlists', help='Write the served playlists dict to this path (for PLAYLISTS_PATH)')
+
+    record = subparsers.add_parser('record', help='Record the tracked playlists from the live API')
+    record.add_argument('output', help='Fixtures JSON to write')
+    record.add_argument('--playlists-file', default='playlists.json')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        from functions import get_spotify_client, load_playlists
+        from rate_limit import RateLimitedSpotify, RequestScheduler
+
+        sp = RateLimitedSpotify(get_spotify_client(), RequestScheduler())
+        fixtures = record_fixtures(sp, load_playlists(args.playlists_file))
+        with open(args.output, 'w') as file:
+            json.dump(fixtures, file)
+        print(f"Recorded {len(fixtures['playlists'])} playlists to {args.output}")
+        return
+
+    if args.fixtures:
+        with open(args.fixtures) as file:
+            fixtures = json.load(file)
+    else:
+        fixtures = synthetic_fixtures(args.playlists, args.tracks)
+
+    if args.write_playlists:
+        with open(args.write_playlists, 'w') as file:
+            json.dump(fixtures['playlists_dict'], file, indent=4)
+
+    stub = FakeSpotify(fixtures, latency=args.latency_ms / 1000, page_size=args.page_size,
+                       rate_limit_every=args.rate_limit_every, retry_after=args.retry_after, port=args.port)
+    print(f"Serving {len(fixtures['playlists'])} playlists at {stub.api_url} (token: {stub.token_url})")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
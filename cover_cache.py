@@ -0,0 +1,210 @@
+# Thumbnail cache of the playlist cover art shown on the pages
+#
+# Covers are full-size i.scdn.co images. `CoverCache` downloads each unique URL once, shrinks it to the size the pages
+# show it at and keeps it on disk, evicting the least recently used thumbnails once the cache outgrows its size
+# budget. Pages hand `st.image` the local file. The cache is warmed with a week's covers (`warm_cover_cache`) when the
+# home page loads it - or, when the worker shares the directory with the pages, by the worker right after the pull -
+# so visitors do not wait on Spotify's CDN one cover at a time.
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from io import BytesIO
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+
+# Directory of the thumbnails; empty to disable the cache (the pages then show the original URLs)
+COVER_CACHE_DIR = os.getenv('COVER_CACHE_DIR', 'cover_cache')
+
+# Set to 1 when COVER_CACHE_DIR is shared by the worker and the web processes (e.g. a mounted volume) - only then is
+# the worker's warm-up visible to the pages. Heroku dynos each have their own filesystem.
+COVER_CACHE_SHARED = os.getenv('COVER_CACHE_SHARED', '0') == '1'
+
+# Size budget of the directory - least recently used thumbnails are removed beyond it
+COVER_CACHE_MAX_BYTES = int(os.getenv('COVER_CACHE_MAX_MB', '50')) * 2**20
+
+# Longest side of a thumbnail in pixels - twice the 300px the pages show, for high-density screens
+THUMBNAIL_SIZE = 600
+
+# (connect, read) timeouts of a download, so a slow CDN never blocks a page for long
+DOWNLOAD_TIMEOUT = (3, 10)
+
+# Covers downloaded at the same time by `prefetch`
+PREFETCH_WORKERS = 8
+
+
+class CoverCache:
+    """
+    Size-bounded LRU disk cache of cover thumbnails, one JPEG per image URL. Safe to use from several threads.
+
+    Recency is the file's modification time, refreshed on every hit, so it survives restarts and is shared by every
+    process using the same directory.
+
+    Args:
+    - directory (str): Directory of the thumbnails. Created on the first write.
+    - max_bytes (int): Size budget of the directory.
+    - size (int): Longest side of a thumbnail in pixels.
+    """
+
+    def __init__(self, directory=COVER_CACHE_DIR, max_bytes=COVER_CACHE_MAX_BYTES, size=THUMBNAIL_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = size
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.jpg')
+
+    def get(self, url):
+        """
+        Returns the path of the thumbnail of `url`, downloading and resizing the image if it is not cached yet.
+
+        Args:
+        - url (str): URL of the cover image.
+
+        Returns:
+        - str: Path of the thumbnail, or None if the image could not be downloaded or decoded.
+        """
+        if not url:
+            return None
+        path = self._path(url)
+        try:
+            os.utime(path)  # Hit: mark as recently used
+            return path
+        except FileNotFoundError:
+            pass
+
+        try:
+            response = self._session.get(url, timeout=DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+            image = Image.open(BytesIO(response.content)).convert('RGB')
+            image.thumbnail((self.size, self.size))
+        except Exception as e:
+            logging.warning(f"Could not load cover image {url}: {e}")
+            return None
+
+        # Written under a temporary name, so a reader never sees half a file
+        os.makedirs(self.directory, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False)
+        try:
+            with file:
+                image.save(file, format='JPEG', quality=85, optimize=True)
+            os.replace(file.name, path)
+        except OSError as e:
+            logging.warning(f"Could not store the thumbnail of {url}: {e}")
+            os.remove(file.name)
+            return None
+
+        self.evict()
+        return path
+
+    def prefetch(self, urls, max_workers=PREFETCH_WORKERS):
+        """
+        Loads the thumbnails of `urls` concurrently.
+
+        Args:
+        - urls (iterable): Cover image URLs. Duplicates and empty values are skipped.
+        - max_workers (int): Maximum number of downloads at the same time.
+
+        Returns:
+        - dict: URL -> path of its thumbnail, or None if it could not be loaded.
+        """
+        unique_urls = list(dict.fromkeys(url for url in urls if url))
+        if not unique_urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_urls))) as executor:
+            return dict(zip(unique_urls, executor.map(self.get, unique_urls)))
+
+    def evict(self):
+        """
+        Removes the least recently used thumbnails until the directory fits its size budget.
+
+        Returns:
+        - int: Number of thumbnails removed.
+        """
+        with self._lock:
+            entries = []
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith('.jpg'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # Evicted by another process
+                total -= size
+                removed += 1
+        return removed
+
+
+@lru_cache(maxsize=None)
+def get_cover_cache():
+    """
+    Returns the process-wide cover cache, or None if COVER_CACHE_DIR is empty.
+    """
+    return CoverCache() if COVER_CACHE_DIR else None
+
+
+def cover_image(url):
+    """
+    Returns what the pages should hand `st.image` for one cover: the cached thumbnail, or the original URL if the
+    cache is disabled.
+
+    Returns:
+    - str: Thumbnail path or URL, or None if the image could not be loaded.
+    """
+    cache = get_cover_cache()
+    return cache.get(url) if cache else url
+
+
+def cover_images(urls):
+    """
+    Returns what the pages should hand `st.image` for each cover: the cached thumbnail, or the original URL if the
+    cache is disabled or the thumbnail could not be loaded.
+
+    Args:
+    - urls (iterable): Cover image URLs.
+
+    Returns:
+    - dict: URL -> thumbnail path or URL.
+    """
+    cache = get_cover_cache()
+    urls = [url for url in urls if url]
+    thumbnails = cache.prefetch(urls) if cache else {}
+    return {url: thumbnails.get(url) or url for url in urls}
+
+
+def warm_cover_cache(urls):
+    """
+    Loads the thumbnails of a week's covers. Never raises.
+
+    Args:
+    - urls (iterable): Cover image URLs of the week.
+
+    Returns:
+    - int: Number of thumbnails available.
+    """
+    cache = get_cover_cache()
+    if cache is None:
+        return 0
+    try:
+        thumbnails = cache.prefetch(urls)
+    except Exception as e:
+        logging.warning(f"Could not warm the cover cache: {e}")
+        return 0
+    loaded = sum(path is not None for path in thumbnails.values())
+    logging.info(f"Cover cache warmed with {loaded} of {len(thumbnails)} cover images.")
+    return loaded
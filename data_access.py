@@ -0,0 +1,158 @@
+# Database access for the Streamlit pages
+#
+# Every page used to build its own engine at the top of the script, so every rerun of every session opened a new
+# connection pool. The pages now share one engine per process (`get_engine`, held by `st.cache_resource`) and read
+# the data through the query functions below. Caching the results stays with the pages, which know how fresh each
+# widget needs to be.
+import os
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import create_engine, text
+
+from database import (DEFAULT_MARKET, WEEKS_TABLE, TOP_PERFORMERS_TABLE, RELEASE_ARTIST_TABLE, COMPARISON_ARTISTS_TABLE,
+                      COVERAGE_TABLE, get_database_url, load_weekly_summary)
+from metrics import load_week, weekly_summary
+
+
+# Connections kept open per process, and extra ones opened under load. Heroku's smaller Postgres plans allow 20
+# connections in total, shared with the worker and every web dyno.
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '3'))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '2'))
+
+# Seconds to wait for a free connection before the page errors out
+POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '10'))
+
+# Queries running longer than this are cancelled by Postgres, so a slow query cannot hold a connection forever
+STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '15000'))
+
+
+@st.cache_resource
+def get_engine():
+    """
+    Returns the process-wide engine shared by every page and session.
+
+    Connections are checked before use (`pool_pre_ping`), so one dropped by Postgres or Heroku between Friday
+    mornings is replaced instead of failing the page, and recycled after an hour.
+
+    Returns:
+    - sqlalchemy.engine.Engine: The engine.
+    """
+    return create_engine(
+        get_database_url(),
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        connect_args={'options': f'-c statement_timeout={STATEMENT_TIMEOUT_MS}'},
+    )
+
+
+def _read_frame(sql, params=None):
+    with get_engine().connect() as connection:
+        result = connection.execute(text(sql), params or {})
+        return pd.DataFrame(result.fetchall(), columns=result.keys())
+
+
+def fetch_latest_week(market=DEFAULT_MARKET):
+    """
+    Returns the most recent week in the weeks catalog, or None if there is none yet.
+    """
+    with get_engine().connect() as connection:
+        return connection.execute(text(f"""
+            SELECT MAX(upload_date) FROM public.{WEEKS_TABLE} WHERE market = :market
+        """), {'market': market}).scalar()
+
+
+def fetch_weeks(market=DEFAULT_MARKET):
+    """
+    Returns the weeks in the weeks catalog, most recent first.
+
+    Returns:
+    - list: datetime.date of every week.
+    """
+    with get_engine().connect() as connection:
+        return connection.execute(text(f"""
+            SELECT upload_date FROM public.{WEEKS_TABLE} WHERE market = :market ORDER BY upload_date DESC
+        """), {'market': market}).scalars().all()
+
+
+def fetch_data_version(market=DEFAULT_MARKET):
+    """
+    Returns the time of the worker's latest write, for invalidating cached page data.
+    """
+    with get_engine().connect() as connection:
+        return connection.execute(text(f"""
+            SELECT MAX(updated_at) FROM public.{WEEKS_TABLE} WHERE market = :market
+        """), {'market': market}).scalar()
+
+
+def fetch_week(upload_date, market=DEFAULT_MARKET):
+    """
+    Loads one week's summaries and coverage rows.
+
+    Args:
+    - upload_date (str or datetime.date): The week.
+    - market (str): Market code, e.g. 'AU'.
+
+    Returns:
+    - tuple: The week's summary (dict, see `metrics.weekly_summary`) and its rows (pd.DataFrame).
+    """
+    with get_engine().connect() as connection:
+        # Summaries precomputed by the worker for the metrics, charts and covers (see metrics.py)
+        summary = load_weekly_summary(connection, upload_date, market)
+        # The week's rows, for the search widgets
+        week_df = load_week(connection, upload_date, market)
+    # Weeks the worker has not summarised yet
+    if summary is None:
+        summary = weekly_summary(week_df)
+    return summary, week_df
+
+
+def fetch_top_performers(market=DEFAULT_MARKET, limit=10):
+    """
+    Returns the all-time top weekly performers by reach. Releases tied with the last one are included, like
+    RANK() <= limit.
+
+    Returns:
+    - pd.DataFrame: Date, Artist, Title, playlists (newline separated) and total_followers.
+    """
+    return _read_frame(f"""
+        SELECT upload_date AS "Date", artist AS "Artist", title AS "Title", playlists, total_followers
+        FROM public.{TOP_PERFORMERS_TABLE}
+        WHERE market = :market
+        ORDER BY total_followers DESC
+        FETCH FIRST :limit ROWS WITH TIES
+    """, {'market': market, 'limit': limit})
+
+
+def fetch_comparison_artists(market=DEFAULT_MARKET):
+    """
+    Returns the artists with more than one release, sorted alphabetically ignoring case.
+
+    Returns:
+    - dict: Artist key -> correctly stylised name.
+    """
+    with get_engine().connect() as connection:
+        return dict(connection.execute(text(f"""
+            SELECT artist_key, artist_name FROM public.{COMPARISON_ARTISTS_TABLE}
+            WHERE market = :market
+            ORDER BY lower(artist_name)
+        """), {'market': market}).fetchall())
+
+
+def fetch_artist_releases(artist_key, market=DEFAULT_MARKET):
+    """
+    Returns the coverage rows of every release an artist is credited on.
+
+    Returns:
+    - pd.DataFrame: Date, Title, Playlist, Position and Followers.
+    """
+    return _read_frame(f"""
+        SELECT c."Date", c."Title", c."Playlist", c."Position", c."Followers"
+        FROM public.{RELEASE_ARTIST_TABLE} r
+        JOIN public.{COVERAGE_TABLE} c
+          ON c."Date" = r.upload_date AND c."Market" = r.market AND c."Artist" = r.artist AND c."Title" = r.title
+        WHERE r.market = :market AND r.artist_key = :artist_key
+    """, {'market': market, 'artist_key': artist_key})
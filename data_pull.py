@@ -1,297 +1,164 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import pandas as pd
-from functions import get_playlist_tracks_and_artists, find_tracks_positions_in_playlists
-import json
-import re
-import logging 
+from database import get_database_url, upsert_coverage, refresh_top_performers, record_week, refresh_release_artists, refresh_comparison_artists, load_cover_image_urls, try_pull_lock, release_pull_lock, start_pull_run, finish_pull_run, save_stage_metrics
+from rate_limit import RequestScheduler, RateLimitedSpotify, DEFAULT_RATE, MAX_RATE
+from polling import AdaptivePoller, changed_playlists, POLL_BASE_MINUTES, PULL_SKIPPED, TIMEZONE
+from functions import configure_logging, get_spotify_client, load_markets, market_cache_dir, get_playlist_snapshot, get_playlist_matches, iter_playlists_concurrently, build_track_index, match_positions, parse_cover_artist, PlaylistCache, PLAYLIST_CACHE_DIR
+from metrics import refresh_weekly_summary
+from cover_cache import COVER_CACHE_SHARED, warm_cover_cache
+from archive import RunArchive, ArchivingSpotify, ArchivingCache, load_archive, ARCHIVE_DIR
+import instrumentation
+import logging
 import os
-from datetime import datetime
-from sqlalchemy import create_engine, text
+import sys
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-import psycopg2
+from sqlalchemy import create_engine
 from apscheduler.schedulers.blocking import BlockingScheduler
-from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import pytz
 
 
-def schedule():
-    print(f"Automated Data Pull executed at {datetime.now(pytz.timezone('Australia/Sydney'))}")
-    scheduler = BlockingScheduler(timezone="Australia/Sydney")
-
-    # Define scheduler timings
-    cron_timings = [
-        ('fri', [(0, 1), (0, 15), (0, 45), (0, 52), (1, 0), (1, 30), (2, 0), (2, 30), (3, 0), (4, 0), (5, 0), (6, 0), (7, 0), (8, 0), (8, 15), (8, 45), (9, 0), (9, 30), (9, 55), (10, 0), (10, 10), (10, 15), (11, 0), (12, 30), (15, 0), (15, 1), (15, 4), (15, 8), (15, 9), (15, 20), (15, 30), (16, 0), (17, 0), (22, 0), (23, 19)]),
-        ('sat', [(6, 0), (19, 23)]),
-        ('sun', [(6, 0)]),
-        ('mon', [(6, 0), (7, 0), (7, 30), (8, 0), (8, 30), (9, 0), (9, 15), (9, 30), (9, 45), (10, 0), (11, 0), (12, 0), (14, 0)]),
-        ('tue', [(6, 0), (18, 40)]),
-        ('wed', [(20, 47)])
-    ]
-
-    # Add jobs using loop
-    for day, times in cron_timings:
-        for hour, minute in times:
-            scheduler.add_job(data_pull, CronTrigger(day_of_week=day, hour=hour, minute=minute))
+def check_for_changes():
+    """
+    Polls the snapshot IDs of every enabled market's tracked playlists and seed playlist.
 
-    try:
-        scheduler.start()
-    except (KeyboardInterrupt, SystemExit):
-        pass
+    Returns:
+    - list: Names of the playlists that changed since the last pull, prefixed with their market.
+    """
+    sp = RateLimitedSpotify(get_spotify_client(), RequestScheduler())
 
+    changed = []
+    for market, profile in load_markets().items():
+        playlists_dict = profile['playlists']
+        if profile['seed_playlist'] not in playlists_dict.values():
+            playlists_dict = {**playlists_dict, f"{market} seed playlist": profile['seed_playlist']}
+        changed += [f"{market}: {name}" for name in changed_playlists(sp, playlists_dict, market_cache_dir(market))]
+    return changed
 
 
-'''
 def schedule():
     print(f"Automated Data Pull executed at {datetime.now(pytz.timezone('Australia/Sydney'))}")
     scheduler = BlockingScheduler(timezone="Australia/Sydney")
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=0, minute=1))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=0, minute=15))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=0, minute=45))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=0, minute=52))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=1, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=1, minute=30))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=2, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=2, minute=30))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=3, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=4, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=5, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=6, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=7, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=8, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=8, minute=15))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=8, minute=45))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=9, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=9, minute=30))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=9, minute=55))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=10, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=10, minute=10))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=10, minute=15))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=11, minute=00))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=12, minute=30))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=15, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=15, minute=1))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=15, minute=4))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=15, minute=8))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=15, minute=9))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=15, minute=20))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=15, minute=30))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=16, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=17, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=22, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='fri', hour=22, minute=35))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='sat', hour=6, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='sun', hour=6, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=6, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=7, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=7, minute=30))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=8, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=8, minute=30))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=9, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=9, minute=15))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=9, minute=30))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=9, minute=45))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=10, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=11, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=12, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='mon', hour=14, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='tue', hour=6, minute=0))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='tue', hour=18, minute=40))
-    scheduler.add_job(data_pull, CronTrigger(day_of_week='wed', hour=20, minute=47))
+
+    # Polls snapshot IDs and runs the full pull only when something changed - see polling.py for the intervals
+    poller = AdaptivePoller(
+        check=check_for_changes,
+        pull=run_pull,
+        week_of=get_upload_date,
+        clock=lambda: datetime.now(TIMEZONE),
+    )
+
+    def poll():
+        # The next poll is scheduled relative to the end of this one
+        minutes = poller.poll()
+        scheduler.reschedule_job('poll', trigger=IntervalTrigger(minutes=minutes))
+
+    # First poll straight away
+    scheduler.add_job(poll, IntervalTrigger(minutes=POLL_BASE_MINUTES), id='poll', next_run_time=datetime.now(TIMEZONE),
+                      max_instances=1, coalesce=True)
 
     try:
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
         pass
-'''
 
-def data_pull():
-    # data pull logic and database upload below
 
-    # # Fetch credentials via environment variables
-    CLIENT_ID = os.getenv('CLIENT_ID')
-    CLIENT_SECRET = os.getenv('CLIENT_SECRET')
+# New Music Friday AU & NZ playlist - every release added to it is checked against the tracked playlists
+NMF_PLAYLIST_ID = '37i9dQZF1DWT2SPAYawYcO'
 
-    # Load list of playlists from JSON file
-    with open('playlists.json', 'r') as file:
-        playlists_dict = json.load(file)
 
-    # Initialise the Spotify client with client credentials for public data access
-    client_credentials_manager = SpotifyClientCredentials(client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
-    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+def collect_coverage(sp, playlists_dict, playlist_id=NMF_PLAYLIST_ID, playlist_cache=None):
+    """
+    Fetches the tracked playlists and yields this week's coverage rows: one row per NMF release per playlist it was
+    added to, plus one row per cover-artist playlist without any NMF adds.
 
-    # Configure logging to file
-    logging.basicConfig(filename='log.txt', level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s',
-                        datefmt='%A %Y-%m-%d %H:%M:%S')  # Custom date format
+    The rows are produced as the playlists come in - each playlist's pages are matched against the NMF tracks while
+    they stream in and only the matches are kept - so the playlists' track lists are never held in memory.
 
-    # New Music Friday AU & NZ playlist 
-    playlist_id = '37i9dQZF1DWT2SPAYawYcO'
+    Args:
+    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
+    - playlists_dict (dict): A dictionary mapping playlist names to their Spotify IDs.
+    - playlist_id (str): The Spotify ID of the seed playlist (New Music Friday AU & NZ).
+    - playlist_cache (PlaylistCache, optional): Snapshot IDs and playlist items kept between runs. Defaults to the
+      cache in PLAYLIST_CACHE_DIR.
 
+    Yields:
+    - tuple: A coverage row, with values in the order of `database.ROW_COLUMNS`.
+    """
     print('Fetching Spotify data...')
-    
-    # Fetches track names and artist names from New Music Friday AU & NZ
-    # Returns a list of tuples, each containing a track name and concatenated artist names.
-    # Example, [('Foam', 'Royel Otis'),('One More Night', 'KUČKA, Flume')]
-    track_details = get_playlist_tracks_and_artists(sp, playlist_id)
-    print(f'Fetched {len(track_details)} track details from New Music Friday AU & NZ playlist.')
-    
-    # Uses`track_details` from above and `playlists_dict' (loaded JSON file)
-    # Finds the positions of each track in multiple playlists
-    track_positions = find_tracks_positions_in_playlists(sp, track_details, playlists_dict)
-    print(f'Track positions in other playlists found for {len(track_positions)} tracks.')
-    
-    
-    # Fetching playlist follower counts
-    # Dictionary to store follower counts
-    playlist_followers = {}
-
-    # Fetching follower counts
-    for playlist_name, playlist_id in playlists_dict.items():
-        playlist = sp.playlist(playlist_id)
-        follower_count = playlist['followers']['total']
-        playlist_followers[playlist_name] = follower_count
-        
-    logging.info("Playlist followers data fetched successfully")
-
-    # Create and save fetched data as a DataFrame
-    rows = []
-
-    for _, track_info in track_positions.items():
-        artist_name = track_info['artist_name']
-        track_name = track_info['track_name']
-        for playlist_info in track_info['playlists']:
-            playlist_name = playlist_info['playlist']
-            position = playlist_info['position']
-            # Fetch the follower count using the playlist name
-            followers = playlist_followers.get(playlist_name, 0)  # Default to 0 if playlist not found
-            rows.append({
-                'Artist': artist_name,
-                'Title': track_name,
-                'Playlist': playlist_name,
-                'Position': position,
-                'Followers': followers
-            })
-
-    # Convert the list of rows into a DataFrame
-    df = pd.DataFrame(rows)
-    # Get the unique values from the 'Playlist' column
-    unique_playlists_in_df = df['Playlist'].unique()
-    logging.info("Initial DataFrame created successfully ")
-    
-    for playlist in unique_playlists_in_df:
-        logging.info(f'Unique Playlist In First DF: {playlist}')
-
-
-    # Start collecting data for the Cover Art and Cover Artist info
-    #Fetch Playlist image URLs
-    cover_art_dict = {}
-
-    for playlist_name, playlist_id in playlists_dict.items():
-
-        playlist_data = sp.playlist(playlist_id)
-
-        # Fetching playlist cover image URL
-        cover_image_url = playlist_data['images'][0]['url'] if playlist_data['images'] else 'No image available'
-
-        # append to dictionary 
-        cover_art_dict[playlist_name] = cover_image_url
-    logging.info("Cover image URLs returned successfuly")
-
-    # Fetch cover artist details 
-    # Initialise a dictionary to store playlist name and playlist cover artist details 
-    cover_artist_dict = {}
-
-    for playlist_name, playlist_id in playlists_dict.items():
-        # Fetch playlist data from Spotify
-        playlist = sp.playlist(playlist_id)
-
-        # Extract the required information
-        playlist_description = playlist.get('description', 'No description available')
-
-        # Define regex patterns
-        # Case-insensitive 
-        patterns = [
-            r'cover:\s*(.*?)$',  # Pattern for "Cover: artist_name"
-            r'\.\s*([^\.]+)$'    # Pattern for "sentence. artist_name", as a fallback
-        ]
-
-        cover_artist = None
-        for pattern in patterns:
-            match = re.search(pattern, playlist_description, re.IGNORECASE)
-            if match:
-                cover_artist = match.group(1).strip()
-                if cover_artist and cover_artist.lower() != "no cover artist found":
-                    cover_artist_dict[playlist_name] = cover_artist
-                    break  # If a valid cover artist is found, stop looking through other patterns
-    logging.info("Cover artist details returned successfully  ")
-
-    #Remove Image URLs from `cover_art_dict` that don't have a Cover Artist. Only Cover Art featuring an artist is useful. 
-    # Create a new dictionary that will only include matching keys
-    filtered_cover_art_dict = {}
-
-    # Loop through the cover_art_dict
-    for playlist_name in cover_art_dict:
-        # Check if the current key also exists in cover_artist_dict
-        if playlist_name in cover_artist_dict:
-            # Add it to the new dictionary
-            filtered_cover_art_dict[playlist_name] = cover_art_dict[playlist_name]
-    logging.info("Non-cover artist covers removed successfully")
-
-    # Create variable for all cover_info data
-    cover_info_data = {
-        'filtered_cover_art_dict': filtered_cover_art_dict,
-        'cover_artist_dict': cover_artist_dict
-    }
-    # logging.info("cover_info_data collected successfully. Details: %s", str(cover_info_data))
-
-    cover_info_df = pd.DataFrame({
-            'Playlist': list(cover_info_data['filtered_cover_art_dict'].keys()),
-            'Cover Art URL': list(cover_info_data['filtered_cover_art_dict'].values()),
-            'Featured Artist': list(cover_info_data['cover_artist_dict'].values())
-        })
-    unique_playlists = cover_info_df['Playlist'].unique().tolist()
-    
-    for playlist in unique_playlists:
-        logging.info(f"Unique playlist with cover art and artist details: {playlist}")
-
-    todays_date = datetime.today()
-    formatted_date = todays_date.strftime('%Y-%m-%d') # Format the date as a string in 'YYYY-MM-DD' format
-
-    df.insert(0, 'Date', formatted_date)
-    cover_info_df.insert(0, 'Date', formatted_date)
-
-    merged_df = pd.merge(df, cover_info_df, on=['Date', 'Playlist'], how='outer')
-
-    # rename columns to match DB 
-    rename_mapping = {
-        'Date': 'Date',
-        'Artist' : 'Artist',
-        'Title' : 'Title',
-        'Playlist' : 'Playlist',
-        'Position' : 'Position',
-        'Followers' : 'Followers',
-        'Cover Art URL' : 'Image_URL',
-        'Featured Artist' : 'Cover_Artist'
-        }
-
-    merged_df.rename(columns=rename_mapping, inplace=True)
-
-    # Convert the DataFrame 'Date' column to datetime and format it as needed
-    merged_df['Date'] = pd.to_datetime(merged_df['Date']).dt.strftime('%Y-%m-%d')
 
-    # Database upload
-    ####################
-    DATABASE_URL = os.getenv('DATABASE_URL')
-    if DATABASE_URL.startswith("postgres://"):
-        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-        # logging.info("Updated DATABASE_URL to use 'postgresql://'")
+    # Snapshot IDs and playlist items from the previous run. Playlists whose snapshot ID has not changed are not re-paginated.
+    if playlist_cache is None:
+        playlist_cache = PlaylistCache(PLAYLIST_CACHE_DIR)
 
-    logging.info("Connecting to db.")
-    engine = create_engine(DATABASE_URL)
+    # Track IDs, track names, artist names and ISRCs from New Music Friday AU & NZ
+    # A list of tuples, each containing a track ID, track name, concatenated artist names and ISRC.
+    # Example, [('2Kcd2lLbMYi0dp7XYBcM1j', 'Foam', 'Royel Otis', 'AUUM72400123'), ...]
+    with instrumentation.stage('seed_fetch'):
+        seed_snapshot = get_playlist_snapshot(sp, playlist_id, playlist_cache)
+    track_details = seed_snapshot['tracks']
+    print(f'Fetched {len(track_details)} track details from New Music Friday AU & NZ playlist.')
 
+    # Every playlist is matched against the NMF tracks on track ID, falling back to ISRC
+    track_index = build_track_index(track_details)
+    tracks_by_id = track_index[0]
+
+    def fetch(sp, tracked_playlist_id):
+        # Re-use the NMF snapshot if it is also a tracked playlist
+        if tracked_playlist_id == playlist_id:
+            with instrumentation.stage('matching'):
+                return {**seed_snapshot, 'matches': list(match_positions(track_index, track_details))}
+        return get_playlist_matches(sp, tracked_playlist_id, track_index, playlist_cache)
+
+    playlist_count = cached_count = row_count = 0
+    matched_tracks = set()
+
+    # Fetches every tracked playlist exactly once: followers, cover image, description, snapshot ID and matched tracks
+    snapshots = iter_playlists_concurrently(fetch, sp, playlists_dict)
+    while True:
+        # Waiting for the fetch threads counts towards their stages, not towards the stage consuming the rows
+        with instrumentation.idle():
+            playlist_name, snapshot = next(snapshots, (None, None))
+        if snapshot is None:
+            break
+        playlist_count += 1
+        cached_count += snapshot['from_cache']
+
+        # Only Cover Art featuring an artist is useful, so the image URL is kept for cover-artist playlists only
+        with instrumentation.stage('cover_parsing'):
+            cover_artist = parse_cover_artist(snapshot['description'])
+        image_url = snapshot['image_url'] if cover_artist else None
+        if cover_artist:
+            logging.info(f"Playlist with cover art and artist details: {playlist_name}")
+
+        for track_id, position in snapshot['matches']:
+            _, track_name, artist_name, isrc = tracks_by_id[track_id]
+            matched_tracks.add(track_id)
+            row_count += 1
+            yield (playlist_name, track_id, artist_name, track_name, isrc, position, snapshot['followers'],
+                   image_url, cover_artist)
+
+        # Cover-artist playlists without any NMF adds still get a row, for their cover
+        if cover_artist and not snapshot['matches']:
+            row_count += 1
+            yield (playlist_name, None, None, None, None, None, None, image_url, cover_artist)
+
+    logging.info(f"Fetched {playlist_count} playlist snapshots ({cached_count} unchanged since the last run).")
+    print(f'Track positions in other playlists found for {len(matched_tracks)} tracks.')
+    logging.info(f"Built {row_count} coverage rows.")
+
+
+def get_upload_date(now=None):
+    """
+    Returns the release week a pull belongs to: the most recent Friday in Sydney time, as 'YYYY-MM-DD'.
+
+    Args:
+    - now (datetime, optional): The time to place in a week. Defaults to the current time in Sydney, like the poller's
+      clock, so a pull and the poll that triggered it always agree on the week whatever the server's timezone.
+    """
     # Calculating the upload date
-    now = datetime.now()
+    now = now or datetime.now(TIMEZONE)
     weekday = now.weekday()
 
     if weekday == 5: # Saturday
@@ -303,28 +170,52 @@ def data_pull():
     else: # Friday
         days_to_subtract = 0
 
-    upload_date = (now - timedelta(days=days_to_subtract)).strftime('%Y-%m-%d')
-    logging.info(f"Upload date determined as: {upload_date}")
+    return (now - timedelta(days=days_to_subtract)).strftime('%Y-%m-%d')
+
+
+def write_coverage(engine, coverage_by_market, upload_date):
+    """
+    Writes every market's coverage rows for the week of `upload_date` in one transaction, together with the week's
+    summaries for the pages (see metrics.py), its Top Performers entry, its release artists and its place in the weeks
+    catalog.
 
+    Args:
+    - engine (sqlalchemy.engine.Engine): Engine to write with.
+    - coverage_by_market (dict): Market code -> coverage rows from `collect_coverage`. Generators are consumed before
+      the transaction opens.
+    - upload_date (str): The week being written, as 'YYYY-MM-DD'.
 
-### debugging
+    Returns:
+    - dict: Number of rows 'inserted', 'updated', 'deleted' and left 'unchanged', summed over the markets.
+    """
+    counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    # The matched rows are collected before the transaction opens, so it is never held open (with its locks) while
+    # Spotify is being fetched - only the write itself runs inside it
+    rows_by_market = {}
+    for market, rows in coverage_by_market.items():
+        with instrumentation.for_market(market):
+            rows_by_market[market] = list(rows)
+
+    # Only rows that changed since the last run in this week are written
     with engine.connect() as conn:
         with conn.begin() as trans:
             try:
-                logging.info(f"Attempting to delete existing records for date {upload_date}.") 
-                result = conn.execute(text("""DELETE FROM public.nmf_spotify_coverage WHERE "Date" = :date"""), {'date': upload_date})
-                logging.info(f"Deleted {result.rowcount} existing records for date {upload_date}.")
-                logging.info("Inserting new data.")
-                # Ensure 'merged_df' has the correct 'Date' set to 'upload_date' before insertion
-                merged_df['Date'] = upload_date
-                
-                # logging.info(f"Preview of merged_df before insertion:\n{merged_df.head()}")
-                
-                # Count amount of new rows being insterted for comparison to deletion 
-                inserted_row_count = len(merged_df)    
-                merged_df.to_sql('nmf_spotify_coverage', con=engine, if_exists='append', index=False)
-            
-                logging.info(f"Inserted {inserted_row_count} new records successfully.")
+                logging.info(f"Applying coverage changes for date {upload_date}.")
+                for market, rows in rows_by_market.items():
+                    with instrumentation.for_market(market):
+                        market_counts = upsert_coverage(conn, rows, upload_date, market)
+                        # The pages read the week's summaries, Top Performers and release artists instead of
+                        # aggregating the rows
+                        with instrumentation.stage('summary'):
+                            refresh_weekly_summary(conn, upload_date, market)
+                            refresh_top_performers(conn, upload_date, market)
+                            refresh_release_artists(conn, upload_date, market)
+                            refresh_comparison_artists(conn, market)
+                            record_week(conn, upload_date, market)
+                    logging.info(f"{market}: inserted {market_counts['inserted']}, updated {market_counts['updated']} and deleted {market_counts['deleted']} records ({market_counts['unchanged']} unchanged).")
+                    for key in counts:
+                        counts[key] += market_counts[key]
                 trans.commit()
                 logging.info("Database transaction committed.")
             except Exception as e:
@@ -333,9 +224,269 @@ def data_pull():
                 raise
 
     logging.info("Database upload completed.")
-    
-    pass
+
+    return counts
+
+
+def stream_market(market, profile, upload_date, rate_share=1.0):
+    """
+    Fetches one market's playlists and yields its coverage rows as they are built (see `collect_coverage`).
+
+    With PULL_ARCHIVE_DIR set, the raw responses of the pull are archived there (see archive.py) once all rows were
+    produced, so the week can be re-processed later with `replay_pull`.
+
+    Args:
+    - market (str): Market code, e.g. 'AU'.
+    - profile (dict): The market's profile from `load_markets`.
+    - upload_date (str): The week being pulled, as 'YYYY-MM-DD'. Recorded in the archive.
+    - rate_share (float): Share of the Spotify request rate this market may use - the markets run side by side on one app.
+
+    Yields:
+    - tuple: The market's coverage rows, in the order of `database.ROW_COLUMNS`.
+    """
+    # Spotify client with client credentials for public data access, created once per worker process
+    # The client shares one pooled HTTP session across the concurrent playlist fetches and re-uses its cached token
+    # Every call of this run goes through one scheduler, which throttles the fetch threads together, waits out 429s
+    # and stops the run once its call budget is spent. Any failed fetch aborts the run before anything is committed.
+    request_scheduler = RequestScheduler(rate=DEFAULT_RATE * rate_share, max_rate=MAX_RATE * rate_share)
+    sp = RateLimitedSpotify(get_spotify_client(), request_scheduler)
+    playlist_cache = PlaylistCache(market_cache_dir(market))
+
+    archive = None
+    if ARCHIVE_DIR:
+        archive = RunArchive({'market': market, 'seed_playlist': profile['seed_playlist'],
+                              'playlists': profile['playlists'], 'upload_date': upload_date})
+        sp, playlist_cache = ArchivingSpotify(sp, archive), ArchivingCache(playlist_cache, archive)
+
+    completed = False
+    try:
+        yield from collect_coverage(sp, profile['playlists'], profile['seed_playlist'], playlist_cache)
+        completed = True
+    finally:
+        logging.info(f"Spotify requests ({market}): {request_scheduler.stats()}")
+        if archive:
+            archive.close() if completed else archive.discard()
+
+
+def pull_market(market, profile, upload_date, rate_share=1.0):
+    """
+    Fetches one market's playlists and builds its coverage rows in a worker process, when several markets are enabled.
+
+    Returns:
+    - tuple: The market's coverage rows - materialised, as they are sent back to the parent process - and the
+      stage metrics of its fetch.
+    """
+    # Build the client first, so importing Spotipy does not count towards the traced memory of the first stage
+    get_spotify_client()
+    with instrumentation.collect() as metrics, instrumentation.for_market(market):
+        rows = list(stream_market(market, profile, upload_date, rate_share))
+    return rows, metrics.snapshot()
+
+
+# Log file of the worker, shared by the market processes
+LOG_FILE = 'log.txt'
+
+# Number of markets pulled at the same time, one process each
+MARKET_WORKERS = int(os.getenv('MARKET_WORKERS', '4'))
+
+
+def collect_markets(markets, upload_date):
+    """
+    Pulls every market, each in its own process, so adding a market does not add to the length of a run.
+
+    Args:
+    - markets (dict): Enabled market profiles from `load_markets`.
+    - upload_date (str): The week being pulled, as 'YYYY-MM-DD'.
+
+    Returns:
+    - tuple: Market code -> coverage rows for the markets that succeeded, and market code -> error for those that failed.
+    """
+    # A single market is pulled in-process; its rows are built as the playlists come in
+    if len(markets) == 1:
+        (market, profile), = markets.items()
+        return {market: stream_market(market, profile, upload_date)}, {}
+
+    # Fetch (or re-use) the access token once, so the worker processes all start from the cached token
+    # instead of each requesting and writing a new one
+    get_spotify_client().auth_manager.get_access_token(as_dict=False)
+
+    rate_share = 1 / len(markets)
+    coverage_by_market, errors = {}, {}
+    # Spawned rather than forked - the scheduler and HTTP pools run threads that a fork would copy mid-flight
+    with ProcessPoolExecutor(max_workers=min(len(markets), MARKET_WORKERS), mp_context=multiprocessing.get_context('spawn'),
+                             initializer=configure_logging, initargs=(LOG_FILE,)) as executor:
+        futures = {market: executor.submit(pull_market, market, profile, upload_date, rate_share) for market, profile in markets.items()}
+        for market, future in futures.items():
+            try:
+                coverage_by_market[market], stage_metrics = future.result()
+                instrumentation.merge(stage_metrics)
+            except Exception as e:
+                logging.error(f"Pull failed for market {market}: {e}")
+                errors[market] = e
+    return coverage_by_market, errors
+
+
+def data_pull(engine=None, upload_date=None):
+    """
+    Runs one pull: fetches every enabled market's playlists and writes this week's coverage rows.
+
+    A market whose fetch fails is not written; the other markets are, and the pull then raises.
+
+    Args:
+    - engine (sqlalchemy.engine.Engine, optional): Engine to write with. Defaults to one for DATABASE_URL.
+    - upload_date (str, optional): The week to write, as 'YYYY-MM-DD'. Defaults to `get_upload_date()`.
+
+    Returns:
+    - dict: Number of rows 'inserted', 'updated', 'deleted' and left 'unchanged'.
+    """
+    # data pull logic and database upload below
+
+    upload_date = upload_date or get_upload_date()
+    logging.info(f"Upload date determined as: {upload_date}")
+
+    # Market profiles with their seed playlist and tracked playlists
+    markets = load_markets()
+    coverage_by_market, errors = collect_markets(markets, upload_date)
+
+    # Database upload
+    ####################
+    if engine is None:
+        logging.info("Connecting to db.")
+        engine = create_engine(get_database_url())
+
+    counts = write_coverage(engine, coverage_by_market, upload_date) if coverage_by_market else None
+
+    if errors:
+        raise RuntimeError(f"Pull failed for markets {', '.join(errors)}: " + "; ".join(f"{market}: {e}" for market, e in errors.items()))
+    return counts
+
+
+def replay_pull(archives, engine=None):
+    """
+    Re-runs the matching and the database write of archived pulls, without any Spotify API call.
+
+    Args:
+    - archives (list): Loaded archives (see `archive.load_archive`), at most one per market, all of the same week.
+    - engine (sqlalchemy.engine.Engine, optional): Engine to write with. Defaults to one for DATABASE_URL.
+
+    Returns:
+    - dict: Number of rows 'inserted', 'updated', 'deleted' and left 'unchanged'.
+    """
+    upload_dates = {header['upload_date'] for header, _, _ in archives}
+    if len(upload_dates) != 1:
+        raise ValueError(f"Archives of different weeks cannot be replayed together: {', '.join(sorted(upload_dates))}")
+    upload_date, = upload_dates
+
+    coverage_by_market = {}
+    for header, sp, playlist_cache in archives:
+        if header['market'] in coverage_by_market:
+            raise ValueError(f"More than one archive given for market {header['market']}.")
+        logging.info(f"Replaying the {header['market']} pull of {header['started_at']}.")
+        coverage_by_market[header['market']] = collect_coverage(sp, header['playlists'], header['seed_playlist'], playlist_cache)
+
+    if engine is None:
+        engine = create_engine(get_database_url())
+    return write_coverage(engine, coverage_by_market, upload_date)
+
+
+def report_metrics(conn, run_id, metrics, status):
+    """
+    Logs a run's stage metrics and stores them in the stage metrics table and the Prometheus textfile.
+    Storing them never fails the pull - errors are logged.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection.
+    - run_id (int): ID of the run's ledger row.
+    - metrics (instrumentation.PullMetrics): The run's metrics.
+    - status (str): The run's ledger status.
+    """
+    stage_metrics = metrics.snapshot()
+    for stage_metric in stage_metrics:
+        logging.info(f"Stage {stage_metric['stage']} ({stage_metric['market']}): {stage_metric['seconds']:.2f}s, "
+                     f"{stage_metric['api_calls']} API calls, {stage_metric['retries']} retries, "
+                     f"{stage_metric['bytes_received'] / 1024:.0f} KiB received, "
+                     f"peak {stage_metric['peak_memory_bytes'] / 2**20:.1f} MiB")
+    try:
+        save_stage_metrics(conn, run_id, stage_metrics)
+        instrumentation.write_prometheus(stage_metrics, metrics.seconds, status)
+    except Exception as e:
+        logging.error(f"Could not store the pull's stage metrics: {e}")
+
+
+def run_pull(trigger='manual', pull=data_pull, upload_date=None):
+    """
+    Runs a pull unless another worker is running one, recording it in the pull_runs ledger.
+
+    A Postgres advisory lock keeps pulls single-flight across workers. If another process holds it, the run is recorded
+    as 'skipped' and PULL_SKIPPED is returned; the poller then pulls again on its next cycle, so any number of skipped
+    triggers turn into one follow-up run. Within a worker the poll job itself never overlaps (max_instances=1).
+
+    The per-stage metrics of the run (see instrumentation.py) are stored in the pull_stage_metrics table and written to
+    the Prometheus textfile at PULL_METRICS_PATH.
+
+    Args:
+    - trigger (str): Why the pull was triggered, stored in the ledger.
+    - pull (callable): Runs the pull with an engine and the upload date and returns its row counts. Defaults to
+      `data_pull`.
+    - upload_date (str, optional): The week to write, as 'YYYY-MM-DD'. Defaults to `get_upload_date()`.
+
+    Returns:
+    - dict: Number of rows 'inserted', 'updated', 'deleted' and left 'unchanged', or PULL_SKIPPED.
+    """
+    engine = create_engine(get_database_url())
+    upload_date = upload_date or get_upload_date()
+
+    try:
+        # The advisory lock belongs to this connection's session and is held until it is released below
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as lock_conn:
+            if not try_pull_lock(lock_conn):
+                logging.warning("Another worker is running a pull, skipping this one.")
+                run_id = start_pull_run(lock_conn, trigger, upload_date, status='skipped')
+                finish_pull_run(lock_conn, run_id, 'skipped')
+                return PULL_SKIPPED
+
+            try:
+                run_id = start_pull_run(lock_conn, trigger, upload_date)
+                try:
+                    with instrumentation.collect() as metrics:
+                        counts = pull(engine, upload_date)
+                except Exception as e:
+                    finish_pull_run(lock_conn, run_id, 'failed', error=str(e))
+                    report_metrics(lock_conn, run_id, metrics, 'failed')
+                    raise
+                finish_pull_run(lock_conn, run_id, 'succeeded', counts)
+                report_metrics(lock_conn, run_id, metrics, 'succeeded')
+            finally:
+                release_pull_lock(lock_conn)
+
+        # Thumbnails of the week's covers, when the pages read the same cache directory - otherwise the home page warms
+        # its own. After the lock is released, so the downloads never hold up the next pull.
+        if COVER_CACHE_SHARED:
+            try:
+                with engine.connect() as conn:
+                    image_urls = load_cover_image_urls(conn, upload_date)
+                warm_cover_cache(image_urls)
+            except Exception as e:
+                logging.warning(f"Could not warm the cover cache: {e}")
+        return counts
+    finally:
+        engine.dispose()
 
 if __name__ == "__main__":
-    schedule()
+    parser = argparse.ArgumentParser(description='New Music Friday coverage worker.')
+    parser.add_argument('--replay', nargs='+', metavar='ARCHIVE',
+                        help='Re-process archived pulls (one .jsonl.gz per market) instead of polling Spotify')
+    args = parser.parse_args()
+
+    # Configure logging to the console and to file
+    configure_logging(LOG_FILE)
+    if args.replay:
+        archives = [load_archive(file_path) for file_path in args.replay]
+        counts = run_pull('replay', pull=lambda engine, upload_date: replay_pull(archives, engine),
+                          upload_date=archives[0][0]['upload_date'])
+        if counts == PULL_SKIPPED:
+            sys.exit("Replay skipped: another worker is running a pull. Run it again once that pull has finished.")
+        print(f"Replay finished: {counts}")
+    else:
+        schedule()
 
@@ -0,0 +1,562 @@
+# Database helpers for the data pull worker. The schema itself is created by migrations.py.
+import os
+import io
+import csv
+import json
+import logging
+
+from sqlalchemy import text
+
+from instrumentation import stage
+from functions import split_artists
+
+
+# Coverage view read by every page: one row per NMF release per playlist it was added to, with the release's and the
+# playlist's details - a join of the three tables below
+COVERAGE_TABLE = 'nmf_spotify_coverage'
+
+# Coverage rows written by `data_pull()`: the release's track ID, its playlist and its position there
+COVERAGE_ROWS_TABLE = 'coverage_rows'
+
+# Artist, title and ISRC of every release with coverage rows, once per week
+RELEASE_TRACK_TABLE = 'release_track'
+
+# Follower count, cover image and cover artist of every playlist with coverage rows, once per week
+PLAYLIST_SNAPSHOT_TABLE = 'playlist_snapshot'
+
+# Market the rows belong to when none is given - the original AU & NZ pull
+DEFAULT_MARKET = 'AU'
+
+# A coverage row is identified by its week, market, playlist and Spotify track ID
+KEY_COLUMNS = ['Date', 'Market', 'Playlist', 'Track_ID']
+
+# Columns that can change for an existing release between runs in the same week (artist renames included)
+RELEASE_COLUMNS = ['Artist', 'Title', 'ISRC']
+
+# Columns that can change for an existing row between runs in the same week
+TRACK_COLUMNS = ['Position']
+
+# Columns that can change for an existing playlist snapshot between runs in the same week
+SNAPSHOT_COLUMNS = ['Followers', 'Image_URL', 'Cover_Artist']
+
+VALUE_COLUMNS = RELEASE_COLUMNS + TRACK_COLUMNS + SNAPSHOT_COLUMNS
+
+# Columns of the coverage view
+COVERAGE_COLUMNS = KEY_COLUMNS + VALUE_COLUMNS
+
+
+def get_database_url():
+    """
+    Reads DATABASE_URL from the environment, rewriting Heroku's 'postgres://' scheme to the 'postgresql://' one SQLAlchemy expects.
+
+    Returns:
+    - str: The database URL, or None if DATABASE_URL is not set.
+    """
+    database_url = os.getenv('DATABASE_URL')
+    if database_url and database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    return database_url
+
+
+def _quote(column):
+    return f'"{column}"'
+
+
+# Key columns that are never NULL
+NOT_NULL_KEY_COLUMNS = ['Date', 'Market', 'Playlist']
+
+
+def _key_match_sql(left, right):
+    """
+    SQL condition matching coverage rows of `left` and `right` on KEY_COLUMNS.
+
+    Nullable key columns (Track_ID is NULL on cover-only playlist rows) are compared through COALESCE rather than
+    IS NOT DISTINCT FROM, which Postgres cannot hash join on. Spotify never returns empty IDs, so '' is a safe stand-in.
+    """
+    return " AND ".join(
+        f'{left}.{_quote(col)} = {right}.{_quote(col)}' if col in NOT_NULL_KEY_COLUMNS
+        else f"COALESCE({left}.{_quote(col)}, '') = COALESCE({right}.{_quote(col)}, '')"
+        for col in KEY_COLUMNS
+    )
+
+
+class _CsvRowStream:
+    """
+    Read-only file object for COPY FROM STDIN that renders rows as CSV lines only when COPY asks for more data,
+    so the rows are never all held in memory. NULLs are written as \\N so they stay distinct from empty strings.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._line = io.StringIO()
+        self._writer = csv.writer(self._line)
+        self._pending = ''
+        self.rows = 0
+
+    def _next_line(self):
+        row = next(self._rows, None)
+        if row is None:
+            return ''
+        self.rows += 1
+        self._line.seek(0)
+        self._line.truncate()
+        self._writer.writerow(['\\N' if value is None else value for value in row])
+        return self._line.getvalue()
+
+    def read(self, size=-1):
+        chunks, length = [self._pending], len(self._pending)
+        while size < 0 or length < size:
+            line = self._next_line()
+            if not line:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            self._pending = ''
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+
+def copy_rows(conn, rows, table, columns):
+    """
+    Streams rows into `table` with COPY FROM STDIN - much faster than row-by-row INSERTs, and `rows` may be a generator
+    that produces them while the COPY runs.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open psycopg2-backed connection. The COPY runs inside its transaction.
+    - rows (iterable): Row tuples, with values in the order of `columns`.
+    - table (str): Name of the (possibly schema-qualified) target table.
+    - columns (list): Names of the columns the rows fill.
+
+    Returns:
+    - int: Number of rows copied.
+    """
+    stream = _CsvRowStream(rows)
+    column_sql = ", ".join(_quote(col) for col in columns)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({column_sql}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", stream)
+    finally:
+        cursor.close()
+    return stream.rows
+
+
+# Columns of the rows handed to `upsert_coverage` - Date and Market are the same for a whole write and filled in there
+ROW_COLUMNS = [col for col in COVERAGE_COLUMNS if col not in ('Date', 'Market')]
+
+
+def upsert_coverage(conn, rows, upload_date, market=DEFAULT_MARKET, table=COVERAGE_ROWS_TABLE,
+                    snapshot_table=PLAYLIST_SNAPSHOT_TABLE, track_table=RELEASE_TRACK_TABLE):
+    """
+    Brings the coverage rows, release tracks and playlist snapshots stored for `upload_date` and `market` in line with
+    `rows`, touching only the rows that changed.
+
+    The pulled rows are streamed into a temporary table with COPY. Their release details are merged into the release
+    track table, one row per track ID, and their playlist details into the playlist snapshot table, one row per
+    playlist. The rest is de-duplicated into a staging table and merged from there in three statements. Rows are
+    matched on (Date, Market, Playlist, Track_ID). Stored rows missing from `rows` are deleted, rows whose Position
+    changed are updated and new rows are inserted.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection, inside the caller's transaction.
+    - rows (iterable): The freshly pulled coverage rows as tuples in ROW_COLUMNS order, e.g. the generator returned by
+      `data_pull.collect_coverage`. Consumed while the COPY runs.
+    - upload_date (str): The week being written, as 'YYYY-MM-DD'.
+    - market (str): The market the rows were pulled for. Rows of other markets are left alone.
+    - table (str): Coverage rows table to write to.
+    - snapshot_table (str): Playlist snapshot table to write to.
+    - track_table (str): Release track table to write to.
+
+    Returns:
+    - dict: Number of coverage rows 'inserted', 'updated', 'deleted' and left 'unchanged'.
+    """
+    target = f'public.{table}'
+    snapshots = f'public.{snapshot_table}'
+    tracks = f'public.{track_table}'
+    staging = f'{table}_staging'
+
+    pulled = f'{table}_pulled'
+    params = {'date': upload_date, 'market': market}
+
+    # The pulled rows are produced while the COPY runs, so their fetch stages nest inside db_insert
+    with stage('db_insert'):
+        # Raw pulled rows, without the tables' constraints - Date and Market are only filled in below
+        source = {**{col: 'r' for col in RELEASE_COLUMNS}, **{col: 's' for col in SNAPSHOT_COLUMNS}}
+        pulled_sql = ", ".join(f'{source.get(col, "t")}.{_quote(col)}' for col in ROW_COLUMNS)
+        conn.execute(text(f'DROP TABLE IF EXISTS {pulled}'))
+        conn.execute(text(f"""
+            CREATE TEMP TABLE {pulled} ON COMMIT DROP AS
+            SELECT {pulled_sql} FROM {target} t CROSS JOIN {tracks} r CROSS JOIN {snapshots} s WITH NO DATA
+        """))
+        copy_rows(conn, rows, pulled, ROW_COLUMNS)
+
+        # Every row of a release carries the same details - one release track per track ID
+        release_sql = ", ".join(_quote(col) for col in RELEASE_COLUMNS)
+        release_changed_sql = " OR ".join(f't.{_quote(col)} IS DISTINCT FROM EXCLUDED.{_quote(col)}' for col in RELEASE_COLUMNS)
+        tracks_written = conn.execute(text(f"""
+            INSERT INTO {tracks} AS t ("Date", "Market", "Track_ID", {release_sql})
+            SELECT DISTINCT ON ("Track_ID") CAST(:date AS DATE), :market, "Track_ID", {release_sql}
+            FROM {pulled}
+            WHERE "Track_ID" IS NOT NULL
+            ORDER BY "Track_ID"
+            ON CONFLICT ("Date", "Market", "Track_ID") DO UPDATE
+            SET {", ".join(f'{_quote(col)} = EXCLUDED.{_quote(col)}' for col in RELEASE_COLUMNS)}
+            WHERE {release_changed_sql}
+        """), params).rowcount
+
+        # Every row of a playlist carries the same details - one snapshot per playlist
+        snapshot_sql = ", ".join(_quote(col) for col in SNAPSHOT_COLUMNS)
+        snapshot_changed_sql = " OR ".join(f't.{_quote(col)} IS DISTINCT FROM EXCLUDED.{_quote(col)}' for col in SNAPSHOT_COLUMNS)
+        snapshots_written = conn.execute(text(f"""
+            INSERT INTO {snapshots} AS t ("Date", "Market", "Playlist", {snapshot_sql})
+            SELECT DISTINCT ON ("Playlist") CAST(:date AS DATE), :market, "Playlist", {snapshot_sql}
+            FROM {pulled}
+            ORDER BY "Playlist"
+            ON CONFLICT ("Date", "Market", "Playlist") DO UPDATE
+            SET {", ".join(f'{_quote(col)} = EXCLUDED.{_quote(col)}' for col in SNAPSHOT_COLUMNS)}
+            WHERE {snapshot_changed_sql}
+        """), params).rowcount
+
+        # A track can only hold one position per playlist - keep its highest placement
+        track_columns = [col for col in ROW_COLUMNS if col not in SNAPSHOT_COLUMNS + RELEASE_COLUMNS]
+        track_sql = ", ".join(_quote(col) for col in track_columns)
+        conn.execute(text(f'DROP TABLE IF EXISTS {staging}'))
+        conn.execute(text(f'CREATE TEMP TABLE {staging} (LIKE {target}) ON COMMIT DROP'))
+        columns = ", ".join(_quote(col) for col in KEY_COLUMNS + TRACK_COLUMNS)
+        staged = conn.execute(text(f"""
+            INSERT INTO {staging} ("Date", "Market", {track_sql})
+            SELECT DISTINCT ON ("Playlist", "Track_ID") CAST(:date AS DATE), :market, {track_sql}
+            FROM {pulled}
+            ORDER BY "Playlist", "Track_ID", "Position" NULLS LAST
+        """), params).rowcount
+        # Temp tables are never auto-analyzed; without statistics the merges below can fall back to nested loops
+        conn.execute(text(f'ANALYZE {staging}'))
+
+    with stage('db_delete'):
+        # Keys stored more than once (from the old delete-and-reinsert path, or rows written before Track_ID existed)
+        # are removed and re-inserted once below
+        group_columns = ", ".join(_quote(col) for col in KEY_COLUMNS)
+        deduplicated = conn.execute(text(f"""
+            DELETE FROM {target}
+            WHERE ctid IN (
+                SELECT ctid FROM (
+                    SELECT ctid, COUNT(*) OVER (PARTITION BY {group_columns}) AS copies
+                    FROM {target}
+                    WHERE "Date" = :date AND "Market" = :market
+                ) d
+                WHERE d.copies > 1
+            )
+        """), params).rowcount
+
+        deleted = conn.execute(text(f"""
+            DELETE FROM {target} t
+            WHERE t."Date" = :date AND t."Market" = :market
+              AND NOT EXISTS (SELECT 1 FROM {staging} s WHERE {_key_match_sql('t', 's')})
+        """), params).rowcount
+
+        # Snapshots of playlists and releases that no longer have any coverage rows this week
+        snapshots_deleted = conn.execute(text(f"""
+            DELETE FROM {snapshots} t
+            WHERE t."Date" = :date AND t."Market" = :market
+              AND NOT EXISTS (SELECT 1 FROM {pulled} p WHERE p."Playlist" = t."Playlist")
+        """), params).rowcount
+        tracks_deleted = conn.execute(text(f"""
+            DELETE FROM {tracks} t
+            WHERE t."Date" = :date AND t."Market" = :market
+              AND NOT EXISTS (SELECT 1 FROM {pulled} p WHERE p."Track_ID" = t."Track_ID")
+        """), params).rowcount
+
+    with stage('db_insert'):
+        set_sql = ", ".join(f'{_quote(col)} = s.{_quote(col)}' for col in TRACK_COLUMNS)
+        changed_sql = " OR ".join(f't.{_quote(col)} IS DISTINCT FROM s.{_quote(col)}' for col in TRACK_COLUMNS)
+        updated = conn.execute(text(f"""
+            UPDATE {target} t
+            SET {set_sql}
+            FROM {staging} s
+            WHERE t."Date" = :date AND t."Market" = :market AND {_key_match_sql('t', 's')} AND ({changed_sql})
+        """), params).rowcount
+
+        inserted = conn.execute(text(f"""
+            INSERT INTO {target} ({columns})
+            SELECT {columns} FROM {staging} s
+            WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE t."Date" = :date AND t."Market" = :market AND {_key_match_sql('t', 's')})
+        """), params).rowcount
+
+    counts = {
+        'inserted': inserted,
+        'updated': updated,
+        'deleted': deleted + deduplicated,
+        'unchanged': staged - inserted - updated,
+    }
+    logging.info(f"Coverage upsert for {upload_date} ({market}): {counts}, "
+                 f"{tracks_written} release tracks written and {tracks_deleted} deleted, "
+                 f"{snapshots_written} playlist snapshots written and {snapshots_deleted} deleted")
+    return counts
+
+
+# Ledger of scheduled pulls: one row per triggered run
+PULL_RUNS_TABLE = 'pull_runs'
+
+# Key of the Postgres advisory lock held for the duration of a pull, shared by every worker process
+PULL_LOCK_KEY = 7_240_113
+
+
+def try_pull_lock(conn):
+    """
+    Tries to take the session-level pull lock without waiting.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Connection in AUTOCOMMIT mode that stays open while the pull runs.
+
+    Returns:
+    - bool: True if the lock was taken, False if another process holds it.
+    """
+    return conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': PULL_LOCK_KEY}).scalar()
+
+
+def release_pull_lock(conn):
+    conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': PULL_LOCK_KEY})
+
+
+def start_pull_run(conn, trigger, upload_date, status='running'):
+    """
+    Records the start of a run in the ledger.
+
+    Runs still marked 'running' can only be left over from a crashed worker while the caller holds the pull lock,
+    so they are marked 'abandoned' first.
+
+    Returns:
+    - int: ID of the new ledger row.
+    """
+    if status == 'running':
+        conn.execute(text(f"UPDATE public.{PULL_RUNS_TABLE} SET status = 'abandoned' WHERE status = 'running'"))
+    return conn.execute(text(f"""
+        INSERT INTO public.{PULL_RUNS_TABLE} (trigger, upload_date, status)
+        VALUES (:trigger, :upload_date, :status)
+        RETURNING id
+    """), {'trigger': trigger, 'upload_date': upload_date, 'status': status}).scalar()
+
+
+def finish_pull_run(conn, run_id, status, counts=None, error=None):
+    """
+    Records the outcome of a run: its status, duration, rows written and the error of a failed run.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection.
+    - run_id (int): ID returned by `start_pull_run`.
+    - status (str): 'succeeded', 'failed' or 'skipped'.
+    - counts (dict, optional): Row counts returned by `upsert_coverage`.
+    - error (str, optional): Error message of a failed run.
+    """
+    counts = counts or {}
+    conn.execute(text(f"""
+        UPDATE public.{PULL_RUNS_TABLE}
+        SET status = :status,
+            finished_at = clock_timestamp(),
+            duration_seconds = EXTRACT(EPOCH FROM clock_timestamp() - started_at),
+            rows_inserted = :inserted,
+            rows_updated = :updated,
+            rows_deleted = :deleted,
+            rows_unchanged = :unchanged,
+            error = :error
+        WHERE id = :id
+    """), {
+        'id': run_id,
+        'status': status,
+        'inserted': counts.get('inserted'),
+        'updated': counts.get('updated'),
+        'deleted': counts.get('deleted'),
+        'unchanged': counts.get('unchanged'),
+        'error': error,
+    })
+
+
+# Per-stage metrics of each run, see instrumentation.py
+PULL_STAGE_METRICS_TABLE = 'pull_stage_metrics'
+
+
+def save_stage_metrics(conn, run_id, stage_metrics):
+    """
+    Stores the stage metrics of a run next to its ledger row.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection.
+    - run_id (int): ID returned by `start_pull_run`.
+    - stage_metrics (list): Output of `instrumentation.PullMetrics.snapshot`.
+    """
+    if not stage_metrics:
+        return
+    conn.execute(text(f"""
+        INSERT INTO public.{PULL_STAGE_METRICS_TABLE}
+            (run_id, market, stage, seconds, api_calls, retries, bytes_received, peak_memory_bytes)
+        VALUES (:run_id, :market, :stage, :seconds, :api_calls, :retries, :bytes_received, :peak_memory_bytes)
+    """), [{**metrics, 'run_id': run_id, 'market': metrics['market'] or ''} for metrics in stage_metrics])
+
+
+# Summaries of each week shown on the pages, computed by the worker (see metrics.py)
+WEEKLY_SUMMARY_TABLE = 'weekly_summary'
+
+
+def save_weekly_summary(conn, upload_date, market, summary):
+    """
+    Stores the summary of a week, replacing the one of an earlier pull.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection.
+    - upload_date (str): The week, as 'YYYY-MM-DD'.
+    - market (str): Market code, e.g. 'AU'.
+    - summary (dict): Output of `metrics.weekly_summary`.
+    """
+    conn.execute(text(f"""
+        INSERT INTO public.{WEEKLY_SUMMARY_TABLE} (upload_date, market, summary)
+        VALUES (:upload_date, :market, CAST(:summary AS JSONB))
+        ON CONFLICT (upload_date, market) DO UPDATE SET summary = EXCLUDED.summary, computed_at = now()
+    """), {'upload_date': upload_date, 'market': market, 'summary': json.dumps(summary)})
+
+
+def load_weekly_summary(conn, upload_date, market=DEFAULT_MARKET):
+    """
+    Reads the stored summary of a week.
+
+    Returns:
+    - dict: The summary, or None if the week has none (yet).
+    """
+    return conn.execute(text(f"""
+        SELECT summary FROM public.{WEEKLY_SUMMARY_TABLE} WHERE upload_date = :upload_date AND market = :market
+    """), {'upload_date': upload_date, 'market': market}).scalar()
+
+
+# Top release of every week by total reach, for the all-time Top Performers leaderboard
+TOP_PERFORMERS_TABLE = 'top_performers'
+
+
+def _insert_top_performers_sql(table, week_filter):
+    # Top release(s) by reach of the weeks matching `week_filter` (ties included), from the coverage rows
+    return f"""
+        INSERT INTO public.{TOP_PERFORMERS_TABLE} (upload_date, market, artist, title, playlists, total_followers)
+        SELECT "Date", "Market", "Artist", "Title", playlists, total_followers
+        FROM (
+            SELECT
+                "Date", "Market", "Artist", "Title",
+                STRING_AGG(DISTINCT "Playlist", E'\\n') AS playlists,
+                SUM("Followers") AS total_followers,
+                RANK() OVER (PARTITION BY "Date", "Market" ORDER BY SUM("Followers") DESC) AS rank_within_week
+            FROM public.{table} c
+            WHERE {week_filter}
+              AND "Artist" IS NOT NULL AND "Title" IS NOT NULL AND "Followers" IS NOT NULL
+            GROUP BY "Date", "Market", "Artist", "Title"
+        ) ranked
+        WHERE rank_within_week = 1
+    """
+
+
+def refresh_top_performers(conn, upload_date, market=DEFAULT_MARKET, table=COVERAGE_TABLE):
+    """
+    Replaces the week's entry in the Top Performers table with its current top release(s). Called by the worker
+    after every write, so the leaderboard never has to rank the whole coverage table.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection, inside the write's transaction.
+    - upload_date (str): The week, as 'YYYY-MM-DD'.
+    - market (str): Market code, e.g. 'AU'.
+    - table (str): Coverage table to read.
+    """
+    params = {'date': upload_date, 'market': market}
+    conn.execute(text(f"""
+        DELETE FROM public.{TOP_PERFORMERS_TABLE} WHERE upload_date = :date AND market = :market
+    """), params)
+    conn.execute(text(_insert_top_performers_sql(table, 'c."Date" = :date AND c."Market" = :market')), params)
+
+
+# Catalog of the weeks in the coverage table, per market
+WEEKS_TABLE = 'weeks'
+
+
+def record_week(conn, upload_date, market=DEFAULT_MARKET):
+    """
+    Adds a week to the weeks catalog, or marks it as updated.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection, inside the write's transaction.
+    - upload_date (str): The week, as 'YYYY-MM-DD'.
+    - market (str): Market code, e.g. 'AU'.
+    """
+    conn.execute(text(f"""
+        INSERT INTO public.{WEEKS_TABLE} (market, upload_date) VALUES (:market, :date)
+        ON CONFLICT (market, upload_date) DO UPDATE SET updated_at = now()
+    """), {'date': upload_date, 'market': market})
+
+
+def load_cover_image_urls(conn, upload_date, table=PLAYLIST_SNAPSHOT_TABLE):
+    """
+    Returns the distinct cover image URLs of a week's playlists, across markets.
+    """
+    return conn.execute(text(f"""
+        SELECT DISTINCT "Image_URL" FROM public.{table} WHERE "Date" = :date AND "Image_URL" IS NOT NULL
+    """), {'date': upload_date}).scalars().all()
+
+
+# One row per artist per release - a release credited to "A, B" has a row for A and one for B
+RELEASE_ARTIST_TABLE = 'release_artist'
+
+# Artists with more than one release, offered by the release comparison page
+COMPARISON_ARTISTS_TABLE = 'comparison_artists'
+
+
+def refresh_release_artists(conn, upload_date, market=DEFAULT_MARKET, table=RELEASE_TRACK_TABLE):
+    """
+    Replaces the week's rows in the release artist table with the artists of its current releases. Called by the
+    worker after every write.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection, inside the write's transaction.
+    - upload_date (str): The week, as 'YYYY-MM-DD'.
+    - market (str): Market code, e.g. 'AU'.
+    - table (str): Release track table to read.
+
+    Returns:
+    - int: Number of rows written.
+    """
+    params = {'date': upload_date, 'market': market}
+    conn.execute(text(f"""
+        DELETE FROM public.{RELEASE_ARTIST_TABLE} WHERE upload_date = :date AND market = :market
+    """), params)
+    releases = conn.execute(text(f"""
+        SELECT DISTINCT "Artist", "Title" FROM public.{table}
+        WHERE "Date" = :date AND "Market" = :market AND "Artist" IS NOT NULL AND "Title" IS NOT NULL
+    """), params).fetchall()
+
+    # Keyed on the lower-case name, so a release credited with different casing still counts for the same artist
+    rows = {}
+    for artists, title in releases:
+        for name in split_artists(artists):
+            rows[(artists, title, name.lower())] = name
+    if rows:
+        conn.execute(text(f"""
+            INSERT INTO public.{RELEASE_ARTIST_TABLE} (upload_date, market, artist, title, artist_key, artist_name)
+            VALUES (:date, :market, :artist, :title, :artist_key, :artist_name)
+        """), [{**params, 'artist': artists, 'title': title, 'artist_key': key, 'artist_name': name}
+               for (artists, title, key), name in rows.items()])
+    return len(rows)
+
+
+def refresh_comparison_artists(conn, market=DEFAULT_MARKET):
+    """
+    Rebuilds the market's list of artists with more than one release (distinct titles) from the release artist table.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection.
+    - market (str): Market code, e.g. 'AU'.
+    """
+    conn.execute(text(f'DELETE FROM public.{COMPARISON_ARTISTS_TABLE} WHERE market = :market'), {'market': market})
+    conn.execute(text(f"""
+        INSERT INTO public.{COMPARISON_ARTISTS_TABLE} (market, artist_key, artist_name, releases)
+        SELECT market, artist_key, MODE() WITHIN GROUP (ORDER BY artist_name), COUNT(DISTINCT title)
+        FROM public.{RELEASE_ARTIST_TABLE}
+        WHERE market = :market
+        GROUP BY market, artist_key
+        HAVING COUNT(DISTINCT title) > 1
+    """), {'market': market})
+
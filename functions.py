@@ -1,104 +1,548 @@
 # Import necessary libraries
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import pandas as pd
+# Spotipy and requests are imported inside the client factory, so pages that only need the
+# helpers below (e.g. `is_valid_spotify_link`) import this module without touching Spotify.
 import json
 import re
-from time import sleep
 import os
 import logging
+import tempfile
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import stage, timed_iter, record
 
-import logging
 
-# Configure logging with a custom date format to include the day of the week
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    datefmt='%A %Y-%m-%d %H:%M:%S')  # Including the day of the week
+def configure_logging(filename=None):
+    """
+    Configures logging with a custom date format that includes the day of the week.
 
+    Args:
+    - filename (str, optional): Also write log records to this file.
+    """
+    handlers = [logging.StreamHandler()]
+    if filename:
+        handlers.append(logging.FileHandler(filename))
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%A %Y-%m-%d %H:%M:%S',  # Including the day of the week
+                        handlers=handlers)
 
-# # Fetch credentials via environment variables
-CLIENT_ID = os.getenv('CLIENT_ID')
-CLIENT_SECRET = os.getenv('CLIENT_SECRET')
 
-# Initialise the Spotify client with client credentials 
-client_credentials_manager = SpotifyClientCredentials(client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+# Tracked playlists (name -> Spotify ID)
+PLAYLISTS_PATH = os.getenv('PLAYLISTS_PATH', 'playlists.json')
 
-# Load list of playlists from JSON file
-with open('playlists.json', 'r') as file:
-    playlists_dict = json.load(file)
 
-def get_playlist_tracks_and_artists(sp, playlist_id):
+def load_playlists(file_path=PLAYLISTS_PATH):
     """
-    Fetches track names and artist names from a Spotify playlist.
+    Loads the tracked playlists.
 
     Args:
-    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
-    - playlist_id (str): The Spotify ID of the playlist from which to fetch tracks.
+    - file_path (str): Path of the playlists JSON file.
 
     Returns:
-    - list: A list of tuples, each containing a track name and concatenated artist names.
-    """    
-    track_details = []
+    - dict: A dictionary mapping playlist names to their Spotify IDs.
+    """
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+
+# Market profiles: seed playlist and tracked playlists per market
+MARKETS_PATH = os.getenv('MARKETS_PATH', 'markets.json')
+
+
+def load_markets(file_path=MARKETS_PATH, playlists_path=PLAYLISTS_PATH):
+    """
+    Loads the enabled market profiles.
+
+    A profile's "playlists" is either a name -> Spotify ID dictionary or the path of a playlists JSON file. Without
+    it the profile tracks the playlists in `playlists_path`. Without a markets file only AU & NZ is pulled.
+
+    Args:
+    - file_path (str): Path of the markets JSON file.
+    - playlists_path (str): Playlists JSON file of profiles that do not list their own.
+
+    Returns:
+    - dict: Market code -> {'name', 'seed_playlist', 'playlists'} with 'playlists' loaded, for enabled markets only.
+    """
     try:
-        # Request specific fields to minimize data transfer
-        results = sp.playlist_items(playlist_id, fields="items.track(name,artists.name),next")
-        
-        # Iterate through all pages of results
-        while results:
-            tracks = results['items']
-            for item in tracks:
-                track = item['track']
-                if track:  # Ensure the track information exists
-                    track_name = track['name']
-                    artist_names = ', '.join(artist['name'] for artist in track['artists'])
-                    track_details.append((track_name, artist_names))
-            
-            # Fetch the next page of results, if available
-            results = sp.next(results) if results['next'] else None
-
-    except Exception as e:
-        logging.error(f"Failed to fetch tracks from playlist {playlist_id}: {e}")
-    
+        with open(file_path, 'r') as file:
+            profiles = json.load(file)
+    except FileNotFoundError:
+        profiles = {'AU': {'name': 'Australia & New Zealand', 'seed_playlist': '37i9dQZF1DWT2SPAYawYcO'}}
+
+    markets = {}
+    for code, profile in profiles.items():
+        if not profile.get('enabled', True):
+            continue
+        playlists = profile.get('playlists', playlists_path)
+        if isinstance(playlists, str):
+            playlists = load_playlists(playlists)
+        markets[code] = {'name': profile['name'], 'seed_playlist': profile['seed_playlist'], 'playlists': playlists}
+    return markets
+
+
+# Number of playlists fetched in parallel (and size of the shared HTTP connection pool)
+MAX_WORKERS = int(os.getenv('SPOTIFY_MAX_WORKERS', '8'))
+
+# Client-credentials token persisted between runs and worker restarts
+SPOTIFY_TOKEN_CACHE_PATH = os.getenv('SPOTIFY_TOKEN_CACHE_PATH', '.spotify_token_cache')
+
+
+def _token_cache_handler(cache_path):
+    """
+    Builds a Spotipy cache handler that keeps the access token in memory and mirrors it to `cache_path`.
+
+    Spotipy asks its cache handler for the token before every request. The default file handler re-reads the
+    file each time, and concurrent fetch threads would race on it; this one only reads the file once.
+    """
+    from spotipy.cache_handler import CacheFileHandler
+
+    class TokenCacheHandler(CacheFileHandler):
+        def __init__(self):
+            super().__init__(cache_path=cache_path)
+            self._lock = threading.Lock()
+            self._token_info = None
+            self._loaded = False
+
+        def get_cached_token(self):
+            with self._lock:
+                if not self._loaded:
+                    self._token_info = super().get_cached_token()
+                    self._loaded = True
+                return self._token_info
+
+        def save_token_to_cache(self, token_info):
+            with self._lock:
+                self._token_info = token_info
+                self._loaded = True
+                # Market worker processes share the file - write a per-process temporary file and swap it in,
+                # so no process ever reads a half-written token
+                temp_path = f"{cache_path}.{os.getpid()}.tmp"
+                try:
+                    with open(temp_path, 'w') as file:
+                        json.dump(token_info, file)
+                    os.replace(temp_path, cache_path)
+                except OSError as e:
+                    logging.warning(f"Couldn't write token to cache at {cache_path}: {e}")
+
+    return TokenCacheHandler()
+
+
+# Point the client at another Spotify API / token endpoint, e.g. the local stand-in in benchmarks/fake_spotify.py
+SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL')
+SPOTIFY_TOKEN_URL = os.getenv('SPOTIFY_TOKEN_URL')
+
+
+def build_spotify_client(client_id, client_secret, max_workers=MAX_WORKERS, token_cache_path=SPOTIFY_TOKEN_CACHE_PATH,
+                         api_url=SPOTIFY_API_URL, token_url=SPOTIFY_TOKEN_URL, retry_status_codes=None):
+    """
+    Builds a Spotipy client whose requests share one pooled HTTP session, sized for `max_workers` concurrent fetches.
+
+    Args:
+    - client_id (str): Spotify API client ID.
+    - client_secret (str): Spotify API client secret.
+    - max_workers (int): Number of threads that will use the client at once.
+    - token_cache_path (str): File the access token is cached in until it expires.
+    - api_url (str, optional): Base URL of the Web API, ending in '/'. Defaults to Spotify's.
+    - token_url (str, optional): URL of the client-credentials token endpoint. Defaults to Spotify's.
+    - retry_status_codes (tuple, optional): HTTP statuses retried by the session. Defaults to Spotipy's, which include 429.
+
+    Returns:
+    - spotipy.Spotify: A client-credentials authenticated Spotipy client.
+    """
+    import requests
+    import spotipy
+    from requests.adapters import HTTPAdapter
+    from spotipy.oauth2 import SpotifyClientCredentials
+    from urllib3.util.retry import Retry
+
+    # Spotipy only mounts its retry policy on sessions it creates itself, so mirror its defaults here
+    if retry_status_codes is None:
+        retry_status_codes = spotipy.Spotify.default_retry_codes
+    retry = Retry(
+        total=spotipy.Spotify.max_retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=spotipy.Spotify.max_retries,
+        backoff_factor=0.3,
+        status_forcelist=retry_status_codes,
+        # urllib3 otherwise retries any 429 carrying Retry-After, even with 429 left out of the retried statuses
+        respect_retry_after_header=429 in retry_status_codes,
+    )
+
+    session = requests.Session()
+    # Response sizes count towards the pull's stage metrics
+    session.hooks['response'].append(_record_response_bytes)
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    client_credentials_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret,
+                                                          requests_session=session,
+                                                          cache_handler=_token_cache_handler(token_cache_path))
+    if token_url:
+        client_credentials_manager.OAUTH_TOKEN_URL = token_url
+
+    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager, requests_session=session)
+    if api_url:
+        sp.prefix = api_url
+    return sp
+
+
+def _record_response_bytes(response, *args, **kwargs):
+    record(bytes_received=len(response.content))
+
+
+# Server errors are retried by the HTTP session. 429s are left to rate_limit.RequestScheduler, which honours
+# Retry-After across all fetch threads instead of each thread backing off on its own.
+SCHEDULED_RETRY_CODES = (500, 502, 503, 504)
+
+
+@lru_cache(maxsize=None)
+def get_spotify_client(max_workers=MAX_WORKERS):
+    """
+    Returns the process-wide Spotipy client, creating it on first use from the CLIENT_ID / CLIENT_SECRET environment variables.
+    The scheduled worker re-uses it across runs, so each run re-uses the cached token instead of re-authenticating.
+
+    Rate-limited (429) responses are not retried by the client itself - wrap it in a `rate_limit.RateLimitedSpotify`.
+
+    Args:
+    - max_workers (int): Number of threads that will use the client at once.
+
+    Returns:
+    - spotipy.Spotify: A client-credentials authenticated Spotipy client.
+    """
+    return build_spotify_client(os.getenv('CLIENT_ID'), os.getenv('CLIENT_SECRET'), max_workers,
+                                retry_status_codes=SCHEDULED_RETRY_CODES)
+
+# Fields requested for the single per-playlist snapshot fetch. Metadata and the first page of items come back in one call.
+PLAYLIST_SNAPSHOT_FIELDS = "followers.total,images,description,snapshot_id,tracks.items.track(id,name,artists.name,external_ids.isrc),tracks.next"
+
+# Fields requested when the playlist's tracks may be re-used from the cache - metadata only
+PLAYLIST_METADATA_FIELDS = "followers.total,images,description,snapshot_id"
+
+# Fields requested for every following page of playlist items
+PLAYLIST_ITEMS_FIELDS = "items.track(id,name,artists.name,external_ids.isrc),next"
+
+def parse_track_items(items):
+    """
+    Converts a page of playlist items into (track ID, track name, concatenated artist names, ISRC) tuples.
+
+    Args:
+    - items (list): The 'items' list of a playlist items page returned by the Spotify API.
+
+    Returns:
+    - list: A list of tuples, each containing a track ID, track name, concatenated artist names and ISRC.
+      The track ID is None for local files and the ISRC is None when Spotify does not provide one.
+    """
+    track_details = []
+    for item in items:
+        track = item['track']
+        if track:  # Ensure the track information exists
+            track_name = track['name']
+            artist_names = ', '.join(artist['name'] for artist in track['artists'])
+            isrc = (track.get('external_ids') or {}).get('isrc')
+            track_details.append((track.get('id'), track_name, artist_names, isrc))
     return track_details
 
-def find_tracks_positions_in_playlists(sp, track_details, playlists_dict):
+def iter_tracks(items):
+    """
+    Parses playlist items one at a time (see `parse_track_items`).
+
+    Yields:
+    - tuple: (track ID, track name, concatenated artist names, ISRC) for every item that has a track.
+    """
+    for item in items:
+        yield from parse_track_items([item])
+
+def iter_playlist_items(sp, playlist_id, first_page=None):
+    """
+    Yields a playlist's raw items page by page, so only one page of items is held in memory at a time.
+
+    Args:
+    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
+    - playlist_id (str): The Spotify ID of the playlist.
+    - first_page (dict, optional): The first page of items, when it already came embedded in the playlist object.
+
+    Yields:
+    - dict: The playlist's items as returned by the Spotify API, in playlist order.
+    """
+    results = first_page or sp.playlist_items(playlist_id, fields=PLAYLIST_ITEMS_FIELDS)
+    offset = 0
+    while True:
+        yield from results['items']
+        offset += len(results['items'])
+        if not results['next']:
+            return
+        results = sp.playlist_items(playlist_id, fields=PLAYLIST_ITEMS_FIELDS, offset=offset)
+
+def open_playlist(sp, playlist_id, cache=None):
     """
-    Finds the positions of specified tracks in multiple playlists, including their names and artist names.
+    Fetches a playlist's followers, cover image, description and snapshot ID, and returns them with a lazy iterator
+    over its tracks. The metadata and the first page of tracks come from one projected `sp.playlist` call, so each
+    playlist costs 1 + (number of extra 100-track pages) requests.
+
+    When the playlist is in the cache, only the metadata is requested first. If its snapshot ID is unchanged the items
+    are read back from the cache file and the playlist costs a single request. Otherwise the items are written to the
+    cache as they are iterated. The cache keeps the raw items, so a change to `parse_track_items` applies to cached
+    playlists as well.
 
     Args:
     - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
-    - track_details (list): A list of tuples with track names and their corresponding artist names.
+    - playlist_id (str): The Spotify ID of the playlist to fetch.
+    - cache (PlaylistCache, optional): The market's playlist cache.
+
+    Returns:
+    - tuple: A dictionary with 'snapshot_id', 'followers', 'image_url', 'description' and 'from_cache' keys, and an
+      iterator of (track ID, track name, concatenated artist names, ISRC) tuples. The iterator must be consumed
+      to the end for the cache to be updated.
+    """
+    cached_snapshot_id = cache.snapshot_id(playlist_id) if cache else None
+    if cached_snapshot_id:
+        playlist = sp.playlist(playlist_id, fields=PLAYLIST_METADATA_FIELDS)
+        # Playlist has not changed since the last run
+        from_cache = playlist.get('snapshot_id') == cached_snapshot_id
+        items = cache.items(playlist_id) if from_cache else iter_playlist_items(sp, playlist_id)
+    else:
+        playlist = sp.playlist(playlist_id, fields=PLAYLIST_SNAPSHOT_FIELDS)
+        from_cache = False
+        # First page of items is embedded in the playlist object
+        items = iter_playlist_items(sp, playlist_id, playlist['tracks'])
+
+    if cache and not from_cache:
+        items = cache.store(playlist_id, playlist.get('snapshot_id'), items)
+
+    images = playlist.get('images') or []
+
+    snapshot = {
+        'snapshot_id': playlist.get('snapshot_id'),
+        'followers': playlist['followers']['total'],
+        'image_url': images[0]['url'] if images else 'No image available',
+        'description': playlist.get('description') or 'No description available',
+        'from_cache': from_cache,
+    }
+    return snapshot, iter_tracks(items)
+
+def get_playlist_snapshot(sp, playlist_id, cache=None):
+    """
+    Fetches everything the data pull needs from a playlist, with its whole track list (see `open_playlist`).
+    Used for the seed playlist, whose tracks are indexed for matching.
+
+    Args:
+    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
+    - playlist_id (str): The Spotify ID of the playlist to fetch.
+    - cache (PlaylistCache, optional): The market's playlist cache.
+
+    Returns:
+    - dict: A dictionary with 'snapshot_id', 'followers', 'image_url', 'description', 'tracks' and 'from_cache' keys.
+      'tracks' is a list of (track ID, track name, concatenated artist names, ISRC) tuples.
+    """
+    snapshot, tracks = open_playlist(sp, playlist_id, cache)
+    snapshot['tracks'] = list(tracks)
+    return snapshot
+
+def get_playlist_matches(sp, playlist_id, track_index, cache=None):
+    """
+    Fetches a playlist and matches its tracks against `track_index` while its pages stream in. Only the matches are
+    kept, never the playlist's track list.
+
+    Args:
+    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
+    - playlist_id (str): The Spotify ID of the playlist to fetch.
+    - track_index (tuple): The seed playlist's index from `build_track_index`.
+    - cache (PlaylistCache, optional): The market's playlist cache.
+
+    Returns:
+    - dict: A dictionary with 'snapshot_id', 'followers', 'image_url', 'description', 'matches' and 'from_cache' keys.
+      'matches' is a list of (track ID, position) tuples.
+    """
+    with stage('playlist_fetch'):
+        snapshot, tracks = open_playlist(sp, playlist_id, cache)
+    # Fetching the following pages (and reading or writing the cache) still counts as playlist_fetch
+    with stage('matching'):
+        snapshot['matches'] = list(match_positions(track_index, timed_iter(tracks, 'playlist_fetch')))
+    return snapshot
+
+def iter_playlists_concurrently(fetch, sp, playlists_dict, max_workers=MAX_WORKERS):
+    """
+    Runs `fetch(sp, playlist_id)` for every playlist on a bounded thread pool and yields the results as they can be
+    handed out in order.
+
+    Args:
+    - fetch (callable): Function taking the Spotipy client and a playlist ID.
+    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
     - playlists_dict (dict): A dictionary mapping playlist names to their Spotify IDs.
+    - max_workers (int): Maximum number of playlists fetched at the same time.
+
+    Yields:
+    - tuple: (playlist name, fetch result), in the same order as `playlists_dict`.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(playlist_name, executor.submit(fetch, sp, playlist_id)) for playlist_name, playlist_id in playlists_dict.items()]
+        try:
+            # Collect in submission order so the output does not depend on which fetch finishes first
+            for playlist_name, future in futures:
+                yield playlist_name, future.result()
+        finally:
+            # A failed fetch (or a consumer that stops early) leaves the playlists not started yet unfetched
+            for _, future in futures:
+                future.cancel()
+
+def fetch_playlists_concurrently(fetch, sp, playlists_dict, max_workers=MAX_WORKERS):
+    """
+    Runs `fetch(sp, playlist_id)` for every playlist on a bounded thread pool.
+
+    Args:
+    - fetch (callable): Function taking the Spotipy client and a playlist ID.
+    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
+    - playlists_dict (dict): A dictionary mapping playlist names to their Spotify IDs.
+    - max_workers (int): Maximum number of playlists fetched at the same time.
 
     Returns:
-    - dict: A dictionary with track names and artist names as keys, detailing their presence and positions in playlists.
+    - dict: A dictionary mapping playlist names to the fetch result, in the same order as `playlists_dict`.
     """
-    track_positions = {}
+    return dict(iter_playlists_concurrently(fetch, sp, playlists_dict, max_workers))
+
+# Directory of the snapshot_id / track list cache kept between scheduled runs
+PLAYLIST_CACHE_DIR = os.getenv('PLAYLIST_CACHE_DIR', 'playlist_cache')
 
-    # Prepare a dictionary mapping track names and artist names to their details
-    track_info_dict = {(name, artist): {'track_name': name, 'artist_name': artist, 'playlists': []} for name, artist in track_details}
+# Bumped whenever the stored items change shape, so caches written by older code are ignored
+PLAYLIST_CACHE_VERSION = 4
 
-    for playlist_name, playlist_id in playlists_dict.items():
+def market_cache_dir(market, directory=PLAYLIST_CACHE_DIR):
+    """
+    Returns the playlist cache directory of `market`, e.g. 'playlist_cache/uk'.
+    """
+    return os.path.join(directory, market.lower())
+
+class PlaylistCache:
+    """
+    Snapshot IDs and playlist items kept between runs, in one JSON lines file per playlist: a header line with the
+    snapshot ID, then one line per raw playlist item. The files are read and written a line at a time, so a playlist's
+    items are never all in memory.
+
+    Args:
+    - directory (str): Directory of the cache files. Created on the first write.
+    """
+
+    def __init__(self, directory=PLAYLIST_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, playlist_id):
+        return os.path.join(self.directory, f"{playlist_id}.jsonl")
+
+    def snapshot_id(self, playlist_id):
+        """
+        Returns the snapshot ID the playlist was cached at, or None if there is no usable cache entry.
+        """
         try:
-            # Fetch tracks and their artists from each playlist
-            playlist_tracks = get_playlist_tracks_and_artists(sp, playlist_id)
-            for position, (track_name, artist_names) in enumerate(playlist_tracks, start=1):
-                key = (track_name, artist_names)
-                if key in track_info_dict:
-                    
-                    # Record the playlist and position for each matching track
-                    track_info_dict[key]['playlists'].append({
-                        'playlist': playlist_name,
-                        'position': position
-                    })
-        except Exception as e:
-            print(f"Error processing playlist {playlist_name}: {e}")
-
-    # Format the output dictionary to include track names, artist names, and their playlist positions
-    track_positions = {f"{name} - {artist}": info for (name, artist), info in track_info_dict.items()}
-
-    return track_positions
+            with open(self._path(playlist_id), 'r') as file:
+                header = json.loads(file.readline())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if header.get('version') != PLAYLIST_CACHE_VERSION:
+            logging.info(f"Ignoring cached playlist {playlist_id} written by an older version.")
+            return None
+        return header.get('snapshot_id')
+
+    def items(self, playlist_id):
+        """
+        Yields the cached items of the playlist.
+        """
+        with open(self._path(playlist_id), 'r') as file:
+            file.readline()  # Header
+            for line in file:
+                yield json.loads(line)
+
+    def store(self, playlist_id, snapshot_id, items):
+        """
+        Passes `items` through while writing them to the playlist's cache file.
+
+        The file is written to a temporary name first and only replaces the cached entry once `items` is exhausted,
+        so a fetch that fails half-way never leaves a partial playlist behind.
+
+        Yields:
+        - dict: The playlist items of `items`.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        file = tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False)
+        temp_path = file.name
+        try:
+            with file:
+                file.write(json.dumps({'version': PLAYLIST_CACHE_VERSION, 'snapshot_id': snapshot_id}) + '\n')
+                for item in items:
+                    file.write(json.dumps(item) + '\n')
+                    yield item
+            if snapshot_id:
+                os.replace(temp_path, self._path(playlist_id))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+def build_track_index(track_details):
+    """
+    Indexes the seed playlist's tracks for matching. Local files have no ID and cannot be matched.
+
+    Args:
+    - track_details (list): A list of (track ID, track name, artist names, ISRC) tuples.
+
+    Returns:
+    - tuple: A dictionary mapping track IDs to their track tuple, and a fallback dictionary mapping ISRCs to track IDs.
+    """
+    tracks_by_id = {track[0]: track for track in track_details if track[0]}
+
+    # Fallback key: ISRC -> track ID of the release
+    isrc_index = {}
+    for track_id, _, _, isrc in track_details:
+        if track_id and isrc:
+            isrc_index.setdefault(isrc, track_id)
+
+    return tracks_by_id, isrc_index
+
+def match_positions(track_index, playlist_tracks):
+    """
+    Finds the indexed tracks in one playlist. Tracks are matched on their Spotify track ID, so artist ordering, renames
+    and songs sharing a title do not affect the result. Playlist tracks whose ID does not match are matched on ISRC,
+    which catches releases a playlist carries under another track ID (relinked tracks, the single vs. the album version).
+
+    Args:
+    - track_index (tuple): The seed playlist's index from `build_track_index`.
+    - playlist_tracks (iterable): The playlist's track tuples, in playlist order. Consumed lazily.
+
+    Yields:
+    - tuple: (track ID of the matched seed track, 1-based position in the playlist).
+    """
+    tracks_by_id, isrc_index = track_index
+    matched = set()
+    for position, (track_id, _, _, isrc) in enumerate(playlist_tracks, start=1):
+        if track_id not in tracks_by_id:
+            track_id = isrc_index.get(isrc)
+        # A release found twice in one playlist (both versions) keeps its highest position
+        if track_id is None or track_id in matched:
+            continue
+        matched.add(track_id)
+        yield track_id, position
+
+
+# Extracts the featured cover artist from a playlist description
+def parse_cover_artist(playlist_description):
+    # Define regex patterns
+    # Case-insensitive 
+    patterns = [
+        r'cover:\s*(.*?)$',  # Pattern for "Cover: artist_name"
+        r'\.\s*([^\.]+)$'    # Pattern for "sentence. artist_name", as a fallback
+    ]
+
+    for pattern in patterns:
+        match = re.search(pattern, playlist_description, re.IGNORECASE)
+        if match:
+            cover_artist = match.group(1).strip()
+            if cover_artist and cover_artist.lower() != "no cover artist found":
+                return cover_artist  # If a valid cover artist is found, stop looking through other patterns
+    return None
 
 
 # Code for the 'about' section' - User input for a Playlist ID submission 
@@ -131,3 +575,23 @@ def is_valid_spotify_link(link):
 def is_correct_track(track, artist, title):
     return track['artists'][0]['name'].lower() == artist.lower() and track['name'].lower() == title.lower()
 
+
+
+# Artists whose stylisation is lost somewhere between Spotify and the coverage table, by lower-case name
+ARTIST_NAME_CORRECTIONS = {
+    'charli xcx': 'Charli xcx',
+    # Add more special cases here
+}
+
+
+def correct_artist_name(name):
+    if name is None:
+        return name
+    return ARTIST_NAME_CORRECTIONS.get(name.lower(), name)  # Return the original name without modification
+
+
+# Splits a release's artist credit ("Artist A, Artist B") into its artists, with the correct stylisation
+def split_artists(artists):
+    if not artists:
+        return []
+    return [correct_artist_name(name) for name in artists.split(', ')]
@@ -6,12 +6,11 @@ import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import json
 import plotly.express as px
-from sqlalchemy import create_engine, text
-import os
 
-from PIL import Image
-import requests
-from io import BytesIO
+from database import DEFAULT_MARKET
+from data_access import fetch_latest_week, fetch_week
+from metrics import release_index
+from cover_cache import cover_image, cover_images, warm_cover_cache
 
 
 # Set right aligned note about Desktop viewing 
@@ -31,12 +30,6 @@ with col3:
         unsafe_allow_html=True,
     )
     
-# Setup DATABASE_URL and engine
-DATABASE_URL = os.getenv('DATABASE_URL')
-if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-engine = create_engine(DATABASE_URL)
-
 
 ##################################
 # TITLE INFO
@@ -90,19 +83,16 @@ st.subheader(most_recent_friday_str)
 
 @st.cache_data(ttl=350, show_spinner='Fetching New Releases...')
 def load_db_for_most_recent_date():
-    query = text("""
-    SELECT * FROM nmf_spotify_coverage
-    WHERE "Date" = (SELECT MAX("Date") FROM nmf_spotify_coverage)
-    """)
-    with engine.connect() as connection:
-        result = connection.execute(query)
-        # Ensure columns are correctly extracted from result
-        columns = result.keys()  # list of column names
-        latest_friday_df = pd.DataFrame(result.fetchall(), columns=columns)
-    return latest_friday_df
-
-# Main dataframe to use for home.py 
-latest_friday_df = load_db_for_most_recent_date()
+    # Latest week from the weeks catalog, rather than scanning the coverage table
+    summary, week_df = fetch_week(fetch_latest_week(DEFAULT_MARKET), DEFAULT_MARKET)
+    # Thumbnails of every cover of the week, downloaded together once per load instead of one by one as they render
+    warm_cover_cache([cover['image_url'] for cover in summary['cover_artists']]
+                     + ([summary['nmf_cover']['image_url']] if summary['nmf_cover'] else []))
+    # Releases and their playlists for "Search Adds By Song", built once per load rather than on every rerun
+    return summary, week_df, release_index(week_df)
+
+# Main summary and dataframe to use for home.py 
+summary, latest_friday_df, (release_choices, release_rows) = load_db_for_most_recent_date()
 
 # Set columns for metrics 
 col1, col2 = st.columns([50, 50])  
@@ -130,37 +120,22 @@ st.markdown(
                 unsafe_allow_html=True
             )
 
-# Filter the DataFrame to get rows matching the NMF playlist
-filtered_df = latest_friday_df[latest_friday_df['Playlist'] == "New Music Friday AU & NZ"]
-
-# Function to load image from URL
-def load_image_from_url(url):
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            image = Image.open(BytesIO(response.content))
-            return image
-        else:
-            return None
-    except Exception as e:
-        print(f"Error loading image: {e}")
-        return None
-
-# Filter the DataFrame to get rows matching the NMF playlist
-filtered_df = latest_friday_df[latest_friday_df['Playlist'] == "New Music Friday AU & NZ"]
+# NMF cover image and artist, if the NMF playlist has a cover
+nmf_cover = summary['nmf_cover']
 
-# Ensure the filtered DataFrame is not empty and the Image_URL is not null before extracting the Image URL
-if not filtered_df.empty and pd.notna(filtered_df['Image_URL'].iloc[0]):
-    image_url = filtered_df['Image_URL'].iloc[0]
-    cover_artist = filtered_df['Cover_Artist'].iloc[0] if 'Cover_Artist' in filtered_df.columns and pd.notna(filtered_df['Cover_Artist'].iloc[0]) else None
+# Ensure the NMF playlist was found and has an Image_URL before extracting the Image URL
+if nmf_cover:
+    image_url = nmf_cover['image_url']
+    cover_artist = nmf_cover['cover_artist']
 
     if image_url:  # Check if the URL is not empty
-        todays_cover_image = load_image_from_url(image_url)
+        # Cached thumbnail, downloaded once rather than on every visit
+        todays_cover_image = cover_image(image_url)
         if todays_cover_image:
             if cover_artist:
-                col2.image(image_url, caption=f"Cover Artist: {cover_artist}", width=300)
+                col2.image(todays_cover_image, caption=f"Cover Artist: {cover_artist}", width=300)
             else:
-                col2.image(image_url, width=300)
+                col2.image(todays_cover_image, width=300)
                 col2.write("Cover Artist not available.")
         else:
             col2.write("Failed to load image from URL.")
@@ -203,21 +178,11 @@ else:
 # HIGHEST REACH METRIC 
 #######################
 
-# Assuming latest_friday_df is your DataFrame
-# Group by 'Title' and 'Artist', then sum the 'Followers' column
-highest_reach = latest_friday_df.groupby(['Title', 'Artist'])['Followers'].sum().reset_index(name='Reach')
-
-# Find the maximum reach
-max_reach = highest_reach['Reach'].max()
-
-# Filter to get the titles with the maximum reach
-highest_reach_max = highest_reach[highest_reach['Reach'] == max_reach].reset_index(drop=True)
-
-# Collect all artist-title pairs into a list (without including the reach value)
-artist_title_pairs = [f"{row['Artist']} - '{row['Title']}'" for _, row in highest_reach_max.iterrows()]
+# Total reach of the releases with the highest reach, summed over their playlists
+max_reach = summary['highest_reach']['reach']
 
-# Sort the list alphabetically
-artist_title_pairs.sort()
+# Collect all artist-title pairs into a list (without including the reach value), sorted alphabetically
+artist_title_pairs = [f"{artist} - '{title}'" for artist, title in summary['highest_reach']['releases']]
 
 # Prepare the HTML string without bullet points, using line breaks to separate items
 artist_title_html = "<div style='margin-top: -10px;'>" + "<br>".join(artist_title_pairs) + "</div>"
@@ -236,17 +201,11 @@ with col1:
 # MOST ADDED METRIC
 #######################
 
-# Assuming latest_friday_df is your DataFrame
-# Find the titles with the most entries
-most_added = latest_friday_df.groupby(['Title', 'Artist']).size().reset_index(name='Count')
-max_count = most_added['Count'].max()
-most_added_max = most_added[most_added['Count'] == max_count].reset_index(drop=True)
+# Number of playlists the most added releases were added to
+max_count = summary['most_added']['count']
 
-# Collect all artist-title pairs into a list
-artist_title_pairs = [f"{row['Artist']} - '{row['Title']}'" for _, row in most_added_max.iterrows()]
-
-# Sort the list alphabetically
-artist_title_pairs.sort()
+# Collect all artist-title pairs into a list, sorted alphabetically
+artist_title_pairs = [f"{artist} - '{title}'" for artist, title in summary['most_added']['releases']]
 
 # Prepare the HTML string without bullet points, using line breaks to separate items
 artist_title_html = "<div style='margin-top: -10px;'>" + "<br>".join(artist_title_pairs) + "</div>"
@@ -265,21 +224,11 @@ with col1:
 # HIGHEST AVERAGE PLAYLIST POSITION 
 ####################################
 
-# Use latest_friday_df from earlier in the code
-# Group by 'Title' and 'Artist', then find the average 'Position'
-avg_position = latest_friday_df.groupby(['Title', 'Artist'])['Position'].mean().reset_index(name='AvgPosition')
-
-# Find the minimum average position
-min_avg_position = avg_position['AvgPosition'].min()
-
-# Filter to get the titles and artists with the minimum average position
-lowest_avg_position = avg_position[avg_position['AvgPosition'] == min_avg_position].reset_index(drop=True)
+# Lowest average position of a release across its playlists
+min_avg_position = summary['highest_average_position']['position']
 
-# Collect all artist-title pairs into a list
-artist_title_pairs = [f"{row['Artist']} - '{row['Title']}'" for _, row in lowest_avg_position.iterrows()]
-
-# Sort the list alphabetically
-artist_title_pairs.sort()
+# Collect all artist-title pairs with that average position into a list, sorted alphabetically
+artist_title_pairs = [f"{artist} - '{title}'" for artist, title in summary['highest_average_position']['releases']]
 
 # Prepare the HTML string without bullet points, using line breaks to separate items
 artist_title_html = "<div style='margin-top: -10px;'>" + "<br>".join(artist_title_pairs) + "</div>"
@@ -315,24 +264,13 @@ st.write(
     unsafe_allow_html=True,
 )
 
-# Use latest_friday_df from earlier in the code
-top_artists_reach = latest_friday_df.groupby(['Artist', 'Title']).agg({
-    'Followers': 'sum',
-    'Playlist': lambda x: list(x.unique())  # Creates a list of unique playlists for each artist
-})
-
-# Sort the DataFrame based on 'Followers' while maintaining the whole DataFrame
-sorted_top_artists_reach = top_artists_reach.sort_values(by='Followers', ascending=False)
-
-# Select the top 5 artists while keeping all columns ('Followers' and 'Playlist')
-results_with_playlist = sorted_top_artists_reach.head(5).copy()
+# Top 5 releases by reach, with the list of unique playlists each was added to
+results_with_playlist = pd.DataFrame(summary['top_reach'], columns=['artist', 'title', 'followers', 'playlists']) \
+    .rename(columns={'artist': 'Artist', 'title': 'Title', 'followers': 'Followers', 'playlists': 'Playlist'})
 
 # Join the playlist names with '<br>' to create a single string with line breaks
 results_with_playlist['Playlists_str'] = results_with_playlist['Playlist'].apply(lambda x: '<br>'.join(x))
 
-# Ensure 'Artist' is a column for Plotly (if 'Artist' was the index)
-results_with_playlist = results_with_playlist.reset_index()
-
 # Combine 'Artist' and 'Title' into a unique identifier
 results_with_playlist['Artist_Title'] = results_with_playlist['Artist'] + ' - ' + results_with_playlist['Title']
 
@@ -396,33 +334,11 @@ st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
 
 st.subheader('Search Adds By Song:')
 
-# Combine Artist & Title for the first dropdown box: 
-# Use latest_friday_df from earlier in the code
-
-# Filter out rows where either 'Artist' or 'Title' is null for dropdown creation
-filtered_df_for_artist_title = latest_friday_df.dropna(subset=['Artist', 'Title'])
-
-# Temporarily create 'Artist_Title' in the filtered dataframe for dropdown options
-filtered_df_for_artist_title['Artist_Title'] = filtered_df_for_artist_title['Artist'] + " - " + filtered_df_for_artist_title['Title']
-
-# Ensure unique values and sort them for the dropdown
-choices = filtered_df_for_artist_title['Artist_Title'].unique()
-sorted_choices = sorted(choices, key=lambda x: x.lower())
-
-# Dropdown for user to select an artist and title
-selected_artist_title = st.selectbox('Select New Release:', sorted_choices)
-
-# Add 'Artist_Title' to the original dataframe for filtering based on the dropdown selection
-latest_friday_df['Artist_Title'] = latest_friday_df.apply(lambda row: f"{row['Artist']} - {row['Title']}" if pd.notnull(row['Artist']) and pd.notnull(row['Title']) else None, axis=1)
+# Dropdown for user to select an artist and title, from the week's release index
+selected_artist_title = st.selectbox('Select New Release:', release_choices)
 
-# Now filter the original DataFrame based on selection, this time it includes 'Artist_Title'
-filtered_df = latest_friday_df[latest_friday_df['Artist_Title'] == selected_artist_title].drop(columns=['Artist', 'Title', 'Artist_Title'])
-
-# Ensure 'Followers' is numeric for proper sorting
-filtered_df['Followers'] = pd.to_numeric(filtered_df['Followers'], errors='coerce')
-
-# Continue with sorting and displaying the data 
-ordered_filtered_df = filtered_df.sort_values(by='Followers', ascending=False)
+# The release's playlists, already ordered by 'Followers'
+ordered_filtered_df = pd.DataFrame(release_rows.get(selected_artist_title, []), columns=['Playlist', 'Position', 'Followers'])
 
 #### By removing this line, ordered_filtered_df['Followers'] remains in a numeric format, which should allow Streamlit to handle sorting properly when you click on the column headers in the displayed DataFrame.
 # # Before displaying, round 'Followers' to no decimal places and format
@@ -471,14 +387,9 @@ else:
 # Cover Artists DataFrame 
 #################################################
 
-# Filter out rows where either 'Cover_Artist' or 'Image_URL' is None before grouping
-# Use latest_friday_df from earlier in the code
-filtered_df = latest_friday_df.dropna(subset=['Cover_Artist', 'Image_URL'])
-
-new_cover_artist_df = filtered_df.groupby('Playlist').agg({
-    'Image_URL': 'first',
-    'Cover_Artist': 'first'
-}).reset_index()
+# Playlists with a cover artist, with their cover image
+new_cover_artist_df = pd.DataFrame(summary['cover_artists'], columns=['playlist', 'cover_artist', 'image_url']) \
+    .rename(columns={'playlist': 'Playlist', 'cover_artist': 'Cover_Artist', 'image_url': 'Image_URL'})
 
 final_cover_artist_df = new_cover_artist_df[['Playlist', 'Cover_Artist']]
 
@@ -511,11 +422,12 @@ col1, col2 = st.columns(2)
 # Initialize an index for the last column, will be used if there's an odd number of images
 last_col = None
 
-# Iterate over DataFrame rows
-for index, row in new_cover_artist_df.iterrows():
-    playlist_name = row['Playlist']
-    artist_name = row['Cover_Artist']
-    image_url = row['Image_URL']
+# Thumbnails of every cover, downloaded concurrently on a cache miss
+cover_images_by_url = cover_images(new_cover_artist_df['Image_URL'])
+
+# Iterate over the covers
+for index, (playlist_name, artist_name, image_url) in enumerate(new_cover_artist_df[['Playlist', 'Cover_Artist', 'Image_URL']].itertuples(index=False)):
+    image_url = cover_images_by_url.get(image_url, image_url)
     
     # Check if we're at the last image and if it should be centered
     if index == last_image_col_index:
@@ -534,14 +446,8 @@ st.write('- - - - - -')
 # ADDS BY PLAYLIST GRAPH
 ################################
 
-# # Calculate the number of adds per playlist and sort for plotting
-# # Use latest_friday_df from earlier in the code
-
-# Filter out rows with both null 'Artist' and 'Title'
-non_null_adds_df = latest_friday_df.dropna(subset=['Artist', 'Title'])
-
-# Count the number of adds per playlist only for non-null 'Artist' and 'Title'
-adds_per_playlist = non_null_adds_df['Playlist'].value_counts().reindex(latest_friday_df['Playlist'].unique(), fill_value=0).sort_values()
+# Number of adds per playlist (playlists without adds included), sorted for plotting
+adds_per_playlist = pd.Series(dict(summary['adds_by_playlist']), dtype='int64')
 
 fig, ax = plt.subplots(figsize=(6, 8), facecolor= '#0E1117')
 adds_per_playlist.plot(kind='barh', ax=ax, color='#ab47bc')
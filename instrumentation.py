@@ -0,0 +1,306 @@
+# Per-stage metrics for the data pull: wall time, API calls, retries, bytes received and traced memory peak
+#
+# A pull runs inside `collect()`. Code along the pull marks its stages with `stage(name)`; API calls, retries and
+# bytes are recorded against the stage the calling thread is in. Stages nest: while a thread is in an inner stage
+# the outer one's clock is paused, so every second is counted towards one stage only. Outside a pull all of this
+# is a no-op, so the helpers can be called from code the dashboard imports too.
+import os
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, asdict
+
+
+# Stages of a pull, in the order they first run
+STAGES = ['seed_fetch', 'playlist_fetch', 'matching', 'cover_parsing', 'db_delete', 'db_insert', 'summary']
+
+# Trace allocations during a pull to report each stage's memory peak. Off by default - tracemalloc slows the
+# CPU-bound stages down noticeably - so the peaks stay 0 unless it is enabled here or by a benchmark.
+TRACE_MEMORY = os.getenv('PULL_TRACE_MEMORY', '0') == '1'
+
+# Prometheus text-format file the worker rewrites after every pull, e.g. for node_exporter's textfile collector
+METRICS_PATH = os.getenv('PULL_METRICS_PATH', 'pull_metrics.prom')
+
+
+@dataclass
+class StageMetrics:
+    market: str
+    stage: str
+    # Summed over the threads that ran the stage, so concurrent playlist fetches can add up to more than the run took
+    seconds: float = 0.0
+    api_calls: int = 0
+    retries: int = 0
+    bytes_received: int = 0
+    # Highest traced memory of the process while the stage was running
+    peak_memory_bytes: int = 0
+
+
+class PullMetrics:
+    """
+    Collects the stage metrics of one pull. Use the module-level helpers rather than calling this directly.
+
+    Args:
+    - trace_memory (bool): Trace allocations with tracemalloc for the memory peaks.
+    """
+
+    def __init__(self, trace_memory=TRACE_MEMORY):
+        self.trace_memory = trace_memory
+        # Market the stages are recorded for. A process only ever works on one market at a time.
+        self.market = None
+        self.started = time.perf_counter()
+        # Wall time of the run, set when it ends
+        self.seconds = None
+        self._stages = {}
+        self._running = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        # Called with the lock held
+        if key not in self._stages:
+            self._stages[key] = StageMetrics(*key)
+        return self._stages[key]
+
+    def _fold_peak(self):
+        # Called with the lock held. Credits the traced peak so far to every running stage, then starts a new peak.
+        if not self.trace_memory:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for key in self._running:
+            metrics = self._get(key)
+            metrics.peak_memory_bytes = max(metrics.peak_memory_bytes, peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Counts the time the calling thread spends in the block towards stage `name`. A `name` of None pauses the
+        thread's current stage without counting the time anywhere.
+        """
+        stack = self._local.__dict__.setdefault('stack', [])
+        key = (self.market, name) if name else None
+        now = time.perf_counter()
+        with self._lock:
+            # Pause the outer stage
+            if stack and stack[-1][0]:
+                self._get(stack[-1][0]).seconds += now - stack[-1][1]
+            if key:
+                self._fold_peak()
+                self._running[key] = self._running.get(key, 0) + 1
+                self._get(key)
+        stack.append([key, now])
+        try:
+            yield
+        finally:
+            _, started = stack.pop()
+            now = time.perf_counter()
+            if key:
+                with self._lock:
+                    self._get(key).seconds += now - started
+                    self._fold_peak()
+                    self._running[key] -= 1
+                    if not self._running[key]:
+                        del self._running[key]
+            # Resume the outer stage
+            if stack:
+                stack[-1][1] = now
+
+    def record(self, **counts):
+        """
+        Adds `counts` (e.g. api_calls=1) to the stage the calling thread is in.
+        """
+        stack = getattr(self._local, 'stack', None)
+        if not stack or not stack[-1][0]:
+            return
+        with self._lock:
+            metrics = self._get(stack[-1][0])
+            for name, value in counts.items():
+                setattr(metrics, name, getattr(metrics, name) + value)
+
+    def timed_iter(self, iterable, name):
+        """
+        See the module-level `timed_iter`. The time is measured per item without taking the lock, then moved from the
+        consuming stage to stage `name` once the iteration ends.
+        """
+        stack = self._local.__dict__.setdefault('stack', [])
+        key = (self.market, name)
+        consumer = stack[-1][0] if stack else None
+        spent = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                started = time.perf_counter()
+                # API calls and bytes recorded while the next item is produced belong to stage `name`
+                stack.append([key, started])
+                try:
+                    item = next(iterator, _DONE)
+                finally:
+                    stack.pop()
+                    spent += time.perf_counter() - started
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            with self._lock:
+                self._get(key).seconds += spent
+                if consumer:
+                    self._get(consumer).seconds -= spent
+
+    def merge(self, rows):
+        """
+        Adds stage metrics collected in another process (see `snapshot`).
+        """
+        with self._lock:
+            for row in rows:
+                metrics = self._get((row['market'], row['stage']))
+                metrics.seconds += row['seconds']
+                metrics.api_calls += row['api_calls']
+                metrics.retries += row['retries']
+                metrics.bytes_received += row['bytes_received']
+                metrics.peak_memory_bytes = max(metrics.peak_memory_bytes, row['peak_memory_bytes'])
+
+    def snapshot(self):
+        """
+        Returns the stage metrics as a list of dictionaries, ordered by market and STAGES.
+        """
+        order = {name: i for i, name in enumerate(STAGES)}
+        with self._lock:
+            stages = sorted(self._stages.values(), key=lambda m: (m.market or '', order.get(m.stage, len(order)), m.stage))
+            return [asdict(metrics) for metrics in stages]
+
+
+# Marks the end of an iterator in `PullMetrics.timed_iter`
+_DONE = object()
+
+
+# Metrics of the pull running in this process, if any
+_active = None
+
+
+@contextmanager
+def collect(trace_memory=TRACE_MEMORY):
+    """
+    Collects stage metrics for the code run inside the block.
+
+    Yields:
+    - PullMetrics: The run's metrics. `seconds` holds the run's wall time once the block is left.
+    """
+    global _active
+    metrics = PullMetrics(trace_memory)
+    # Only start tracing if nobody else (e.g. a benchmark) already is
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _active = metrics
+    try:
+        yield metrics
+    finally:
+        _active = None
+        metrics.seconds = time.perf_counter() - metrics.started
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def stage(name):
+    """
+    Marks a stage of the running pull (see `PullMetrics.stage`). Does nothing outside a pull.
+    """
+    return _active.stage(name) if _active else nullcontext()
+
+
+def idle():
+    """
+    Pauses the calling thread's stage, e.g. while it waits for other threads whose own stages count the time.
+    """
+    return stage(None)
+
+
+def record(**counts):
+    """
+    Adds `counts` to the calling thread's stage of the running pull. Does nothing outside a pull.
+    """
+    if _active:
+        _active.record(**counts)
+
+
+def timed_iter(iterable, name):
+    """
+    Passes `iterable` through, counting the time spent producing each item towards stage `name` - e.g. fetching
+    the next page of a playlist while its tracks are consumed by another stage.
+    """
+    return _active.timed_iter(iterable, name) if _active else iter(iterable)
+
+
+@contextmanager
+def for_market(market):
+    """
+    Records the stages run inside the block for `market`.
+    """
+    if not _active:
+        yield
+        return
+    previous, _active.market = _active.market, market
+    try:
+        yield
+    finally:
+        _active.market = previous
+
+
+def merge(rows):
+    """
+    Adds stage metrics collected in a worker process to the running pull.
+    """
+    if _active:
+        _active.merge(rows)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Exported per-stage metrics: (field, metric name, help text)
+PROMETHEUS_METRICS = [
+    ('seconds', 'nmf_pull_stage_seconds', 'Time spent in each stage of the last pull, summed over threads.'),
+    ('api_calls', 'nmf_pull_stage_api_calls', 'Spotify API calls made in each stage of the last pull.'),
+    ('retries', 'nmf_pull_stage_retries', 'Rate-limited Spotify API calls retried in each stage of the last pull.'),
+    ('bytes_received', 'nmf_pull_stage_bytes_received', 'Spotify API response bytes received in each stage of the last pull.'),
+    ('peak_memory_bytes', 'nmf_pull_stage_peak_memory_bytes', 'Peak traced memory while each stage of the last pull ran.'),
+]
+
+
+def write_prometheus(stage_metrics, run_seconds, status, file_path=METRICS_PATH, now=None):
+    """
+    Writes the metrics of the last pull in the Prometheus text format. The file is replaced atomically, so a
+    collector never reads a half-written file.
+
+    Args:
+    - stage_metrics (list): Output of `PullMetrics.snapshot`.
+    - run_seconds (float): Wall time of the whole pull.
+    - status (str): Ledger status of the pull, e.g. 'succeeded'.
+    - file_path (str): File to write. Nothing is written if empty.
+    - now (float, optional): Unix time of the pull's end. Defaults to the current time.
+    """
+    if not file_path:
+        return
+
+    lines = [
+        '# HELP nmf_pull_duration_seconds Wall time of the last pull.',
+        '# TYPE nmf_pull_duration_seconds gauge',
+        f'nmf_pull_duration_seconds{{status="{_escape(status)}"}} {run_seconds:.6f}',
+        '# HELP nmf_pull_last_run_timestamp_seconds Unix time the last pull finished.',
+        '# TYPE nmf_pull_last_run_timestamp_seconds gauge',
+        f'nmf_pull_last_run_timestamp_seconds{{status="{_escape(status)}"}} {now or time.time():.3f}',
+    ]
+    for field, name, help_text in PROMETHEUS_METRICS:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for metrics in stage_metrics:
+            labels = f'market="{_escape(metrics["market"] or "")}",stage="{_escape(metrics["stage"])}"'
+            lines.append(f'{name}{{{labels}}} {metrics[field]}')
+
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, file_path)
+    logging.info(f"Wrote pull metrics to {file_path}.")
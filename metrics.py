@@ -0,0 +1,186 @@
+# Weekly summaries shown on the home and historical coverage pages
+#
+# The worker computes them once per pull from the week's coverage rows and stores them in the weekly summary table
+# (see `refresh_weekly_summary`), so a page only reads one small JSON payload instead of aggregating the week's rows
+# on every rerun. Weeks without a stored summary are computed on the fly with the same `weekly_summary`.
+import logging
+
+import pandas as pd
+from sqlalchemy import text
+
+from database import COVERAGE_TABLE, DEFAULT_MARKET, WEEKLY_SUMMARY_TABLE, save_weekly_summary
+
+
+# Seed playlist whose cover is shown at the top of the pages
+NMF_PLAYLIST_NAME = "New Music Friday AU & NZ"
+
+# Columns of the coverage table the summaries and the pages' search widgets need
+WEEK_COLUMNS = ['Playlist', 'Artist', 'Title', 'Position', 'Followers', 'Image_URL', 'Cover_Artist']
+
+# Releases shown in the Top 5 Highest Reach chart
+TOP_REACH_SIZE = 5
+
+
+def load_week(conn, upload_date, market=DEFAULT_MARKET, table=COVERAGE_TABLE):
+    """
+    Loads the coverage rows of one week.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection.
+    - upload_date (str): The week, as 'YYYY-MM-DD'.
+    - market (str): Market code, e.g. 'AU'.
+    - table (str): Coverage table to read.
+
+    Returns:
+    - pd.DataFrame: The week's rows with the columns in WEEK_COLUMNS.
+    """
+    columns = ', '.join(f'"{column}"' for column in WEEK_COLUMNS)
+    result = conn.execute(text(f"""
+        SELECT {columns} FROM public.{table} WHERE "Date" = :date AND "Market" = :market
+    """), {'date': upload_date, 'market': market})
+    return pd.DataFrame(result.fetchall(), columns=WEEK_COLUMNS)
+
+
+def _number(value):
+    # JSON has no NaN - an empty week has no maximum
+    return None if pd.isna(value) else float(value)
+
+
+def _releases(stats, column, value):
+    """
+    Returns the (artist, title) pairs of the releases in `stats` (indexed by Title, Artist) whose `column` equals
+    `value`, sorted the way the pages list them.
+    """
+    matches = stats.index[stats[column].to_numpy() == value]
+    pairs = [(artist, title) for title, artist in matches]
+    return sorted(pairs, key=lambda pair: f"{pair[0]} - '{pair[1]}'")
+
+
+def weekly_summary(df, nmf_playlist=NMF_PLAYLIST_NAME):
+    """
+    Computes the summaries of one week's coverage rows: the Highest Reach, Most Added and Highest Average Playlist
+    Position releases, the Top 5 Highest Reach chart, the NMF cover, the cover artists and the adds per playlist.
+
+    The per-release figures come from a single grouped pass over the week's rows; everything else works on whole
+    columns, so no row is visited in Python.
+
+    Args:
+    - df (pd.DataFrame): The week's rows, with (at least) the columns in WEEK_COLUMNS.
+    - nmf_playlist (str): Name of the seed playlist.
+
+    Returns:
+    - dict: JSON-serialisable summaries. Releases are [artist, title] pairs.
+    """
+    # Cover-only rows have no release and drop out of the per-release figures
+    releases = df.dropna(subset=['Artist', 'Title'])
+
+    # Reach, adds and average position of every release in one pass
+    stats = releases.groupby(['Title', 'Artist'], sort=False).agg(
+        reach=('Followers', 'sum'),
+        adds=('Followers', 'size'),
+        avg_position=('Position', 'mean'),
+    )
+    max_reach, max_adds, min_avg_position = stats['reach'].max(), stats['adds'].max(), stats['avg_position'].min()
+
+    # Top 5 chart: the releases with the highest reach and the unique playlists they were added to
+    top_reach = stats.reset_index().sort_values(['reach', 'Artist', 'Title'], ascending=[False, True, True],
+                                                kind='mergesort').head(TOP_REACH_SIZE)
+    top_rows = releases.merge(top_reach[['Title', 'Artist']], on=['Title', 'Artist'])
+    top_playlists = top_rows.drop_duplicates(['Title', 'Artist', 'Playlist']) \
+        .groupby(['Title', 'Artist'], sort=False)['Playlist'].agg(list)
+
+    # Cover of the seed playlist
+    nmf_rows = df[df['Playlist'] == nmf_playlist]
+    nmf_cover = None
+    if not nmf_rows.empty and pd.notna(nmf_rows['Image_URL'].iloc[0]):
+        cover_artist = nmf_rows['Cover_Artist'].iloc[0]
+        nmf_cover = {'image_url': nmf_rows['Image_URL'].iloc[0],
+                     'cover_artist': cover_artist if pd.notna(cover_artist) else None}
+
+    # Cover artists, one per playlist
+    covers = df.dropna(subset=['Cover_Artist', 'Image_URL']).drop_duplicates('Playlist').sort_values('Playlist')
+
+    # NMF adds per playlist, playlists without any included
+    adds_per_playlist = releases['Playlist'].value_counts() \
+        .reindex(df['Playlist'].unique(), fill_value=0).sort_values(kind='mergesort')
+
+    return {
+        'highest_reach': {'reach': _number(max_reach), 'releases': _releases(stats, 'reach', max_reach)},
+        'most_added': {'count': int(max_adds) if pd.notna(max_adds) else None,
+                       'releases': _releases(stats, 'adds', max_adds)},
+        'highest_average_position': {'position': _number(min_avg_position),
+                                     'releases': _releases(stats, 'avg_position', min_avg_position)},
+        'top_reach': [{'artist': artist, 'title': title, 'followers': _number(reach),
+                       'playlists': top_playlists[(title, artist)]}
+                      for artist, title, reach in zip(top_reach['Artist'], top_reach['Title'], top_reach['reach'])],
+        'nmf_cover': nmf_cover,
+        'cover_artists': [{'playlist': playlist, 'cover_artist': cover_artist, 'image_url': image_url}
+                          for playlist, cover_artist, image_url
+                          in zip(covers['Playlist'], covers['Cover_Artist'], covers['Image_URL'])],
+        'adds_by_playlist': [[playlist, int(count)] for playlist, count in adds_per_playlist.items()],
+    }
+
+
+def release_index(df):
+    """
+    Builds the lookup behind the "Search Adds By Song" widget: every release of the week with the playlists it was
+    added to, so selecting a release is a dictionary lookup rather than a scan of the week's rows.
+
+    Args:
+    - df (pd.DataFrame): The week's rows, with (at least) the columns in WEEK_COLUMNS.
+
+    Returns:
+    - tuple: The dropdown options ("Artist - Title", sorted ignoring case) and a dict mapping each of them to its
+      (Playlist, Position, Followers) rows, highest reach first.
+    """
+    releases = df.dropna(subset=['Artist', 'Title']).sort_values('Followers', ascending=False, kind='mergesort')
+    keys = releases['Artist'] + " - " + releases['Title']
+
+    rows = {}
+    for key, playlist, position, followers in zip(keys, releases['Playlist'], releases['Position'], releases['Followers']):
+        rows.setdefault(key, []).append((playlist, position, followers))
+    return sorted(rows, key=str.lower), rows
+
+
+def refresh_weekly_summary(conn, upload_date, market=DEFAULT_MARKET, table=COVERAGE_TABLE):
+    """
+    Recomputes and stores the summary of one week from its coverage rows. Called by the worker after every write,
+    inside the write's transaction, so the pages never see rows and a summary from different pulls.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection.
+    - upload_date (str): The week, as 'YYYY-MM-DD'.
+    - market (str): Market code, e.g. 'AU'.
+    - table (str): Coverage table to read.
+
+    Returns:
+    - dict: The stored summary.
+    """
+    summary = weekly_summary(load_week(conn, upload_date, market, table))
+    save_weekly_summary(conn, upload_date, market, summary)
+    logging.info(f"Stored the weekly summary of {market} {upload_date}.")
+    return summary
+
+
+def backfill_weekly_summaries(conn, all_weeks=False, table=COVERAGE_TABLE):
+    """
+    Stores the summaries of the weeks in the coverage table that have none yet - weeks written before the worker
+    stored summaries.
+
+    Args:
+    - conn (sqlalchemy.engine.Connection): Open connection.
+    - all_weeks (bool): Recompute every week's summary, e.g. after the summary format changed.
+    - table (str): Coverage table to read.
+
+    Returns:
+    - int: Number of weeks summarised.
+    """
+    weeks = conn.execute(text(f"""
+        SELECT DISTINCT c."Date", c."Market" FROM public.{table} c
+        WHERE :all_weeks OR NOT EXISTS (
+            SELECT 1 FROM public.{WEEKLY_SUMMARY_TABLE} s WHERE s.upload_date = c."Date" AND s.market = c."Market"
+        )
+    """), {'all_weeks': all_weeks}).fetchall()
+    for upload_date, market in weeks:
+        refresh_weekly_summary(conn, upload_date, market, table)
+    return len(weeks)
@@ -0,0 +1,421 @@
+# Versioned schema migrations for the app's database
+#
+# Every change to the schema is a numbered migration in MIGRATIONS. `migrate()` applies the ones a database has not
+# seen yet, in order and each in its own transaction, and records them in the schema_migrations table. Heroku runs
+# this file in its release phase (see Procfile), before the new pages and worker start, so the pages and the worker
+# can rely on the schema instead of creating tables as they go.
+#
+# Never edit a migration that has shipped - add a new one.
+import logging
+
+from sqlalchemy import text
+
+from database import (COVERAGE_TABLE, COVERAGE_ROWS_TABLE, PLAYLIST_SNAPSHOT_TABLE, DEFAULT_MARKET, PULL_RUNS_TABLE,
+                      PULL_STAGE_METRICS_TABLE, WEEKLY_SUMMARY_TABLE, TOP_PERFORMERS_TABLE, WEEKS_TABLE,
+                      RELEASE_ARTIST_TABLE, COMPARISON_ARTISTS_TABLE, RELEASE_TRACK_TABLE)
+
+
+# Applied migrations: one row per version
+MIGRATIONS_TABLE = 'schema_migrations'
+
+# Key of the Postgres advisory lock held while migrating, so two releases never migrate at the same time
+MIGRATION_LOCK_KEY = 7_240_114
+
+
+def _create_coverage_table(conn):
+    # The table was first created by `DataFrame.to_sql`; older databases already have it, with fewer columns
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{COVERAGE_TABLE} (
+            "Date" TEXT,
+            "Artist" TEXT,
+            "Title" TEXT,
+            "Playlist" TEXT,
+            "Position" DOUBLE PRECISION,
+            "Followers" DOUBLE PRECISION,
+            "Image_URL" TEXT,
+            "Cover_Artist" TEXT
+        )
+    """))
+    # Columns later versions of the pull added. Rows written before markets existed are AU & NZ rows.
+    conn.execute(text(f"""
+        ALTER TABLE public.{COVERAGE_TABLE}
+            ADD COLUMN IF NOT EXISTS "Track_ID" TEXT,
+            ADD COLUMN IF NOT EXISTS "ISRC" TEXT,
+            ADD COLUMN IF NOT EXISTS "Market" TEXT NOT NULL DEFAULT '{DEFAULT_MARKET}'
+    """))
+
+
+def _create_pull_runs_tables(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{PULL_RUNS_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            trigger TEXT,
+            upload_date TEXT,
+            status TEXT NOT NULL,
+            started_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+            finished_at TIMESTAMPTZ,
+            duration_seconds DOUBLE PRECISION,
+            rows_inserted INTEGER,
+            rows_updated INTEGER,
+            rows_deleted INTEGER,
+            rows_unchanged INTEGER,
+            error TEXT
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{PULL_STAGE_METRICS_TABLE} (
+            run_id BIGINT NOT NULL REFERENCES public.{PULL_RUNS_TABLE} (id) ON DELETE CASCADE,
+            market TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            seconds DOUBLE PRECISION,
+            api_calls INTEGER,
+            retries INTEGER,
+            bytes_received BIGINT,
+            peak_memory_bytes BIGINT,
+            PRIMARY KEY (run_id, market, stage)
+        )
+    """))
+
+
+def _create_weekly_summary_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{WEEKLY_SUMMARY_TABLE} (
+            upload_date TEXT NOT NULL,
+            market TEXT NOT NULL,
+            summary JSONB NOT NULL,
+            computed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (upload_date, market)
+        )
+    """))
+
+
+def _create_top_performers_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{TOP_PERFORMERS_TABLE} (
+            upload_date TEXT NOT NULL,
+            market TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            title TEXT NOT NULL,
+            playlists TEXT,
+            total_followers DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (upload_date, market, artist, title)
+        )
+    """))
+    # Serves the leaderboard's top-N scan
+    conn.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS {TOP_PERFORMERS_TABLE}_market_followers_idx
+        ON public.{TOP_PERFORMERS_TABLE} (market, total_followers DESC)
+    """))
+    # Weeks written before the worker maintained the table: the top release(s) of each by reach, ties included
+    conn.execute(text(f"""
+        INSERT INTO public.{TOP_PERFORMERS_TABLE} (upload_date, market, artist, title, playlists, total_followers)
+        SELECT "Date", "Market", "Artist", "Title", playlists, total_followers
+        FROM (
+            SELECT
+                "Date", "Market", "Artist", "Title",
+                STRING_AGG(DISTINCT "Playlist", E'\\n') AS playlists,
+                SUM("Followers") AS total_followers,
+                RANK() OVER (PARTITION BY "Date", "Market" ORDER BY SUM("Followers") DESC) AS rank_within_week
+            FROM public.{COVERAGE_TABLE}
+            WHERE "Artist" IS NOT NULL AND "Title" IS NOT NULL AND "Followers" IS NOT NULL
+            GROUP BY "Date", "Market", "Artist", "Title"
+        ) ranked
+        WHERE rank_within_week = 1
+    """))
+
+
+def _type_columns(conn):
+    # Weeks as dates instead of 'YYYY-MM-DD' text, whole numbers as integers instead of to_sql's floats
+    conn.execute(text(f"""
+        ALTER TABLE public.{COVERAGE_TABLE}
+            ALTER COLUMN "Date" TYPE DATE USING "Date"::date,
+            ALTER COLUMN "Position" TYPE INTEGER USING round("Position")::integer,
+            ALTER COLUMN "Followers" TYPE BIGINT USING round("Followers")::bigint
+    """))
+    for table in (PULL_RUNS_TABLE, WEEKLY_SUMMARY_TABLE):
+        conn.execute(text(f'ALTER TABLE public.{table} ALTER COLUMN upload_date TYPE DATE USING upload_date::date'))
+    conn.execute(text(f"""
+        ALTER TABLE public.{TOP_PERFORMERS_TABLE}
+            ALTER COLUMN upload_date TYPE DATE USING upload_date::date,
+            ALTER COLUMN total_followers TYPE BIGINT USING round(total_followers)::bigint
+    """))
+
+
+def _create_coverage_indexes(conn):
+    # Every page query and the worker's merge filter on the week; the playlist search and artist lookups on the rest
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {COVERAGE_TABLE}_date_idx ON public.{COVERAGE_TABLE} ("Date")'))
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {COVERAGE_TABLE}_date_playlist_idx ON public.{COVERAGE_TABLE} ("Date", "Playlist")'))
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {COVERAGE_TABLE}_artist_idx ON public.{COVERAGE_TABLE} ("Artist")'))
+
+
+def _create_weeks_table(conn):
+    # Catalog of the weeks in the coverage table, kept up to date by the worker - the date picker and the
+    # latest-week lookup read it instead of the coverage table
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{WEEKS_TABLE} (
+            market TEXT NOT NULL,
+            upload_date DATE NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (market, upload_date)
+        )
+    """))
+    conn.execute(text(f"""
+        INSERT INTO public.{WEEKS_TABLE} (market, upload_date)
+        SELECT DISTINCT "Market", "Date" FROM public.{COVERAGE_TABLE}
+        ON CONFLICT DO NOTHING
+    """))
+
+
+def _split_playlist_snapshots(conn):
+    # Every row repeated its playlist's follower count, image URL and cover artist. They move to one row per
+    # playlist and week; the coverage rows keep the release, the playlist and the position.
+    conn.execute(text(f"""
+        CREATE TABLE public.{PLAYLIST_SNAPSHOT_TABLE} (
+            "Date" DATE NOT NULL,
+            "Market" TEXT NOT NULL,
+            "Playlist" TEXT NOT NULL,
+            "Followers" BIGINT,
+            "Image_URL" TEXT,
+            "Cover_Artist" TEXT,
+            PRIMARY KEY ("Date", "Market", "Playlist")
+        )
+    """))
+    # Rows of one playlist and week carry the same details - prefer the most complete one
+    conn.execute(text(f"""
+        INSERT INTO public.{PLAYLIST_SNAPSHOT_TABLE} ("Date", "Market", "Playlist", "Followers", "Image_URL", "Cover_Artist")
+        SELECT DISTINCT ON ("Date", "Market", "Playlist") "Date", "Market", "Playlist", "Followers", "Image_URL", "Cover_Artist"
+        FROM public.{COVERAGE_TABLE}
+        WHERE "Date" IS NOT NULL AND "Playlist" IS NOT NULL
+        ORDER BY "Date", "Market", "Playlist", "Cover_Artist" IS NULL, "Image_URL" IS NULL, "Followers" IS NULL
+    """))
+
+    # Copied into a new table rather than dropping the columns, which would leave the old table's size on disk
+    conn.execute(text(f"""
+        CREATE TABLE public.{COVERAGE_ROWS_TABLE} (
+            "Date" DATE,
+            "Market" TEXT NOT NULL DEFAULT '{DEFAULT_MARKET}',
+            "Playlist" TEXT,
+            "Track_ID" TEXT,
+            "Artist" TEXT,
+            "Title" TEXT,
+            "ISRC" TEXT,
+            "Position" INTEGER
+        )
+    """))
+    conn.execute(text(f"""
+        INSERT INTO public.{COVERAGE_ROWS_TABLE} ("Date", "Market", "Playlist", "Track_ID", "Artist", "Title", "ISRC", "Position")
+        SELECT "Date", "Market", "Playlist", "Track_ID", "Artist", "Title", "ISRC", "Position" FROM public.{COVERAGE_TABLE}
+    """))
+    conn.execute(text(f'DROP TABLE public.{COVERAGE_TABLE}'))
+    conn.execute(text(f'CREATE INDEX {COVERAGE_ROWS_TABLE}_date_idx ON public.{COVERAGE_ROWS_TABLE} ("Date")'))
+    conn.execute(text(f'CREATE INDEX {COVERAGE_ROWS_TABLE}_date_playlist_idx ON public.{COVERAGE_ROWS_TABLE} ("Date", "Playlist")'))
+    conn.execute(text(f'CREATE INDEX {COVERAGE_ROWS_TABLE}_artist_idx ON public.{COVERAGE_ROWS_TABLE} ("Artist")'))
+
+    # The old table's name and columns, so the pages' queries keep working
+    conn.execute(text(f"""
+        CREATE VIEW public.{COVERAGE_TABLE} AS
+        SELECT c."Date", c."Artist", c."Title", c."Playlist", c."Position", s."Followers", s."Image_URL",
+               s."Cover_Artist", c."Track_ID", c."ISRC", c."Market"
+        FROM public.{COVERAGE_ROWS_TABLE} c
+        LEFT JOIN public.{PLAYLIST_SNAPSHOT_TABLE} s
+            ON s."Date" = c."Date" AND s."Market" = c."Market" AND s."Playlist" = c."Playlist"
+    """))
+
+
+def _create_release_artist_tables(conn):
+    # Bridge between releases and their credited artists, read by the release comparison page instead of splitting
+    # every row's artist credit on every rerun
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{RELEASE_ARTIST_TABLE} (
+            upload_date DATE NOT NULL,
+            market TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            title TEXT NOT NULL,
+            artist_key TEXT NOT NULL,
+            artist_name TEXT NOT NULL,
+            PRIMARY KEY (upload_date, market, artist, title, artist_key)
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS {RELEASE_ARTIST_TABLE}_market_artist_key_idx
+        ON public.{RELEASE_ARTIST_TABLE} (market, artist_key)
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{COMPARISON_ARTISTS_TABLE} (
+            market TEXT NOT NULL,
+            artist_key TEXT NOT NULL,
+            artist_name TEXT NOT NULL,
+            releases INTEGER NOT NULL,
+            PRIMARY KEY (market, artist_key)
+        )
+    """))
+    # Weeks written before the worker maintained the tables. Credits are split on ', ' and names corrected like
+    # functions.split_artists did when this migration shipped; an artist credited twice with different casing keeps
+    # the last spelling.
+    conn.execute(text(f"""
+        INSERT INTO public.{RELEASE_ARTIST_TABLE} (upload_date, market, artist, title, artist_key, artist_name)
+        SELECT DISTINCT ON (upload_date, market, artist, title, artist_key)
+               upload_date, market, artist, title, artist_key, artist_name
+        FROM (
+            SELECT c."Date" AS upload_date, c."Market" AS market, c."Artist" AS artist, c."Title" AS title,
+                   lower(s.name) AS artist_key,
+                   CASE lower(s.name) WHEN 'charli xcx' THEN 'Charli xcx' ELSE s.name END AS artist_name,
+                   s.n
+            FROM (
+                SELECT DISTINCT "Date", "Market", "Artist", "Title" FROM public.{COVERAGE_ROWS_TABLE}
+                WHERE "Date" IS NOT NULL AND "Artist" <> '' AND "Title" IS NOT NULL
+            ) c
+            CROSS JOIN LATERAL regexp_split_to_table(c."Artist", ', ') WITH ORDINALITY AS s(name, n)
+        ) credits
+        ORDER BY upload_date, market, artist, title, artist_key, n DESC
+    """))
+    conn.execute(text(f"""
+        INSERT INTO public.{COMPARISON_ARTISTS_TABLE} (market, artist_key, artist_name, releases)
+        SELECT market, artist_key, MODE() WITHIN GROUP (ORDER BY artist_name), COUNT(DISTINCT title)
+        FROM public.{RELEASE_ARTIST_TABLE}
+        GROUP BY market, artist_key
+        HAVING COUNT(DISTINCT title) > 1
+    """))
+
+
+def _split_release_tracks(conn):
+    # Every row repeated its release's artist, title and ISRC. They move to one row per release and week, keyed on the
+    # track ID; the coverage rows keep the track ID, the playlist and the position.
+    conn.execute(text(f'DROP VIEW public.{COVERAGE_TABLE}'))
+
+    # Rows written before track IDs were stored have none. They get a stand-in key per artist and title - Spotify IDs
+    # never contain ':' - so their release details are kept too.
+    conn.execute(text(f"""
+        UPDATE public.{COVERAGE_ROWS_TABLE}
+        SET "Track_ID" = 'legacy:' || md5(COALESCE("Artist", '') || E'\\n' || COALESCE("Title", ''))
+        WHERE "Track_ID" IS NULL AND "Artist" IS NOT NULL
+    """))
+
+    conn.execute(text(f"""
+        CREATE TABLE public.{RELEASE_TRACK_TABLE} (
+            "Date" DATE NOT NULL,
+            "Market" TEXT NOT NULL,
+            "Track_ID" TEXT NOT NULL,
+            "Artist" TEXT,
+            "Title" TEXT,
+            "ISRC" TEXT,
+            PRIMARY KEY ("Date", "Market", "Track_ID")
+        )
+    """))
+    # Rows of one release and week carry the same details - prefer the most complete one
+    conn.execute(text(f"""
+        INSERT INTO public.{RELEASE_TRACK_TABLE} ("Date", "Market", "Track_ID", "Artist", "Title", "ISRC")
+        SELECT DISTINCT ON ("Date", "Market", "Track_ID") "Date", "Market", "Track_ID", "Artist", "Title", "ISRC"
+        FROM public.{COVERAGE_ROWS_TABLE}
+        WHERE "Date" IS NOT NULL AND "Track_ID" IS NOT NULL
+        ORDER BY "Date", "Market", "Track_ID", "Artist" IS NULL, "Title" IS NULL, "ISRC" IS NULL
+    """))
+    conn.execute(text(f'CREATE INDEX {RELEASE_TRACK_TABLE}_artist_idx ON public.{RELEASE_TRACK_TABLE} ("Artist")'))
+
+    # Copied into a new table rather than dropping the columns, which would leave the old table's size on disk
+    conn.execute(text(f'ALTER TABLE public.{COVERAGE_ROWS_TABLE} RENAME TO {COVERAGE_ROWS_TABLE}_wide'))
+    conn.execute(text(f"""
+        CREATE TABLE public.{COVERAGE_ROWS_TABLE} (
+            "Date" DATE,
+            "Market" TEXT NOT NULL DEFAULT '{DEFAULT_MARKET}',
+            "Playlist" TEXT,
+            "Track_ID" TEXT,
+            "Position" INTEGER
+        )
+    """))
+    conn.execute(text(f"""
+        INSERT INTO public.{COVERAGE_ROWS_TABLE} ("Date", "Market", "Playlist", "Track_ID", "Position")
+        SELECT "Date", "Market", "Playlist", "Track_ID", "Position" FROM public.{COVERAGE_ROWS_TABLE}_wide
+    """))
+    conn.execute(text(f'DROP TABLE public.{COVERAGE_ROWS_TABLE}_wide'))
+    conn.execute(text(f'CREATE INDEX {COVERAGE_ROWS_TABLE}_date_idx ON public.{COVERAGE_ROWS_TABLE} ("Date")'))
+    conn.execute(text(f'CREATE INDEX {COVERAGE_ROWS_TABLE}_date_playlist_idx ON public.{COVERAGE_ROWS_TABLE} ("Date", "Playlist")'))
+
+    # The old table's name and columns, so the pages' queries keep working
+    conn.execute(text(f"""
+        CREATE VIEW public.{COVERAGE_TABLE} AS
+        SELECT c."Date", r."Artist", r."Title", c."Playlist", c."Position", s."Followers", s."Image_URL",
+               s."Cover_Artist", c."Track_ID", r."ISRC", c."Market"
+        FROM public.{COVERAGE_ROWS_TABLE} c
+        LEFT JOIN public.{RELEASE_TRACK_TABLE} r
+            ON r."Date" = c."Date" AND r."Market" = c."Market" AND r."Track_ID" = c."Track_ID"
+        LEFT JOIN public.{PLAYLIST_SNAPSHOT_TABLE} s
+            ON s."Date" = c."Date" AND s."Market" = c."Market" AND s."Playlist" = c."Playlist"
+    """))
+
+
+# (version, name, function) of every migration, in the order they are applied
+MIGRATIONS = [
+    (1, 'coverage table', _create_coverage_table),
+    (2, 'pull run ledger and stage metrics', _create_pull_runs_tables),
+    (3, 'weekly summaries', _create_weekly_summary_table),
+    (4, 'top performers', _create_top_performers_table),
+    (5, 'typed date and number columns', _type_columns),
+    (6, 'coverage indexes', _create_coverage_indexes),
+    (7, 'weeks catalog', _create_weeks_table),
+    (8, 'playlist snapshots and coverage view', _split_playlist_snapshots),
+    (9, 'release artists', _create_release_artist_tables),
+    (10, 'release tracks', _split_release_tracks),
+]
+
+
+def applied_versions(conn):
+    """
+    Returns the versions of the migrations applied to the database.
+    """
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{MIGRATIONS_TABLE} (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """))
+    return {row[0] for row in conn.execute(text(f'SELECT version FROM public.{MIGRATIONS_TABLE}'))}
+
+
+def migrate(engine):
+    """
+    Applies the migrations the database has not seen yet.
+
+    Args:
+    - engine (sqlalchemy.engine.Engine): Engine of the app's database.
+
+    Returns:
+    - list: Versions applied by this call.
+    """
+    applied = []
+    # The lock belongs to this connection's session and is held until it is released below
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+        try:
+            with engine.begin() as conn:
+                done = applied_versions(conn)
+            for version, name, func in MIGRATIONS:
+                if version in done:
+                    continue
+                with engine.begin() as conn:
+                    logging.info(f"Applying migration {version}: {name}.")
+                    func(conn)
+                    conn.execute(text(f"""
+                        INSERT INTO public.{MIGRATIONS_TABLE} (version, name) VALUES (:version, :name)
+                    """), {'version': version, 'name': name})
+                applied.append(version)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MIGRATION_LOCK_KEY})
+
+    logging.info(f"Schema is at version {MIGRATIONS[-1][0]} ({len(applied)} migrations applied).")
+    return applied
+
+
+if __name__ == "__main__":
+    from sqlalchemy import create_engine
+    from database import get_database_url
+    from functions import configure_logging
+    from metrics import backfill_weekly_summaries
+
+    configure_logging()
+    engine = create_engine(get_database_url())
+    migrate(engine)
+    # Weeks written before the worker stored summaries
+    with engine.begin() as conn:
+        logging.info(f"Backfilled {backfill_weekly_summaries(conn)} weekly summaries.")
@@ -1,49 +1,32 @@
 import streamlit as st
-import os
-from sqlalchemy import create_engine, text
 import psycopg2
 import pandas as pd 
 from datetime import datetime
 import plotly.express as px
 
-from PIL import Image
-import requests
-from io import BytesIO
 import streamlit as st
 
-# Setup DATABASE_URL and engine
-DATABASE_URL = os.getenv('DATABASE_URL')
-if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-engine = create_engine(DATABASE_URL)
+from database import DEFAULT_MARKET
+from data_access import fetch_weeks, fetch_week, fetch_top_performers
+from metrics import release_index
+from cover_cache import cover_image
 
 # Function to Fetch Unique Dates from the Database
 @st.cache_data(ttl=3500, show_spinner='Fetching available dates...')
 def fetch_unique_dates():
-    query = text("SELECT DISTINCT \"Date\" FROM nmf_spotify_coverage ORDER BY \"Date\" DESC")
-    with engine.connect() as conn:
-        result = conn.execute(query)
-        unique_dates_df = pd.DataFrame(result.fetchall(), columns=result.keys())
-        # Convert the 'Date' column to datetime using the known format 'YYYY-MM-DD'
-        # 'errors='coerce'' will handle any parsing errors by converting them to NaT, which can then be filtered out
-        unique_dates_df['Date'] = pd.to_datetime(unique_dates_df['Date'], format='%Y-%m-%d', errors='coerce')
-    
-        # Filter out any rows where the date could not be parsed
-        unique_dates_df = unique_dates_df.dropna(subset=['Date'])
+    # Weeks catalog kept by the worker, rather than a DISTINCT over the coverage table
+    unique_dates = pd.to_datetime(pd.Series(fetch_weeks(DEFAULT_MARKET), dtype='object'))
 
-        # Convert dates to a more readable string format for display
-        return unique_dates_df['Date'].dt.strftime("%A %d %B %Y").tolist()
+    # Convert dates to a more readable string format for display
+    return unique_dates.dt.strftime("%A %d %B %Y").tolist()
 
 
 # Adjusted Function to Load Database Data Based on Selected Date
 @st.cache_data(ttl=3500, show_spinner='Loading data...')
 def load_db(selected_date_for_sql):
-    query = text("SELECT * FROM nmf_spotify_coverage WHERE \"Date\" = :date")
-    with engine.connect() as connection:
-        result = connection.execute(query, {'date': selected_date_for_sql})
-        columns = result.keys()
-        database_df = pd.DataFrame(result.fetchall(), columns=columns)
-    return database_df
+    summary, week_df = fetch_week(selected_date_for_sql, DEFAULT_MARKET)
+    # Releases and their playlists for "Search Adds By Song", built once per load rather than on every rerun
+    return summary, week_df, release_index(week_df)
 
 st.subheader('Explore past release coverage:')
 
@@ -57,33 +40,17 @@ selected_date_format = st.selectbox("Select a Friday", options=unique_dates)
 selected_date_for_sql = datetime.strptime(selected_date_format, "%A %d %B %Y").strftime("%Y-%m-%d")
 
 # Load data for the selected date
-df = load_db(selected_date_for_sql)
-
-# Function to load image from URL
-def load_image_from_url(url):
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            image = Image.open(BytesIO(response.content))
-            return image
-        else:
-            return None
-    except Exception as e:
-        print(f"Error loading image: {e}")
-        return None
-
-
-# Filter dataframe to get the row with the "New Music Friday AU & NZ" playlist
-nmf_image_series = df[df['Playlist'] == "New Music Friday AU & NZ"]['Image_URL']
+summary, df, (release_choices, release_rows) = load_db(selected_date_for_sql)
 
-# Extract the first image URL from the series
-nmf_image_url = nmf_image_series.iloc[0] if not nmf_image_series.empty else None
+# Image URL of the "New Music Friday AU & NZ" playlist cover
+nmf_image_url = summary['nmf_cover']['image_url'] if summary['nmf_cover'] else None
 
 col1, col2 = st.columns([3, 4])
 # Display the image with a specific width
 with col1:
     if nmf_image_url:
-        todays_cover_image = load_image_from_url(nmf_image_url)
+        # Cached thumbnail, downloaded once rather than on every visit
+        todays_cover_image = cover_image(nmf_image_url)
         if todays_cover_image:
             st.image(todays_cover_image, width=300)
         else:
@@ -118,20 +85,11 @@ st.markdown(
 # HIGHEST REACH METRIC 
 #######################
 
-# Group by 'Title' and sum the 'Followers' for each title
-title_followers = df.groupby('Title')['Followers'].sum()
-
-# Find the maximum followers count for a title
-max_followers = title_followers.max()
-
-# Find the title(s) with the maximum followers count
-title_with_max_followers = title_followers[title_followers == max_followers].index.tolist()
-
-# Filter to find the artist for the top title
-most_reach_title_df = df[df['Title'].isin(title_with_max_followers)].drop_duplicates(subset=['Title', 'Artist'])
+# Total reach of the release(s) with the highest reach
+max_followers = summary['highest_reach']['reach']
 
-# Sort artist names alphabetically
-sorted_artists_reach = sorted(most_reach_title_df['Artist'].tolist())
+# Sort artist names of those releases alphabetically
+sorted_artists_reach = sorted(artist for artist, _ in summary['highest_reach']['releases'])
 
 # Display the metric first
 with col2:
@@ -155,20 +113,11 @@ col2.write("")
 # MOST ADDED METRIC
 #######################
 
-# Group by 'Title' and count the occurrences
-title_counts = df.groupby('Title').size()
+# The max number of adds of a release
+max_adds = summary['most_added']['count']
 
-# Find the max number of adds
-max_adds = title_counts.max()
-
-# Find the title(s) with the max number of adds
-most_added_titles = title_counts[title_counts == max_adds].index.tolist()
-
-# Filter the original DataFrame to get the artist(s) for the most added title(s)
-most_added_artists_df = df[df['Title'].isin(most_added_titles)].drop_duplicates(subset=['Title', 'Artist'])
-
-# Sort artist names alphabetically
-sorted_artists = sorted(most_added_artists_df['Artist'].tolist())
+# Sort artist names of the most added release(s) alphabetically
+sorted_artists = sorted(artist for artist, _ in summary['most_added']['releases'])
 
 # Prepare the HTML string for artist names, with adjustments if there are multiple artists
 if len(sorted_artists) > 1:
@@ -195,25 +144,20 @@ with col2:
 # # HIGHEST AVERAGE PLAYLIST POSITION 
 # ####################################
 
-# Group by 'Artist' and find the average 'Position'
-avg_position_per_artist = df.groupby('Artist')['Position'].mean().reset_index(name='AvgPosition')
-
-# Find the minimum average position
-min_avg_position = avg_position_per_artist['AvgPosition'].min()
+# The minimum average position of a release
+min_avg_position = summary['highest_average_position']['position']
 
-# Filter to get the artist(s) with the minimum average position
-artists_with_lowest_avg_position = avg_position_per_artist[avg_position_per_artist['AvgPosition'] == min_avg_position]
+# Sort artist names of the release(s) with the minimum average position alphabetically
+sorted_artists = sorted(artist for artist, _ in summary['highest_average_position']['releases'])
 
 # Prepare the HTML string for artist names with adjustments if there are multiple artists
-if len(artists_with_lowest_avg_position) > 1:
-    # Sort artist names alphabetically
-    sorted_artists = sorted(artists_with_lowest_avg_position['Artist'].tolist())
+if len(sorted_artists) > 1:
     gap_reduction_html = "<div style='margin-top: -14px;'></div>"
     artist_names_html = gap_reduction_html + "<br>".join(f"<span style='font-size: 95%; line-height: 1;'>{artist}</span>" for artist in sorted_artists)
 else:
     # For a single artist, adjust for gap and use the name without additional HTML
     gap_reduction_html = "<div style='margin-top: -16px;'></div>"
-    artist_names_html = gap_reduction_html + f"<span style='font-size: 95%; line-height: 1;'>{artists_with_lowest_avg_position['Artist'].iloc[0]}</span>"
+    artist_names_html = gap_reduction_html + f"<span style='font-size: 95%; line-height: 1;'>{sorted_artists[0]}</span>"
 
 # Display the metric
 with col2:
@@ -241,24 +185,13 @@ st.write(
     unsafe_allow_html=True,
 )
 
-# Use latest_friday_df from earlier in the code
-top_artists_reach = df.groupby(['Artist', 'Title']).agg({
-    'Followers': 'sum',
-    'Playlist': lambda x: list(x.unique())  # Creates a list of unique playlists for each artist
-})
-
-# Sort the DataFrame based on 'Followers' while maintaining the whole DataFrame
-sorted_top_artists_reach = top_artists_reach.sort_values(by='Followers', ascending=False)
-
-# Select the top 5 artists while keeping all columns ('Followers' and 'Playlist')
-results_with_playlist = sorted_top_artists_reach.head(5).copy()
+# Top 5 releases by reach, with the list of unique playlists each was added to
+results_with_playlist = pd.DataFrame(summary['top_reach'], columns=['artist', 'title', 'followers', 'playlists']) \
+    .rename(columns={'artist': 'Artist', 'title': 'Title', 'followers': 'Followers', 'playlists': 'Playlist'})
 
 # Join the playlist names with '<br>' to create a single string with line breaks
 results_with_playlist['Playlists_str'] = results_with_playlist['Playlist'].apply(lambda x: '<br>'.join(x))
 
-# Ensure 'Artist' is a column for Plotly (if 'Artist' was the index)
-results_with_playlist = results_with_playlist.reset_index()
-
 # Combine 'Artist' and 'Title' into a unique identifier
 results_with_playlist['Artist_Title'] = results_with_playlist['Artist'] + ' - ' + results_with_playlist['Title']
 
@@ -318,33 +251,11 @@ st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
 
 st.subheader('Search Adds By Song:')
 
-# Combine Artist & Title for the first dropdown box: 
-# Use latest_friday_df from earlier in the code
-
-# Filter out rows where either 'Artist' or 'Title' is null for dropdown creation
-filtered_df_for_artist_title = df.dropna(subset=['Artist', 'Title'])
-
-# Temporarily create 'Artist_Title' in the filtered dataframe for dropdown options
-filtered_df_for_artist_title['Artist_Title'] = filtered_df_for_artist_title['Artist'] + " - " + filtered_df_for_artist_title['Title']
-
-# Ensure unique values and sort them for the dropdown
-choices = filtered_df_for_artist_title['Artist_Title'].unique()
-sorted_choices = sorted(choices, key=lambda x: x.lower())
+# Dropdown for user to select an artist and title, from the week's release index
+selected_artist_title = st.selectbox('Select Release:', release_choices)
 
-# Dropdown for user to select an artist and title
-selected_artist_title = st.selectbox('Select Release:', sorted_choices)
-
-# Add 'Artist_Title' to the original dataframe for filtering based on the dropdown selection
-df['Artist_Title'] = df.apply(lambda row: f"{row['Artist']} - {row['Title']}" if pd.notnull(row['Artist']) and pd.notnull(row['Title']) else None, axis=1)
-
-# Now filter the original DataFrame based on selection, this time it includes 'Artist_Title'
-filtered_df = df[df['Artist_Title'] == selected_artist_title].drop(columns=['Artist', 'Title', 'Artist_Title'])
-
-# Ensure 'Followers' is numeric for proper sorting
-filtered_df['Followers'] = pd.to_numeric(filtered_df['Followers'], errors='coerce')
-
-# Continue with sorting and displaying the data 
-ordered_filtered_df = filtered_df.sort_values(by='Followers', ascending=False)
+# The release's playlists, already ordered by 'Followers'
+ordered_filtered_df = pd.DataFrame(release_rows.get(selected_artist_title, []), columns=['Playlist', 'Position', 'Followers'])
 
 #### By removing this line, ordered_filtered_df['Followers'] remains in a numeric format, which should allow Streamlit to handle sorting properly when you click on the column headers in the displayed DataFrame.
 # # Before displaying, round 'Followers' to no decimal places and format
@@ -395,65 +306,14 @@ st.write("-----")
 st.subheader("Top 10 Performers:")
 st.write('Top weekly performers (by reach) across the available weeks (23.02.2024 onwards).')
 
-from sqlalchemy import text
-
 @st.cache_data(ttl=3500, show_spinner="Fetching Top Performers...") # cache for 3 days 
-def get_data(sql, _engine):
-    # Convert SQL query to a text object
-    query = text(sql)
-    with _engine.connect() as connection:
-        result = connection.execute(query)
-        # Manually construct the DataFrame from the result set
-        data_df = pd.DataFrame(result.fetchall(), columns=result.keys())
-    return data_df
-
-# Updated SQL query
-sql_query = """
-WITH TotalFollowers AS (
-  SELECT    
-    "Date",
-    "Artist",
-    "Title",
-    STRING_AGG(DISTINCT "Playlist", E'\n') AS playlists,
-    SUM("Followers") AS total_followers
-  FROM nmf_spotify_coverage
-  WHERE "Artist" IS NOT NULL AND "Title" IS NOT NULL AND "Followers" IS NOT NULL
-  GROUP BY "Date", "Artist", "Title"
-),
-RankedArtistsPerWeek AS (
-  SELECT
-    "Date",
-    "Artist",
-    "Title",
-    playlists,
-    total_followers,
-    RANK() OVER (PARTITION BY "Date" ORDER BY total_followers DESC) AS rank_within_week
-  FROM TotalFollowers
-),
-TopPerformersPerWeek AS (
-  SELECT
-    "Date",
-    "Artist",
-    "Title",
-    playlists,
-    total_followers
-  FROM RankedArtistsPerWeek
-  WHERE rank_within_week = 1
-),
-RankedTopPerformers AS (
-  SELECT
-    *,
-    RANK() OVER (ORDER BY total_followers DESC) AS overall_rank
-  FROM TopPerformersPerWeek
-)
-SELECT "Date", "Artist", "Title", playlists, total_followers
-FROM RankedTopPerformers
-WHERE overall_rank <= 10
-ORDER BY total_followers DESC;
-"""
-
-# retreive DataFrame from SQL query 
-df = get_data(sql_query, engine)
+def get_data():
+    # Top 10 weekly top performers across all weeks. The worker keeps each week's top release(s) in the
+    # top_performers table, so this reads at most a few rows off its index however many weeks there are.
+    return fetch_top_performers(DEFAULT_MARKET, 10)
+
+# retreive DataFrame 
+df = get_data()
 
 # Data preparation
 df['Artist/Title'] = df['Artist'] + " - '" + df['Title'] + "'"
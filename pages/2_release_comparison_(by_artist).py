@@ -1,15 +1,10 @@
 import streamlit as st
-import os
 import pandas as pd
 import plotly.express as px
-from sqlalchemy import create_engine, text
 import psycopg2
 
-DATABASE_URL = os.environ['DATABASE_URL']
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-
-engine = create_engine(DATABASE_URL)
+import data_access
+from database import DEFAULT_MARKET
 
 st.subheader('Release Comparison (By Artist):')
 st.write('Data available from 23rd Feb 2024 onwards')
@@ -20,17 +15,36 @@ st.markdown(
 st.write("Note: New playlists have been added on 7th June 2024. If a track was added to any of the newly tracked playlists prior to 7th June it won't show up in the comparison.")
 st.write('--------------')
 
-def fetch_all_for_selectbox():
-    query = text("""
-    SELECT "Date", "Artist", "Title", "Playlist", "Position", "Followers"
-    FROM nmf_spotify_coverage 
-    """)
-    with engine.connect() as connection:
-        result = connection.execute(query)
-        df = pd.DataFrame(result.fetchall(), columns=result.keys())
-    return df
-
-df = fetch_all_for_selectbox()
+# Time of the latest write by the worker - checked on every rerun, so it is kept to one tiny query
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_data_version():
+    return data_access.fetch_data_version(DEFAULT_MARKET)
+
+# Artist index for the selectbox: small and shared by every visitor
+@st.cache_data(ttl=3500, max_entries=4, show_spinner='Fetching artists...')
+def fetch_artists_for_selectbox(data_version):
+    # Artists with more than one release, kept up to date by the worker
+    return data_access.fetch_comparison_artists(DEFAULT_MARKET)
+
+# Only the selected artist's rows; the most recently selected artists stay cached
+@st.cache_data(ttl=3500, max_entries=200, show_spinner='Loading releases...')
+def fetch_artist_releases(artist_key, data_version):
+    # Coverage rows of every release the artist is credited on
+    return data_access.fetch_artist_releases(artist_key, DEFAULT_MARKET)
+
+# Data version the cached entries were loaded at, shared by every session of this process
+@st.cache_resource
+def cached_data_version():
+    return {'version': None}
+
+# Drop the cached artists and releases once new data lands, instead of keeping them until their ttl runs out
+data_version = fetch_data_version()
+cached = cached_data_version()
+if cached['version'] != data_version:
+    if cached['version'] is not None:
+        fetch_artists_for_selectbox.clear()
+        fetch_artist_releases.clear()
+    cached['version'] = data_version
 
 # Add this function definition before it's used
 def add_ordinal(day):
@@ -40,45 +54,15 @@ def add_ordinal(day):
         suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
     return f"{day}{suffix}"
 
-def correct_artist_name(name):
-    if name is None:
-        return name
-    special_cases = {
-        'charli xcx': 'Charli xcx',
-        # Add more special cases here
-    }
-    
-    lowercase_name = name.lower()
-    if lowercase_name in special_cases:
-        return special_cases[lowercase_name]
-    else:
-        return name  # Return the original name without modification
-
-# Split the 'Artist' column by ", " and then explode the DataFrame to normalize it
-df_normalized = df.assign(Artist=df['Artist'].str.split(', ')).explode('Artist')
-
-# Apply the correct stylization to artist names
-df_normalized['Artist_Corrected'] = df_normalized['Artist'].apply(correct_artist_name)
-
-# Group by the corrected artist name and count distinct titles 
-artist_title_counts = df_normalized.groupby('Artist_Corrected')['Title'].nunique()
-
-# Filter artists with more than one distinct title
-filtered_artists = artist_title_counts[artist_title_counts > 1]
-
-# Get the correct stylization for each artist
-select_box_options = df_normalized[df_normalized['Artist_Corrected'].isin(filtered_artists.index)]['Artist_Corrected'].unique()
-
-# Sort the list of artists alphabetically, ignoring case
-select_box_options_sorted = sorted(select_box_options, key=lambda x: x.lower())
+# Artist key -> correctly stylised name, sorted alphabetically ignoring case
+artist_names = fetch_artists_for_selectbox(data_version)
 
 # Populate a selectbox with the sorted artist names
-selected_artist = st.selectbox('Select Artist:', select_box_options_sorted)
+selected_artist = st.selectbox('Select Artist:', list(artist_names), format_func=artist_names.get)
 
 # Fetch and display data for the selected artist
 if selected_artist:
-    # Filtering the normalized dataframe for the selected artist (case-insensitive)
-    artist_data = df_normalized[df_normalized['Artist_Corrected'] == selected_artist]
+    artist_data = fetch_artist_releases(selected_artist, data_version)
 
     # Convert 'Date' from string to datetime format
     artist_data['Date'] = pd.to_datetime(artist_data['Date'])
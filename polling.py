@@ -0,0 +1,195 @@
+# Adaptive, change-driven polling for the scheduled data pull
+#
+# Instead of pulling at fixed times, the worker polls the snapshot IDs of the tracked playlists (one cheap call per
+# playlist) and only runs the full pull when one of them changed. Polls are frequent in the release windows and right
+# after a change, and back off when nothing has changed for a few cycles.
+import os
+import logging
+from datetime import timedelta
+
+import pytz
+
+from functions import MAX_WORKERS, fetch_playlists_concurrently, PlaylistCache, PLAYLIST_CACHE_DIR
+
+
+TIMEZONE = pytz.timezone('Australia/Sydney')
+
+# When the tracked playlists get updated, as (weekday, start hour, end hour) in Sydney time - Monday is 0.
+# New Music Friday lands just after midnight and editorial playlists keep changing into Friday afternoon,
+# the Monday refresh runs through the morning.
+RELEASE_WINDOWS = [(4, 0, 18), (0, 6, 15)]
+
+# Poll interval in the release windows and right after a change was seen
+POLL_ACTIVE_MINUTES = float(os.getenv('POLL_ACTIVE_MINUTES', '5'))
+
+# The backoff never grows past this during a release window
+POLL_WINDOW_MAX_MINUTES = float(os.getenv('POLL_WINDOW_MAX_MINUTES', '15'))
+
+# Poll interval the rest of the week, and the ceiling the backoff grows to
+POLL_BASE_MINUTES = float(os.getenv('POLL_BASE_MINUTES', '60'))
+POLL_MAX_MINUTES = float(os.getenv('POLL_MAX_MINUTES', '360'))
+
+# Number of unchanged polls before the interval starts doubling
+POLL_BACKOFF_AFTER = int(os.getenv('POLL_BACKOFF_AFTER', '3'))
+
+# Returned by the pull callable when it did not run because another worker was pulling
+PULL_SKIPPED = 'skipped'
+
+# Follower counts are not part of the snapshot ID, so pull at least this often even when nothing changed
+POLL_MAX_STALE_HOURS = float(os.getenv('POLL_MAX_STALE_HOURS', '24'))
+
+
+def in_release_window(now):
+    """
+    Checks whether `now` (a timezone-aware datetime) falls in one of the RELEASE_WINDOWS.
+    """
+    now = now.astimezone(TIMEZONE)
+    return any(now.weekday() == weekday and start <= now.hour < end for weekday, start, end in RELEASE_WINDOWS)
+
+
+def minutes_until_next_window(now):
+    """
+    Returns the number of minutes from `now` until the next release window opens.
+    """
+    now = now.astimezone(TIMEZONE)
+    starts = []
+    for weekday, start, _ in RELEASE_WINDOWS:
+        day = now + timedelta(days=(weekday - now.weekday()) % 7)
+        window_start = TIMEZONE.localize(day.replace(hour=start, minute=0, second=0, microsecond=0, tzinfo=None))
+        if window_start <= now:
+            window_start += timedelta(days=7)
+        starts.append(window_start)
+    return (min(starts) - now).total_seconds() / 60
+
+
+def fetch_snapshot_ids(sp, playlists_dict, max_workers=MAX_WORKERS):
+    """
+    Fetches only the snapshot ID of every playlist in `playlists_dict`.
+
+    Returns:
+    - dict: A dictionary mapping playlist names to their current snapshot ID.
+    """
+    def fetch(sp, playlist_id):
+        return sp.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+
+    return fetch_playlists_concurrently(fetch, sp, playlists_dict, max_workers)
+
+
+def changed_playlists(sp, playlists_dict, cache_dir=PLAYLIST_CACHE_DIR):
+    """
+    Compares the current snapshot IDs against the ones stored by the last pull.
+
+    Args:
+    - sp (spotipy.Spotify): An authenticated instance of the Spotipy client.
+    - playlists_dict (dict): A dictionary mapping playlist names to their Spotify IDs.
+    - cache_dir (str): Directory of the playlist cache written by the pull.
+
+    Returns:
+    - list: Names of the playlists that changed (or were never pulled) since the last pull.
+    """
+    cache = PlaylistCache(cache_dir)
+    snapshot_ids = fetch_snapshot_ids(sp, playlists_dict)
+    return [name for name, snapshot_id in snapshot_ids.items()
+            if cache.snapshot_id(playlists_dict[name]) != snapshot_id]
+
+
+class AdaptivePoller:
+    """
+    Decides after every poll whether to run the pull and how long to wait until the next poll.
+
+    A pull runs on the first poll, when a playlist changed, when a new week started, when the last pull failed or
+    was skipped and once the data is POLL_MAX_STALE_HOURS old.
+
+    Args:
+    - check (callable): Returns the names of the playlists that changed since the last pull.
+    - pull (callable): Runs the full data pull, given the reason it was triggered. Returns PULL_SKIPPED if it did not run.
+    - week_of (callable): Returns the week (upload date) a datetime belongs to.
+    - clock (callable): Returns the current timezone-aware datetime.
+    """
+
+    def __init__(self, check, pull, week_of, clock, active_minutes=POLL_ACTIVE_MINUTES,
+                 window_max_minutes=POLL_WINDOW_MAX_MINUTES, base_minutes=POLL_BASE_MINUTES, max_minutes=POLL_MAX_MINUTES,
+                 backoff_after=POLL_BACKOFF_AFTER, max_stale_hours=POLL_MAX_STALE_HOURS):
+        self.check = check
+        self.pull = pull
+        self.week_of = week_of
+        self.clock = clock
+        self.active_minutes = active_minutes
+        self.window_max_minutes = window_max_minutes
+        self.base_minutes = base_minutes
+        self.max_minutes = max_minutes
+        self.backoff_after = backoff_after
+        self.max_stale = timedelta(hours=max_stale_hours)
+
+        self.unchanged_polls = 0
+        self.last_pull = None
+        self.last_week = None
+        # 'failed' or 'skipped' while the last due pull has not run successfully
+        self.retry_reason = None
+
+    def pull_reason(self, now, changed):
+        """
+        Returns why a pull is due, or None if it is not.
+        """
+        if self.last_pull is None:
+            return 'first poll'
+        if self.retry_reason:
+            return f"retrying {self.retry_reason} pull"
+        if changed:
+            return f"{len(changed)} playlists changed: {', '.join(changed[:5])}"
+        if self.week_of(now) != self.last_week:
+            return 'new week'
+        if now - self.last_pull >= self.max_stale:
+            return 'data is stale'
+        return None
+
+    def next_interval(self, now):
+        """
+        Returns the number of minutes until the next poll.
+        """
+        releasing = in_release_window(now)
+        interval = self.active_minutes if releasing or self.unchanged_polls == 0 else self.base_minutes
+
+        # Double the interval for every unchanged poll past `backoff_after`
+        if self.unchanged_polls >= self.backoff_after:
+            interval *= 2 ** (self.unchanged_polls - self.backoff_after + 1)
+
+        # Back off less during a release window, and never sleep into the next one
+        ceiling = self.window_max_minutes if releasing else self.max_minutes
+        return max(min(interval, ceiling, minutes_until_next_window(now)), self.active_minutes)
+
+    def poll(self):
+        """
+        Runs one poll: checks the snapshot IDs, pulls if needed and returns the minutes until the next poll.
+        """
+        now = self.clock()
+        try:
+            changed = self.check()
+        except Exception as e:
+            logging.error(f"Snapshot check failed: {e}")
+            # Retry on the usual schedule, and soon during a release window
+            interval = self.next_interval(now)
+            return min(interval, self.active_minutes) if in_release_window(now) else interval
+
+        reason = self.pull_reason(now, changed)
+        if reason:
+            logging.info(f"Running data pull ({reason}).")
+            try:
+                result = self.pull(reason)
+            except Exception:
+                logging.exception("Data pull failed.")
+                self.retry_reason = 'failed'
+            else:
+                if result == PULL_SKIPPED:
+                    logging.info("Data pull skipped - another worker is pulling. Retrying on the next poll.")
+                    self.retry_reason = 'skipped'
+                else:
+                    self.retry_reason = None
+                    self.last_pull = now
+                    self.last_week = self.week_of(now)
+
+        self.unchanged_polls = 0 if changed else self.unchanged_polls + 1
+        interval = self.next_interval(now)
+        logging.info(f"{len(changed)} playlists changed, {self.unchanged_polls} unchanged polls in a row. "
+                     f"Next poll in {interval:g} minutes.")
+        return interval
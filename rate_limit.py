@@ -0,0 +1,201 @@
+# Rate-limit-aware scheduling for Spotify API calls made by the data pull
+import os
+import time
+import logging
+import threading
+
+from instrumentation import record
+
+
+# Requests per second the pull starts at, and the bounds the adaptive rate moves between
+DEFAULT_RATE = float(os.getenv('SPOTIFY_RATE', '5'))
+MAX_RATE = float(os.getenv('SPOTIFY_MAX_RATE', '20'))
+MIN_RATE = 0.5
+
+# Most API calls a single pull may make. A healthy pull of the tracked playlists needs well under 200.
+CALL_BUDGET = int(os.getenv('SPOTIFY_CALL_BUDGET', '1000'))
+
+
+class CallBudgetExceeded(Exception):
+    """Raised when a pull would go over its per-run API call budget."""
+
+
+def _retry_after_seconds(error, default=1.0):
+    """
+    Reads the Retry-After header (in seconds) of a 429 SpotifyException, falling back to `default` if it is not a
+    number.
+
+    Returns:
+    - float: Seconds to wait, or None if the error is not a rate limit: another status, or the 429 Spotipy raises
+      without headers once urllib3 ran out of retries ("Max Retries", whatever the failing status was).
+    """
+    headers = getattr(error, 'headers', None) or {}
+    if error.http_status != 429 or headers.get('Retry-After') is None:
+        return None
+    try:
+        return max(float(headers['Retry-After']), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class RequestScheduler:
+    """
+    Token-bucket throttle shared by every thread of a pull.
+
+    The fill rate adapts: it creeps up by `increase` requests/second after each successful call and is cut by
+    `decrease` after a 429, when every thread also waits out the response's Retry-After. Each pull gets its own
+    scheduler, so `call_budget` caps the calls of a single run.
+
+    Args:
+    - rate (float): Starting rate in requests per second.
+    - max_rate (float), min_rate (float): Bounds for the adaptive rate.
+    - burst (int): Bucket size - how many calls may go out back to back.
+    - call_budget (int, optional): Maximum number of calls; None for no limit.
+    - max_retries (int): How often a single call is retried after a 429 before the error is raised.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, max_rate=MAX_RATE, min_rate=MIN_RATE, burst=10, call_budget=CALL_BUDGET,
+                 max_retries=5, increase=0.2, decrease=0.5):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.call_budget = call_budget
+        self.max_retries = max_retries
+        self.increase = increase
+        self.decrease = decrease
+
+        self.calls = 0
+        self.retries = 0
+        # Wall-clock time during which at least one thread was held back
+        self.throttled_seconds = 0.0
+        self._waiting_threads = 0
+        self._wait_started = 0.0
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        """
+        Blocks until a request may be sent, then counts it against the budget.
+        """
+        waiting = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if waiting:
+                    self._end_wait(now)
+                    waiting = False
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        if self.call_budget is not None and self.calls >= self.call_budget:
+                            raise CallBudgetExceeded(f"Spotify call budget of {self.call_budget} calls exhausted")
+                        self._tokens -= 1
+                        self.calls += 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                self._start_wait(now)
+                waiting = True
+            time.sleep(wait)
+
+    # Called with the lock held. Waits of concurrent threads overlap, so only time with at least one waiting thread counts.
+    def _start_wait(self, now):
+        if self._waiting_threads == 0:
+            self._wait_started = now
+        self._waiting_threads += 1
+
+    def _end_wait(self, now):
+        self._waiting_threads -= 1
+        if self._waiting_threads == 0:
+            self.throttled_seconds += now - self._wait_started
+
+    def _on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def _on_rate_limited(self, retry_after):
+        with self._lock:
+            now = time.monotonic()
+            self.retries += 1
+            # The other fetch threads' requests were in flight when the first 429 came back and get 429s of their own.
+            # They belong to the same rate-limit window, so the rate is only cut once per pause.
+            if now < self._paused_until:
+                return
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._paused_until = now + retry_after
+            self._tokens = 0.0
+            self._updated = self._paused_until
+        logging.warning(f"Spotify rate limit hit, pausing {retry_after:.1f}s and slowing to {self.rate:.1f} requests/s")
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls `func(*args, **kwargs)` once the bucket allows it, retrying after 429 responses.
+
+        Raises:
+        - CallBudgetExceeded: If the run's call budget is used up.
+        - spotipy.SpotifyException: For errors other than a 429 with Retry-After, or a 429 that persists after
+          `max_retries` retries.
+        """
+        from spotipy.exceptions import SpotifyException
+
+        attempt = 0
+        while True:
+            self._acquire()
+            record(api_calls=1)
+            try:
+                result = func(*args, **kwargs)
+            except SpotifyException as e:
+                retry_after = _retry_after_seconds(e)
+                if retry_after is None or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                record(retries=1)
+                self._on_rate_limited(retry_after)
+                continue
+            self._on_success()
+            return result
+
+    def stats(self):
+        """
+        Returns the scheduler's counters for logging.
+        """
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'throttled_seconds': round(self.throttled_seconds, 2),
+                'rate': round(self.rate, 2),
+            }
+
+
+class RateLimitedSpotify:
+    """
+    Wraps a Spotipy client so that every public API method goes through a `RequestScheduler`.
+
+    The wrapped client should be built without 429 in its retry status codes (see `functions.get_spotify_client`),
+    otherwise urllib3 retries rate-limited requests itself and the scheduler never sees them.
+
+    Args:
+    - sp (spotipy.Spotify): The client to wrap.
+    - scheduler (RequestScheduler): The scheduler of the current run.
+    """
+
+    def __init__(self, sp, scheduler):
+        self._sp = sp
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self._sp, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def scheduled(*args, **kwargs):
+            return self.scheduler.call(attr, *args, **kwargs)
+
+        return scheduled